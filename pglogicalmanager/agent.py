@@ -0,0 +1,306 @@
+'''Long-running agent which runs CLI commands on warm connections.
+
+start-agent listens on a Unix socket, AGENT_SOCKET. While it runs, the CLI
+sends it each command instead of connecting itself, so a command costs no
+connection setup, TLS handshake or authentication, and catalogs fetched by
+recent commands are reused for catalog_ttl seconds.
+
+The protocol is one JSON line each way:
+
+    {"argv": ["list-subscriptions"], "cwd": "/home/lev", "dsns": ["postgres://...", "postgres://..."]}
+    {"output": "...", "exit_code": 0}
+
+The agent declines commands from a different directory or configuration
+with {"local": true}, and the CLI runs them itself.
+'''
+
+import io
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+import click
+import psycopg2
+import psycopg2.extensions
+
+from . import manager
+
+# Interactive, long-running or changing the configuration, so always run by the CLI itself.
+LOCAL_COMMANDS = {
+    'configure', 'reverse-configuration', 'reverse-subscription', 'rewind-replication-origin',
+    'record-replication-history', 'record-wal-usage', 'sync-standby-slots', 'recover-subscription',
+    'throttle-subscriptions', 'copy-tables', 'wait-for-subscription', 'sync-progress', 'apply',
+    'start-agent', 'stop-agent', 'version', 'benchmark-pgoutput',
+}
+
+
+def _dsns():
+    return [os.getenv('SOURCE_DB_DSN'), os.getenv('DEST_DB_DSN')]
+
+
+def _request(path, request):
+    '''Send a request to the agent and return its response, or None if no agent is listening.'''
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+            sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+
+            with sock.makefile('rb') as file:
+                line = file.readline()
+    except (ConnectionRefusedError, FileNotFoundError):
+        # Socket left behind by an agent that didn't exit cleanly.
+        return None
+
+    return json.loads(line) if line else None
+
+
+def _command(argv):
+    '''Name of the command in argv, after the options of main, e.g. --stats.'''
+    return next((arg for arg in argv if not arg.startswith('-')), None)
+
+
+def forward(argv, path=None):
+    '''Run a command on the agent. Returns its exit code, or None if the CLI should run it.'''
+    command = _command(argv)
+
+    if command is None or command in LOCAL_COMMANDS:
+        return None
+
+    response = _request(path or manager.AGENT_SOCKET, {'argv': argv, 'cwd': os.getcwd(), 'dsns': _dsns()})
+
+    if response is None or response.get('local'):
+        return None
+
+    sys.stdout.write(response['output'])
+    sys.stdout.flush()
+
+    return response['exit_code']
+
+
+def stop(path):
+    '''Stop the agent listening on path. Returns False if there is none.'''
+    return _request(path, {'stop': True}) is not None
+
+
+class _Output:
+    '''sys.stdout which writes to a per-thread buffer while a command runs, so commands can run concurrently.'''
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def _stream(self):
+        return getattr(self.local, 'buffer', None) or self.default
+
+    def write(self, text):
+        return self._stream().write(text)
+
+    def flush(self):
+        return self._stream().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream(), name)
+
+
+def _capture(buffer):
+    '''Send what this thread prints to buffer, or back to stdout if None.'''
+    if not isinstance(sys.stdout, _Output):
+        sys.stdout = _Output(sys.stdout)
+
+    sys.stdout.local.buffer = buffer
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+
+        if not line:
+            return
+
+        response = self.server.run(json.loads(line))
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+
+class Agent(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    '''Runs commands sent over a Unix socket, each on a pair of pooled connections.'''
+
+    daemon_threads = True
+
+    def __init__(self, path, pool_size=4, catalog_ttl=1.0):
+        self.path = path
+        self.pool_size = pool_size
+        self.catalog_ttl = catalog_ttl
+        self.cwd = os.getcwd()
+        self.dsns = _dsns()
+        self.pool = queue.LifoQueue() # Most recently used first, so idle connections stay idle
+        self.refreshed = {}
+
+        if os.path.exists(path):
+            if _request(path, {'ping': True}) is not None:
+                raise OSError(f'An agent is already listening on {path}.')
+
+            os.unlink(path)
+
+        # The agent connects as a superuser, only let this user talk to it. Set at bind,
+        # so there is no moment where the socket is open to anyone.
+        umask = os.umask(0o177)
+
+        try:
+            super().__init__(path, _Handler)
+        finally:
+            os.umask(umask)
+
+    def connect(self):
+        '''Open a pair of connections, both at once.'''
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(manager._connect, dsn) for dsn in self.dsns]
+
+        try:
+            connections = tuple(future.result() for future in futures)
+        except Exception:
+            # Don't leak the one that did connect.
+            for future in futures:
+                if future.exception() is None:
+                    future.result().close()
+            raise
+
+        self.refreshed[connections] = monotonic()
+
+        return connections
+
+    def checkout(self):
+        try:
+            connections = self.pool.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+        # Catalogs may have been changed by someone else since they were fetched.
+        if monotonic() - self.refreshed[connections] > self.catalog_ttl:
+            for conn in connections:
+                manager._invalidate_catalogs(conn)
+
+            self.refreshed[connections] = monotonic()
+
+        return connections
+
+    def checkin(self, connections):
+        '''Return connections to the pool, unless they are broken or the pool is full.'''
+        for conn in connections:
+            if conn.closed or conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                return self.discard(connections)
+
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+
+        if self.pool.qsize() >= self.pool_size:
+            return self.discard(connections)
+
+        self.pool.put(connections)
+
+    def discard(self, connections):
+        self.refreshed.pop(connections, None)
+
+        for conn in connections:
+            manager._invalidate_catalogs(conn)
+            manager._connection_dsns.pop(conn, None)
+
+            if not conn.closed:
+                conn.close()
+
+    def run(self, request):
+        if request.get('ping'):
+            return {'pid': os.getpid()}
+
+        if request.get('stop'):
+            threading.Thread(target=self.shutdown).start()
+            return {'stopped': True}
+
+        if request['cwd'] != self.cwd or request['dsns'] != self.dsns:
+            return {'local': True}
+
+        output = io.StringIO()
+        _capture(output)
+        started = monotonic()
+
+        try:
+            try:
+                connections = self.checkout()
+            except (psycopg2.Error, manager.NotSuperUserError, manager.BelowMinimumVersion) as e:
+                print(f'Agent could not connect to source/destination DB: {e}')
+                exit_code = 1
+            else:
+                manager._agent_connections.connections = connections
+
+                try:
+                    exit_code = _invoke(request['argv'])
+                finally:
+                    manager._agent_connections.connections = None
+                    self.checkin(connections)
+        finally:
+            _capture(None)
+
+        print(f'{" ".join(request["argv"])}: exit code {exit_code} in {round((monotonic() - started) * 1000, 1)} ms')
+
+        return {'output': output.getvalue(), 'exit_code': exit_code}
+
+    def serve(self):
+        '''Serve until stop-agent or Ctrl-C.'''
+        # Fail now, not on the first command, if the configuration is wrong.
+        try:
+            self.checkin(self.connect())
+        except (psycopg2.Error, manager.NotSuperUserError, manager.BelowMinimumVersion) as e:
+            self.server_close()
+            os.unlink(self.path)
+            raise click.ClickException(f'Agent could not connect to source/destination DB: {e}')
+
+        print(f'Agent listening on {self.path}. Source (primary): {self.dsns[0]}, destination (replica): {self.dsns[1]}')
+
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server_close()
+
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+            while not self.pool.empty():
+                self.discard(self.pool.get_nowait())
+
+            if isinstance(sys.stdout, _Output):
+                sys.stdout = sys.stdout.default
+
+
+def _invoke(argv):
+    '''Run a command the way the CLI would. Returns its exit code.'''
+    try:
+        result = manager.main.main(args=argv, prog_name='pglogicalmanager', standalone_mode=False)
+    except click.ClickException as e:
+        e.show(file=sys.stdout)
+        return e.exit_code
+    except click.Abort:
+        print('Aborted!')
+        return 1
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+
+        print(e.code)
+        return 1
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+        return 1
+
+    # Exit code of --help and friends, None for commands.
+    return result if isinstance(result, int) else 0
@@ -0,0 +1,125 @@
+'''Append-only history of replication positions, used to find rewind targets.
+
+Every subscription gets its own file of fixed-width records:
+
+    timestamp (float64, seconds since epoch), slot confirmed_flush_lsn (uint64), origin remote_lsn (uint64)
+
+Records are appended in time order, so the file is its own index: finding
+the position at a point in time is a binary search over the records.
+'''
+
+import mmap
+import os
+import re
+import struct
+
+RECORD = struct.Struct('<dQQ')
+
+# InvalidXLogRecPtr, used when the position is not known (e.g. NULL confirmed_flush_lsn).
+INVALID_LSN = 0
+
+_DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def lsn_to_int(lsn):
+    '''Convert a textual LSN, e.g. 0/16EDE8A0, to its 64-bit integer value.'''
+    if lsn is None:
+        return INVALID_LSN
+
+    high, low = lsn.split('/')
+
+    return (int(high, 16) << 32) | int(low, 16)
+
+
+def int_to_lsn(value):
+    '''Convert a 64-bit integer to the textual LSN format.'''
+    if value == INVALID_LSN:
+        return None
+
+    return f'{value >> 32:X}/{value & 0xFFFFFFFF:X}'
+
+
+def parse_duration(duration):
+    '''Parse a duration like 90s, 10m, 2h or 1d into seconds.'''
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*', duration)
+
+    if match is None:
+        raise ValueError(f'Invalid duration: {duration}. Examples: 90s, 10m, 2h, 1d.')
+
+    value, unit = match.groups()
+
+    return float(value) * _DURATION_UNITS[unit or 's']
+
+
+class History:
+    '''History file of one subscription.'''
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def for_subscription(cls, directory, subscription):
+        return cls(os.path.join(directory, f'{subscription}.history'))
+
+    def append(self, timestamp, slot_lsn, origin_lsn):
+        '''Append one sample. Timestamps never go backwards, so the file stays sorted.'''
+        directory = os.path.dirname(self.path)
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(self.path, 'a+b') as file:
+            size = file.seek(0, os.SEEK_END)
+
+            # Drop a partial record left by a crash in the middle of a write.
+            if size % RECORD.size != 0:
+                size -= size % RECORD.size
+                file.truncate(size)
+
+            if size > 0:
+                file.seek(size - RECORD.size)
+                last_timestamp = RECORD.unpack(file.read(RECORD.size))[0]
+                timestamp = max(timestamp, last_timestamp)
+                file.seek(0, os.SEEK_END)
+
+            file.write(RECORD.pack(timestamp, slot_lsn, origin_lsn))
+
+    def records(self, last=None):
+        '''All records, or the last ones, oldest first. Only the records returned are read.'''
+        with open(self.path, 'rb') as file:
+            count = file.seek(0, os.SEEK_END) // RECORD.size
+            first = max(count - last, 0) if last is not None else 0
+
+            file.seek(first * RECORD.size)
+            data = file.read((count - first) * RECORD.size)
+
+        count = len(data) // RECORD.size
+
+        return [RECORD.unpack_from(data, i * RECORD.size) for i in range(count)]
+
+    def at(self, timestamp):
+        '''Most recent record taken at or before timestamp, or None.'''
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < RECORD.size:
+            return None
+
+        with open(self.path, 'rb') as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return _search(data, len(data) // RECORD.size, timestamp)
+
+
+def _search(data, count, timestamp):
+    '''Binary search for the last record with a timestamp <= timestamp.'''
+    low, high = 0, count
+
+    while low < high:
+        middle = (low + high) // 2
+
+        if RECORD.unpack_from(data, middle * RECORD.size)[0] <= timestamp:
+            low = middle + 1
+        else:
+            high = middle
+
+    if low == 0:
+        return None
+
+    return RECORD.unpack_from(data, (low - 1) * RECORD.size)
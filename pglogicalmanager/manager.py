@@ -2,13 +2,30 @@
 
 import psycopg2
 import psycopg2.extras  # DictCursor
+import psycopg2.extensions  # connection, TRANSACTION_STATUS_IDLE
+import psycopg2.errors  # UniqueViolation, ...
 import colorama
 from colorama import Fore, Style  # Colors in terminal
 from prettytable import PrettyTable  # Pretty table output
-from time import sleep
+from time import sleep, monotonic, perf_counter, time
 import click
 from dotenv import load_dotenv
 import os
+import re
+import json
+import heapq
+import select
+import socket
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from .history import History, lsn_to_int, int_to_lsn, parse_duration
+from .wait import wait_for, WaitTimeout
+from . import wal_usage
+from . import throttle
+from . import pgoutput
 
 __author__ = 'Lev Kokotov <lev.kokotov@instacart.com>'
 __version__ = '0.4.3'
@@ -19,33 +36,498 @@ load_dotenv()
 # Cross-platform colors!
 colorama.init()
 
+# DSNs connections were opened with. connection.dsn hides the password, which
+# extra connections to the same server need.
+_connection_dsns = {}
+
+# Catalog rows prefetched by _ensure_connected, per connection. Dropped when the tool changes the catalog.
+_catalogs = {}
+
+# Where record-replication-history keeps its files.
+HISTORY_DIR = os.getenv('REPLICATION_HISTORY_DIR', './.replication_history')
+
+# Where record-wal-usage keeps its files, and how much WAL slots may retain before forecast-wal-usage alerts.
+WAL_USAGE_DIR = os.getenv('WAL_USAGE_DIR', './.wal_usage')
+WAL_BUDGET = os.getenv('WAL_BUDGET', '50GB')
+
+# Who takes locks, shown in list-locks.
+LOCK_HOLDER = os.getenv('LOCK_HOLDER') or f'{os.getenv("USER", "unknown")}@{socket.gethostname()}:{os.getpid()}'
+
+# Where start-agent listens for commands.
+AGENT_SOCKET = os.getenv('AGENT_SOCKET', './.pglogicalmanager.sock')
+
+# Connections the agent lent to the command running in this thread, see agent.py.
+_agent_connections = threading.local()
+
+# Connections the command running in this thread uses, with their query counters when it got them, see --stats.
+_query_stats = threading.local()
+
 
 def _debug(query):
     print(Fore.BLUE, '\bpsql: ', query, Style.RESET_ALL)
 
 
-def _lock_key():
-    return int(''.join(map(lambda x: str(ord(x) % 7), list('pg-logical-manager'))))
+def _full_dsn(conn):
+    '''DSN of conn, including the password.'''
+    return _connection_dsns.get(conn, conn.dsn)
+
+
+def _quote_ident(name):
+    '''Quote an identifier, always, like psycopg2's quote_ident, but without a connection.'''
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _quote_table(table):
+    '''Quote a table name, optionally schema-qualified, e.g. public.events.'''
+    return '.'.join(_quote_ident(part) for part in table.split('.'))
+
+
+def _table_spec(spec):
+    '''Render a publication table, which is either a table name or a dict with
+    a name and optionally a list of columns and a row filter (where).'''
+    if isinstance(spec, str):
+        spec = {'name': spec}
+
+    sql = _quote_table(spec['name'])
+
+    if spec.get('columns'):
+        sql += ' (' + ', '.join(_quote_ident(column) for column in spec['columns']) + ')'
+    if spec.get('where'):
+        sql += f' WHERE ({spec["where"]})'
+
+    return sql
+
+
+def _check_table_specs(conn, specs):
+    '''Row filters and column lists need PG 15+.'''
+    for spec in specs:
+        if isinstance(spec, dict) and (spec.get('columns') or spec.get('where')) and conn.server_version < 150000:
+            raise UnsupportedFeature(conn.dsn, conn.server_version, 'Publication row filters and column lists', 15)
+
+
+# Minimum version of the publisher and of the subscriber for subscription options. None: up to the subscriber alone.
+SUBSCRIPTION_OPTION_VERSIONS = {
+    'streaming': (14, 14),
+    'binary': (14, 14),
+    'disable_on_error': (None, 15),
+    'failover': (17, 17),
+}
+
+# Parallel apply of streamed transactions is the subscriber's. With an older publisher, it applies them like streaming = on.
+PARALLEL_STREAMING_VERSIONS = (14, 16)
+
+
+def _resolve_streaming(streaming, src_version, dest_version):
+    '''Turn streaming = auto into the best mode supported by the servers, or None if there is none.'''
+    if streaming != 'auto':
+        return streaming
+    if src_version >= 140000 and dest_version >= 160000:
+        return 'parallel'
+    if min(src_version, dest_version) >= 140000:
+        return 'on'
+    return None
+
+
+def _subscription_options(src, dest, streaming=None, binary=None, disable_on_error=None, failover=None):
+    '''Render subscription options that were set, checking the servers that need them support them.
+
+    streaming can be off, on, parallel or auto, i.e. the best the servers support.'''
+    streaming = _resolve_streaming(streaming, src.server_version, dest.server_version)
+
+    options = {
+        'streaming': streaming,
+        'binary': str(binary).lower() if binary is not None else None,
+        'disable_on_error': str(disable_on_error).lower() if disable_on_error is not None else None,
+        'failover': str(failover).lower() if failover is not None else None,
+    }
+    options = {option: value for option, value in options.items() if value is not None}
+
+    for option, value in options.items():
+        minimums = PARALLEL_STREAMING_VERSIONS if (option, value) == ('streaming', 'parallel') else SUBSCRIPTION_OPTION_VERSIONS[option]
+
+        for conn, minimum in zip((src, dest), minimums):
+            if minimum is not None and conn.server_version < minimum * 10000:
+                raise UnsupportedFeature(conn.dsn, conn.server_version, f'{option} = {value}', minimum)
+
+    return [f'{option} = {value}' for option, value in options.items()]
+
+
+def _lock_key(kind, name):
+    '''Key of the lock on one object, e.g. subscription/test_sub, so operations on other objects can run alongside.'''
+    return f'{kind}/{name}'
+
+
+# Locks taken by the tool, a row per locked object, on every server it locks.
+# UNLOGGED tables can't be published or streamed to standbys, so every server keeps its own.
+# The schema is the tool's own, and left out of the catalogs of user tables.
+_LOCKS_TABLE = '''CREATE SCHEMA IF NOT EXISTS pglogicalmanager;
+    CREATE UNLOGGED TABLE IF NOT EXISTS pglogicalmanager.locks (
+        object text PRIMARY KEY,
+        holder text NOT NULL,
+        pid integer NOT NULL,
+        acquired_at timestamptz NOT NULL)'''
+
+
+def _create_locks_table(conn):
+    '''Create the lock table. IF NOT EXISTS still fails when two operators create it at the same time, and one of them did.'''
+    try:
+        _execute(conn, [_LOCKS_TABLE])
+    except (psycopg2.errors.UniqueViolation, psycopg2.errors.DuplicateObject, psycopg2.errors.DuplicateTable,
+            psycopg2.errors.DuplicateSchema):
+        pass
+
+
+def _lock(conn, key):
+    '''Take the lock on key, in one round trip once the lock table exists.
+
+    The lock is held by this connection until it's released, or the
+    connection is gone, e.g. after a crash, however long the holder works.
+    A holder that hangs keeps it, see release-lock. Returns whether the lock was taken.'''
+    query = '''INSERT INTO pglogicalmanager.locks AS l (object, holder, pid, acquired_at)
+        VALUES (%s, %s, pg_backend_pid(), now())
+        ON CONFLICT (object) DO UPDATE SET holder = excluded.holder, pid = excluded.pid, acquired_at = excluded.acquired_at
+        WHERE l.pid = excluded.pid
+            OR NOT EXISTS (SELECT 1 FROM pg_stat_activity a WHERE a.pid = l.pid AND a.backend_start <= l.acquired_at)
+        RETURNING holder'''
+    params = (key, LOCK_HOLDER)
+
+    _debug(query)
+
+    try:
+        return len(_poll(conn, query, params)) > 0
+    except (psycopg2.errors.UndefinedTable, psycopg2.errors.InvalidSchemaName):
+        _create_locks_table(conn)
+
+        return len(_poll(conn, query, params)) > 0
+
+
+def _unlock(conn, key):
+    '''Release the lock on key, if this connection holds it.'''
+    query = 'DELETE FROM pglogicalmanager.locks WHERE object = %s AND pid = pg_backend_pid() RETURNING object'
+
+    _debug(query)
+    _poll(conn, query, (key,))
+
+
+# Catalogs that can be prefetched, by name.
+CATALOG_QUERIES = {
+    'replication_slots': 'SELECT * FROM pg_replication_slots',
+    'publications': 'SELECT * FROM pg_publication',
+    'subscriptions': 'SELECT * FROM pg_subscription',
+    # Subscriptions name their origin pg_<subscription oid>.
+    'replication_origins': '''SELECT o.roident, o.roname, os.remote_lsn, os.local_lsn, s.subname, s.subslotname
+        FROM pg_replication_origin o
+        LEFT JOIN pg_replication_origin_status os ON os.local_id = o.roident
+        LEFT JOIN pg_subscription s ON o.roname = 'pg_' || s.oid
+        ORDER BY o.roident''',
+    # Partitions are listed under their partitioned table.
+    'tables': '''SELECT t.*, c.relkind = 'p' AS partitioned
+        FROM pg_tables t
+        JOIN pg_namespace n ON n.nspname = t.schemaname
+        JOIN pg_class c ON c.relnamespace = n.oid AND c.relname = t.tablename
+        WHERE t.schemaname = 'public' AND NOT c.relispartition''',
+    'columns': "SELECT table_name, column_name, data_type FROM information_schema.columns WHERE table_schema = 'public' ORDER BY column_name",
+    'wal_lsn': 'SELECT pg_current_wal_lsn()',
+    # Tables as added to publications: partitioned tables, not their partitions as in pg_publication_tables.
+    # Column lists and row filters are PG 15+, read through to_jsonb so the query runs on older versions too.
+    'publication_tables': '''SELECT p.pubname, n.nspname || '.' || c.relname AS table_name,
+        (SELECT array_agg(a.attname ORDER BY a.attnum) FROM pg_attribute a
+            WHERE a.attrelid = r.prrelid AND a.attnum::text = ANY(string_to_array(to_jsonb(r) ->> 'prattrs', ' '))) AS columns,
+        (SELECT to_jsonb(t) ->> 'rowfilter' FROM pg_publication_tables t
+            WHERE t.pubname = p.pubname AND t.schemaname = n.nspname AND t.tablename = c.relname) AS row_filter
+        FROM pg_publication_rel r
+        JOIN pg_publication p ON p.oid = r.prpubid
+        JOIN pg_class c ON c.oid = r.prrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace''',
+    # Every leaf partition, with the partitioned table at the top of its hierarchy.
+    'partitions': '''WITH RECURSIVE tree AS (
+            SELECT c.oid AS root, c.oid AS relid FROM pg_class c WHERE c.relkind = 'p' AND NOT c.relispartition
+            UNION ALL
+            SELECT tree.root, i.inhrelid FROM tree JOIN pg_inherits i ON i.inhparent = tree.relid)
+        SELECT rn.nspname AS root_schema, r.relname AS root, ln.nspname AS schemaname, l.relname
+        FROM tree
+        JOIN pg_class r ON r.oid = tree.root
+        JOIN pg_namespace rn ON rn.oid = r.relnamespace
+        JOIN pg_class l ON l.oid = tree.relid
+        JOIN pg_namespace ln ON ln.oid = l.relnamespace
+        WHERE l.relkind = 'r' ORDER BY 1, 2, 3, 4''',
+    # Replica identity, keys and update/delete rate of every user table. Rates are since statistics were reset.
+    'replica_identity': '''SELECT n.nspname AS schemaname, c.relname, c.relreplident, c.relpersistence,
+        EXISTS (SELECT 1 FROM pg_index i WHERE i.indrelid = c.oid AND i.indisprimary) AS has_primary_key,
+        EXISTS (SELECT 1 FROM pg_index i WHERE i.indrelid = c.oid AND i.indisreplident AND i.indisvalid) AS has_identity_index,
+        (SELECT count(*) FROM pg_index i WHERE i.indrelid = c.oid AND i.indisvalid) AS indexes,
+        pg_total_relation_size(c.oid) AS total_size,
+        (coalesce(s.n_tup_upd, 0) + coalesce(s.n_tup_del, 0)) / greatest(extract(epoch FROM now() - coalesce(
+            (SELECT stats_reset FROM pg_stat_database WHERE datname = current_database()), pg_postmaster_start_time())), 1) AS write_rate
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+        WHERE c.relkind = 'r' AND n.nspname NOT LIKE 'pg_toast%' AND n.nspname NOT IN ('pg_catalog', 'information_schema', 'pglogicalmanager')''',
+    # Every index on user tables, with names quoted for scripts.
+    'indexes': '''SELECT n.nspname AS schemaname, t.relname, c.relname AS indexname,
+        quote_ident(n.nspname) || '.' || quote_ident(t.relname) AS quoted_table,
+        quote_ident(n.nspname) || '.' || quote_ident(c.relname) AS quoted_index, quote_ident(c.relname) AS quoted_name,
+        i.indisprimary, i.indisreplident, i.indisunique, i.indisvalid, pg_get_indexdef(i.indexrelid) AS indexdef
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_class t ON t.oid = i.indrelid
+        JOIN pg_namespace n ON n.oid = t.relnamespace
+        WHERE t.relkind = 'r' AND n.nspname NOT LIKE 'pg_toast%' AND n.nspname NOT IN ('pg_catalog', 'information_schema', 'pglogicalmanager')''',
+}
+
+# Catalogs read by commands working on a subscription.
+SUBSCRIPTION_CATALOGS = {'src': ('replication_slots', 'publications'), 'dest': ('subscriptions',)}
+
+_SUPERUSER_QUERY = '''(SELECT usesuper FROM pg_user WHERE usename = CURRENT_USER)
+    OR EXISTS (SELECT 1 FROM pg_auth_members m JOIN pg_roles r ON r.oid = m.roleid
+        WHERE r.rolname = 'rds_superuser' AND m.member = (SELECT "oid" FROM pg_roles WHERE rolname = CURRENT_USER))'''
+
+
+def _catalog(conn, name):
+    '''Rows of a catalog, from the prefetched copy if there is one.'''
+    cached = _catalogs.get(conn, {}).get(name)
+
+    if cached is not None:
+        return cached
+
+    cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cursor.execute(CATALOG_QUERIES[name])
+
+    return cursor.fetchall()
+
+
+def _catalog_rows(conn, name, column, value):
+    '''Rows of a catalog where column = value.
+
+    Prefetched catalogs are indexed by column the first time they are looked
+    up by it, so looking up every subscription's slot is linear, not quadratic.'''
+    cached = _catalogs.get(conn, {})
+
+    if name not in cached:
+        return [row for row in _catalog(conn, name) if row[column] == value]
+
+    index = cached.get((name, column))
+
+    if index is None:
+        index = cached[(name, column)] = {}
+
+        for row in cached[name]:
+            index.setdefault(row[column], []).append(row)
+
+    return index.get(value, [])
+
+
+def _catalog_row(conn, name, column, value):
+    '''First row of a catalog where column = value, or None.'''
+    rows = _catalog_rows(conn, name, column, value)
+
+    return rows[0] if len(rows) > 0 else None
+
+
+def _invalidate_catalogs(conn):
+    '''Forget prefetched catalogs after changing them.'''
+    _catalogs.pop(conn, None)
+
+
+# Statements sent by _execute, the round trips they took and how many that saved.
+_round_trips = {'statements': 0, 'round_trips': 0, 'saved': 0}
+_round_trips_lock = threading.Lock() # The agent runs commands in parallel
+
+
+def _execute(conn, queries, params=None):
+    '''Run one or more statements in a single round trip.
 
+    They are sent as one multi-statement string, which Postgres runs as one
+    implicit transaction, so they succeed or fail together. Statements that
+    can't run in a transaction block (e.g. REFRESH PUBLICATION) must be sent
+    on their own. A single statement with no transaction to flush saves
+    nothing, and isn't reported.'''
+    round_trips = 1
+
+    # Flush all existing transactions
+    if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        conn.rollback()
+        round_trips += 1
+
+    cursor = conn.cursor()
+    query = '; '.join(queries)
+
+    if params is not None:
+        query = cursor.mogrify(query, params).decode('utf-8')
+
+    _debug(query)
+
+    autocommit = conn.autocommit
+    conn.autocommit = True
+
+    try:
+        cursor.execute(query)
+    finally:
+        conn.autocommit = autocommit
+        _invalidate_catalogs(conn)
+
+    saved = len(queries) - round_trips
+
+    with _round_trips_lock:
+        _round_trips['statements'] += len(queries)
+        _round_trips['round_trips'] += round_trips
+        _round_trips['saved'] += max(saved, 0)
+
+    if saved > 0:
+        print(Fore.BLUE, f'\b{len(queries)} statement(s) in {round_trips} round trip(s), {saved} saved.', Style.RESET_ALL)
+
+
+class _StatsConnection(psycopg2.extensions.connection):
+    '''Connection counting the queries sent on it, and the time spent waiting for them.'''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queries = 0
+        self.query_time = 0.0
+
+    def cursor(self, *args, cursor_factory=None, **kwargs):
+        return super().cursor(*args, cursor_factory=_counting_cursor(cursor_factory or self.cursor_factory or psycopg2.extensions.cursor),
+                              **kwargs)
+
+
+class _CountingCursor:
+    def execute(self, query, params=None):
+        started = perf_counter()
+
+        try:
+            return super().execute(query, params)
+        finally:
+            self.connection.queries += 1
+            self.connection.query_time += perf_counter() - started
+
+
+_counting_cursors = {}
+
+
+def _counting_cursor(factory):
+    '''factory, e.g. DictCursor, counting its queries on its connection.'''
+    if factory not in _counting_cursors:
+        _counting_cursors[factory] = type(f'Counting{factory.__name__}', (_CountingCursor, factory), {})
+
+    return _counting_cursors[factory]
+
+
+def _track(conn, name, counters=None):
+    '''Count queries on conn from now on, or from counters, e.g. (0, 0.0) since it connected, for --stats.'''
+    if counters is None:
+        counters = (getattr(conn, 'queries', 0), getattr(conn, 'query_time', 0.0))
+
+    if getattr(_query_stats, 'connections', None) is None:
+        _query_stats.connections = {}
+
+    _query_stats.connections.setdefault(conn, (name, counters))
+
+
+def _show_stats():
+    '''Queries the command sent to each server, and how long it waited for them.'''
+    connections = getattr(_query_stats, 'connections', None) or {}
+
+    print(Fore.GREEN)
+    print('\nQueries\n')
+
+    table = PrettyTable(['Server', 'Queries', 'Time'])
+    total_queries, total_time = 0, 0.0
+
+    for conn, (name, (queries, query_time)) in connections.items():
+        queries = getattr(conn, 'queries', queries) - queries
+        query_time = getattr(conn, 'query_time', query_time) - query_time
+        total_queries += queries
+        total_time += query_time
+        table.add_row([name, queries, f'{query_time * 1000:.1f} ms'])
+
+    table.add_row(['Total', total_queries, f'{total_time * 1000:.1f} ms'])
+
+    print(table)
+    print(Style.RESET_ALL)
+
+
+def _catalog_columns(catalogs):
+    '''Every catalog as a JSON array, so one row carries all of them.'''
+    return [f"(SELECT coalesce(json_agg(c), '[]') FROM ({CATALOG_QUERIES[name]}) c) AS {name}" for name in catalogs]
+
+
+def _connect(dsn, catalogs=()):
+    '''Connect, check the user is a superuser and prefetch catalogs, all in one query.'''
+    conn = psycopg2.connect(dsn, connect_timeout=5, connection_factory=_StatsConnection)
+
+    # Callers that keep running, like the agent, would leak a connection that fails the checks.
+    try:
+        if conn.server_version < 100000:
+            raise BelowMinimumVersion(conn.dsn, conn.server_version)
+
+        columns = [f'{_SUPERUSER_QUERY} AS superuser'] + _catalog_columns(catalogs)
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+
+        # No BEGIN round trip, and the connection is left idle for _execute.
+        conn.autocommit = True
+        cursor.execute('SELECT ' + ', '.join(columns))
+        row = cursor.fetchone()
+        conn.autocommit = False
+
+        if not row['superuser']:
+            raise NotSuperUserError(conn.dsn)
+    except Exception:
+        conn.close()
+        raise
+
+    _connection_dsns[conn] = dsn
+    _catalogs[conn] = {name: row[name] for name in catalogs}
+
+    return conn
+
+
+def _prefetch(conn, catalogs):
+    '''Fetch the catalogs that aren't cached for conn yet, in one query.'''
+    cached = _catalogs.setdefault(conn, {})
+    missing = [name for name in catalogs if name not in cached]
+
+    if not missing:
+        return
 
-def _lock(conn):
-    key = _lock_key()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    query = "SELECT pg_try_advisory_lock(%s)"
 
-    _debug(cursor.mogrify(query, (key,)).decode('utf-8'))
-    cursor.execute(query, (key,))
+    conn.autocommit = True
+    cursor.execute('SELECT ' + ', '.join(_catalog_columns(missing)))
+    row = cursor.fetchone()
+    conn.autocommit = False
+
+    cached.update({name: row[name] for name in missing})
 
-    return cursor.fetchone()['pg_try_advisory_lock']
 
+def _poll(conn, query, params=None):
+    '''Run a query in its own transaction, so every poll sees the current state.'''
+    if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        conn.rollback()
 
-def _unlock(conn):
-    key = _lock_key()
     cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    query = "SELECT pg_advisory_unlock(%s)"
+    autocommit = conn.autocommit
+    conn.autocommit = True
+
+    try:
+        cursor.execute(query, params)
+        return cursor.fetchall()
+    finally:
+        conn.autocommit = autocommit
+
+
+def _wait(check, description, timeout=60.0, show=None, **backoff):
+    '''wait_for, printing what it's waiting for every few seconds. show(value) adds details, e.g. the lag.'''
+    printed = []
+
+    def progress(value, elapsed):
+        if len(printed) > 0 and elapsed - printed[-1] < 5.0:
+            return
+
+        printed.append(elapsed)
+        details = f', {show(value)}' if show is not None else ''
+        print(Fore.BLUE, f'\bWaiting for {description}{details} ({round(elapsed)}s)...', Style.RESET_ALL)
 
-    _debug(cursor.mogrify(query, (key,)).decode('utf-8'))
-    cursor.execute(query, (key,))
+    return wait_for(check, description, timeout=timeout, progress=progress, **backoff)
 
 
 def _superuser(conn):
@@ -93,6 +575,18 @@ class BelowMinimumVersion(Exception):
         self.server_version = server_version
 
 
+class UnsupportedFeature(Exception):
+    def __init__(self, dsn, server_version, feature, minimum_version):
+        super()
+        self.dsn = dsn
+        self.server_version = server_version
+        self.feature = feature
+        self.minimum_version = minimum_version
+
+    def __str__(self):
+        return f'{self.dsn} (version: {self.server_version}): {self.feature} requires PostgreSQL {self.minimum_version} or higher.'
+
+
 class ReplicationSlot:
     @classmethod
     def from_row(cls, conn, row):
@@ -102,33 +596,42 @@ class ReplicationSlot:
         obj.plugin = row['plugin']
         obj.slot_type = row['slot_type']
         obj.confirmed_flush_lsn = row['confirmed_flush_lsn']
+        obj.restart_lsn = row.get('restart_lsn')
+        obj.active = row.get('active')
+        # PG 17+: synced to standbys, and a copy synced from the primary, respectively.
+        obj.failover = row.get('failover', False)
+        obj.synced = row.get('synced', False)
         obj.exists = True
 
         return obj
 
     @classmethod
-    def create(cls, conn, name):
+    def create(cls, conn, name, failover=False):
+        '''Create a pgoutput slot. A failover slot (PG 17+) is synced to standbys, so it survives the source failing over.'''
         slot = ReplicationSlots(conn).get(name)
 
         # Check if slot exists already, if it does, return it
         if slot is not None:
             return slot
 
-        # Otherwise, create it
-        query = "SELECT pg_create_logical_replication_slot(%s, %s)"
-        cursor = conn.cursor()
-
-        _debug(cursor.mogrify(query, (name, 'pgoutput')).decode('utf-8'))
+        if failover and conn.server_version < 170000:
+            raise UnsupportedFeature(conn.dsn, conn.server_version, 'Failover replication slots', 17)
 
-        cursor.execute(query, (name, 'pgoutput'))
+        # Otherwise, create it
+        if failover:
+            # Not temporary, no two-phase, failover.
+            query = "SELECT pg_create_logical_replication_slot(%s, %s, false, false, true)"
+        else:
+            query = "SELECT pg_create_logical_replication_slot(%s, %s)"
 
-        conn.commit()
+        _execute(conn, [query], (name, 'pgoutput'))
 
         obj = cls(conn)
 
         obj.name = name
         obj.plugin = 'pgoutput'
         obj.slot_type = 'logical'
+        obj.failover = failover
         obj.exists = True
 
         return obj
@@ -138,6 +641,10 @@ class ReplicationSlot:
         self.plugin = None
         self.slot_type = None
         self.confirmed_flush_lsn = None
+        self.restart_lsn = None
+        self.active = None
+        self.failover = False
+        self.synced = False
         self.exists = False
         self.conn = conn
 
@@ -146,13 +653,8 @@ class ReplicationSlot:
 
         if slots.get(self.name) is not None:
             query = "SELECT pg_drop_replication_slot(%s)"
-            cursor = self.conn.cursor()
-
-            _debug(cursor.mogrify(query, (self.name,)).decode('utf-8'))
 
-            cursor.execute(query, (self.name,))
-
-            self.conn.commit()
+            _execute(self.conn, [query], (self.name,))
 
         self.exists = False
 
@@ -178,9 +680,8 @@ class ReplicationSlots:
         self.slots = []
 
     def refresh(self):
-        self.cursor.execute('SELECT * FROM pg_replication_slots')
         self.slots = [ReplicationSlot.from_row(
-            self.conn, slot) for slot in self.cursor.fetchall()]
+            self.conn, slot) for slot in _catalog(self.conn, 'replication_slots')]
 
     def show(self):
         self.refresh()
@@ -202,12 +703,9 @@ class ReplicationSlots:
         print(Style.RESET_ALL)
 
     def get(self, name):
-        self.refresh()
+        row = _catalog_row(self.conn, 'replication_slots', 'slot_name', name)
 
-        for slot in self.slots:
-            if slot.name == name:
-                return slot
-        return None
+        return ReplicationSlot.from_row(self.conn, row) if row is not None else None
 
 
 class Publications:
@@ -217,18 +715,13 @@ class Publications:
         self.publications = []
 
     def refresh(self):
-        self.cursor.execute('SELECT * FROM pg_publication')
         self.publications = [Publication.from_row(
-            self.conn, row) for row in self.cursor.fetchall()]
+            self.conn, row) for row in _catalog(self.conn, 'publications')]
 
     def get(self, name):
-        self.refresh()
+        row = _catalog_row(self.conn, 'publications', 'pubname', name)
 
-        for publication in self.publications:
-            if publication.name == name:
-                return publication
-
-        return None
+        return Publication.from_row(self.conn, row) if row is not None else None
 
     def show(self):
         self.refresh()
@@ -239,7 +732,7 @@ class Publications:
         if len(self.publications) == 0:
             print('No publications found.')
         else:
-            table = PrettyTable(['Publication name'])
+            table = PrettyTable(['Publication name', 'All tables', 'Via partition root'])
 
             for publication in self.publications:
                 table.add_row(publication.to_list())
@@ -255,25 +748,36 @@ class Publication:
         self.name = None
         self.exists = False
         self.all_tables = False
+        self.via_partition_root = False
 
     @classmethod
-    def create(cls, conn, name):
+    def create(cls, conn, name, tables=None, via_partition_root=False):
+        '''via_partition_root publishes changes to partitions as changes to their partitioned table (PG 13+).'''
         publication = Publications(conn).get(name)
 
         if publication is not None:
             return publication
         else:
-            query = f'CREATE PUBLICATION {name} FOR ALL TABLES'
+            if via_partition_root and conn.server_version < 130000:
+                raise UnsupportedFeature(conn.dsn, conn.server_version, 'publish_via_partition_root', 13)
 
-            _debug(query)
-            conn.cursor().execute(query)
+            if tables:
+                _check_table_specs(conn, tables)
+                table_list = ', '.join(_table_spec(table) for table in tables)
+                query = f'CREATE PUBLICATION {name} FOR TABLE {table_list}'
+            else:
+                query = f'CREATE PUBLICATION {name} FOR ALL TABLES'
+
+            if via_partition_root:
+                query += ' WITH (publish_via_partition_root = true)'
+
+            _execute(conn, [query])
 
             obj = cls(conn)
             obj.name = name
             obj.exists = True
-            obj.all_tables = True
-
-            conn.commit()
+            obj.all_tables = not tables
+            obj.via_partition_root = via_partition_root
 
             return obj
 
@@ -286,11 +790,34 @@ class Publication:
         obj.name = row['pubname']
         obj.exists = True
         obj.all_tables = row['puballtables']
+        obj.via_partition_root = row.get('pubviaroot', False)
 
         return obj
 
     def to_list(self):
-        return [self.name]
+        return [self.name, self.all_tables, self.via_partition_root]
+
+    def members(self):
+        '''Tables published, with their column lists and row filters on PG 15+.'''
+        cursor = self.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cursor.execute('SELECT * FROM pg_publication_tables WHERE pubname = %s ORDER BY schemaname, tablename', (self.name,))
+
+        return [dict(row) for row in cursor.fetchall()]
+
+    def add_tables(self, tables):
+        '''Add tables (names or dicts with columns and where) to a FOR TABLE publication.'''
+        _check_table_specs(self.conn, tables)
+
+        table_list = ', '.join(_table_spec(table) for table in tables)
+        query = f'ALTER PUBLICATION {self.name} ADD TABLE {table_list}'
+
+        _execute(self.conn, [query])
+
+    def drop_tables(self, tables):
+        table_list = ', '.join(_quote_table(table) for table in tables)
+        query = f'ALTER PUBLICATION {self.name} DROP TABLE {table_list}'
+
+        _execute(self.conn, [query])
 
     def drop(self):
         publication = Publications(self.conn).get(self.name)
@@ -298,9 +825,7 @@ class Publication:
         if publication is not None:
             query = f'DROP PUBLICATION {self.name}'
 
-            _debug(query)
-            self.conn.cursor().execute(query)
-            self.conn.commit()
+            _execute(self.conn, [query])
 
         self.exists = False
 
@@ -316,30 +841,46 @@ class Subscription:
         self.dest = None
 
     @classmethod
-    def create(cls, src, dest, name, copy_data=False, enabled=True, replication_slot=None):
+    def create(cls, src, dest, name, copy_data=False, enabled=True, replication_slot=None, tables=None,
+               streaming=None, binary=None, disable_on_error=None, failover=None, via_partition_root=False):
+        '''failover None makes the slot a failover slot when both servers support it (PG 17+).'''
         slot_name = replication_slot if replication_slot is not None else f'{name}_slot'
         publication_name = f'{name}_publication'
 
-        ReplicationSlot.create(src, slot_name)
-        Publication.create(src, publication_name)
+        if failover is None and min(src.server_version, dest.server_version) >= 170000:
+            failover = True
+
+        options = _subscription_options(src, dest, streaming=streaming, binary=binary, disable_on_error=disable_on_error,
+                                        failover=failover)
+
+        slot = ReplicationSlot.create(src, slot_name, failover=bool(failover))
+        Publication.create(src, publication_name, tables=tables, via_partition_root=via_partition_root)
 
         subscription = Subscriptions(src, dest).get(name)
+        # An existing slot keeps the failover it was created with. Setting it on a
+        # disabled subscription alters the slot on the source to match.
+        alter_failover = bool(failover) and not slot.failover
 
         if subscription is None:
-            dest.rollback()  # Flush all existing transactions
-            dest.set_session(autocommit=True)
-            copy_data = str(copy_data).lower()
-            enabled = str(enabled).lower()
-            query = f'CREATE SUBSCRIPTION {name} CONNECTION %s PUBLICATION {publication_name} WITH (copy_data = {copy_data}, slot_name = {slot_name}, create_slot = false, enabled = {enabled})'
+            options = ''.join(f', {option}' for option in options)
+            query = f'CREATE SUBSCRIPTION {name} CONNECTION %s PUBLICATION {publication_name} WITH (copy_data = {str(copy_data).lower()}, slot_name = {slot_name}, create_slot = false, enabled = {str(enabled and not alter_failover).lower()}{options})'
 
-            _debug(dest.cursor().mogrify(query, (src.dsn,)).decode('utf-8'))
+            _execute(dest, [query], (src.dsn,))
 
-            dest.cursor().execute(query, (src.dsn,))
-            dest.set_session(autocommit=False)
+            if alter_failover:
+                # Can't run in a transaction block, so it goes on its own.
+                _execute(dest, [f'ALTER SUBSCRIPTION {name} SET (failover = true)'])
+                _invalidate_catalogs(src)
+
+                if enabled:
+                    _execute(dest, [f'ALTER SUBSCRIPTION {name} ENABLE'])
+        elif alter_failover:
+            print(Fore.RED, f'\bReplication slot {slot_name} is not a failover slot. Run alter-subscription --failover to make it one.', Style.RESET_ALL)
 
         obj = cls()
         obj.name = name
-        obj.enabled = True
+        # One that already existed is left as it was.
+        obj.enabed = subscription.enabed if subscription is not None else enabled
         obj.dsn = src.dsn
         obj.slot = ReplicationSlots(src).get(slot_name)
         obj.publication = Publications(src).get(publication_name)
@@ -356,14 +897,11 @@ class Subscription:
             query2 = f'ALTER SUBSCRIPTION {subscription.name} SET (slot_name = NONE)'
             query3 = f'DROP SUBSCRIPTION {subscription.name}'
 
-            _debug(query1)
-            self.dest.cursor().execute(query1)
-            _debug(query2)
-            self.dest.cursor().execute(query2)
-            _debug(query3)
-            self.dest.cursor().execute(query3)
-            self.dest.commit()
+            # Without a slot, DROP SUBSCRIPTION can run in the same transaction.
+            _execute(self.dest, [query1, query2, query3])
 
+        # The walsender holds the slot until it notices, and dropping an active slot fails.
+        self.wait_until_released()
         self.slot.drop()
         self.publication.drop()
 
@@ -373,9 +911,7 @@ class Subscription:
         if subscription is not None:
             query = f'ALTER SUBSCRIPTION {self.name} DISABLE'
 
-            _debug(query)
-            self.dest.cursor().execute(query)
-            self.dest.commit()
+            _execute(self.dest, [query])
 
         self.enabed = False
 
@@ -385,37 +921,147 @@ class Subscription:
         if subscription is not None:
             query = f'ALTER SUBSCRIPTION {self.name} ENABLE'
 
-            _debug(query)
-            self.dest.cursor().execute(query)
-            self.dest.commit()
+            _execute(self.dest, [query])
+
+    def alter(self, streaming=None, binary=None, disable_on_error=None, failover=None):
+        '''Change streaming, binary, disable_on_error and failover. Options left as None are not changed.'''
+        options = _subscription_options(self.src, self.dest, streaming=streaming, binary=binary, disable_on_error=disable_on_error,
+                                        failover=failover)
+
+        if len(options) == 0:
+            return
+
+        query = f'ALTER SUBSCRIPTION {self.name} SET ({", ".join(options)})'
+
+        if failover is None:
+            _execute(self.dest, [query])
+            return
+
+        # Changing failover alters the slot on the source, which the apply worker must not be using.
+        enabled = self.enabed
+
+        self.disable()
+        self.wait_until_stopped()
+
+        _execute(self.dest, [query])
+
+        if enabled:
+            self.enable()
+
+    def refresh_publication(self, copy_data=True):
+        '''Pick up tables added to or dropped from the publication. Only new tables are copied.'''
+        query = f'ALTER SUBSCRIPTION {self.name} REFRESH PUBLICATION WITH (copy_data = {str(copy_data).lower()})'
+
+        # Can't run in a transaction block, so it goes on its own.
+        _execute(self.dest, [query])
+
+    def add_tables(self, tables, copy_data=True):
+        self.publication.add_tables(tables)
+        self.refresh_publication(copy_data=copy_data)
+
+    def drop_tables(self, tables):
+        self.publication.drop_tables(tables)
+        self.refresh_publication(copy_data=False)
+
+    def streaming(self):
+        '''Is the apply worker connected to the replication slot.'''
+        rows = _poll(self.src, 'SELECT active FROM pg_replication_slots WHERE slot_name = %s', (self.slot.name,))
+
+        return len(rows) > 0 and rows[0]['active']
+
+    def workers(self):
+        '''Number of running apply and table sync workers.'''
+        rows = _poll(self.dest, 'SELECT count(*) FROM pg_stat_subscription WHERE subname = %s AND pid IS NOT NULL', (self.name,))
+
+        return rows[0][0]
+
+    def current_lag(self):
+        '''Replication lag in bytes, right now. None if the slot has not confirmed anything.'''
+        query = 'SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), confirmed_flush_lsn) AS lag FROM pg_replication_slots WHERE slot_name = %s'
+        rows = _poll(self.src, query, (self.slot.name,))
+
+        if len(rows) == 0 or rows[0]['lag'] is None:
+            return None
+
+        return int(rows[0]['lag'])
+
+    def unsynced_tables(self):
+        '''Tables which haven't finished their initial sync, i.e. aren't in state r (ready).
+
+        Named schema.table, unquoted, like the catalogs: regclass::text would
+        quote some names and leave out the schema of others.'''
+        query = '''SELECT n.nspname || '.' || c.relname AS table_name, r.srsubstate
+            FROM pg_subscription_rel r
+            JOIN pg_subscription s ON s.oid = r.srsubid
+            JOIN pg_class c ON c.oid = r.srrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE r.srsubstate <> 'r' AND s.subname = %s'''
+
+        return _poll(self.dest, query, (self.name,))
+
+    def wait_until_streaming(self, timeout=60.0):
+        _wait(self.streaming, f'subscription {self.name} to start streaming', timeout)
+
+    def wait_until_stopped(self, timeout=60.0):
+        _wait(lambda: self.workers() == 0, f'the workers of subscription {self.name} to stop', timeout)
+
+    def wait_until_released(self, timeout=60.0):
+        _wait(lambda: not self.streaming(), f'replication slot {self.slot.name} to be released', timeout)
+
+    def wait_until_synced(self, timeout=None):
+        pending = []
+
+        def synced():
+            pending[:] = self.unsynced_tables()
+            return len(pending) == 0
+
+        _wait(synced, f'the tables of subscription {self.name} to sync', timeout,
+              show=lambda _: f'{len(pending)} table(s) left')
+
+    def wait_for_lag(self, max_bytes=0, timeout=60.0):
+        lag = [None]
+
+        def caught_up():
+            lag[0] = self.current_lag()
+            return lag[0] is not None and lag[0] <= max_bytes
+
+        _wait(caught_up, f'the lag of subscription {self.name} to drop to {max_bytes} bytes', timeout,
+              show=lambda _: f'lag is {lag[0]} bytes')
 
     def lock(self):
-        return _lock(self.src) and _lock(self.dest)
+        '''Lock the subscription on both servers, or on neither.'''
+        key = _lock_key('subscription', self.name)
+
+        if not _lock(self.src, key):
+            return False
+
+        if not _lock(self.dest, key):
+            _unlock(self.src, key)
+            return False
+
+        return True
 
     def unlock(self):
-        _unlock(self.src)
-        _unlock(self.dest)
+        key = _lock_key('subscription', self.name)
 
-    def replication_lag(self):
-        query1 = 'SELECT pg_current_wal_lsn()'
-        query2 = 'SELECT (%s::pg_lsn - %s::pg_lsn) AS replication_lag'
-        cursor = self.src.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        _unlock(self.src, key)
+        _unlock(self.dest, key)
 
-        _debug(query1)
-        cursor.execute(query1)
+    def replication_lag(self):
+        # Subscription without a slot on the source.
+        if self.slot.conn is None:
+            return None
 
-        lsn = cursor.fetchone()['pg_current_wal_lsn']
+        lsn = _catalog(self.src, 'wal_lsn')[0]['pg_current_wal_lsn']
 
         self.slot.refresh()
 
         flushed_lsn = self.slot.confirmed_flush_lsn
 
-        _debug(cursor.mogrify(query2, (lsn, flushed_lsn)).decode('utf-8'))
-        cursor.execute(query2, (lsn, flushed_lsn))
-
-        lag = cursor.fetchone()['replication_lag']
+        if flushed_lsn is None:
+            return None
 
-        return lag
+        return lsn_to_int(lsn) - lsn_to_int(flushed_lsn)
 
     def reverse(self):
         '''Publisher becomes subscriber, subscriber become publisher.'''
@@ -426,6 +1072,10 @@ class Subscription:
             print(Fore.RED, '\bAborting. Come back when you\'re sure.')
             return
 
+        # The prefetched positions are from before the prompt: read them again, in one query.
+        _invalidate_catalogs(self.src)
+        _prefetch(self.src, ['wal_lsn', 'replication_slots', 'publications'])
+
         replication_lag = self.replication_lag()
 
         if replication_lag != 0:
@@ -456,6 +1106,66 @@ class Subscription:
         # Reverse the configuration
         _write_config(self.src.dsn, self.dest.dsn)
 
+        try:
+            subscription.wait_until_streaming()
+        except WaitTimeout as e:
+            print(Fore.RED, f'\b{e}', Style.RESET_ALL)
+
+    def recover(self, timeout=60.0):
+        '''Resume on a source that failed over to a standby without this subscription's slot.
+
+        The slot is created again, and the subscription resumes from what the
+        destination applied, its origin's remote_lsn: physical standbys keep
+        the LSNs of the primary. A new slot can only decode WAL written after
+        it was created, so the changes between the two are reported as a gap.
+        Returns the resume LSN, where the slot starts and the gap in bytes.'''
+        row = _catalog_row(self.dest, 'subscriptions', 'subname', self.name)
+        slot_name = row['subslotname']
+        enabled = self.enabed
+
+        if not self.lock():
+            raise Exception(f'Subscription {self.name} is locked by another operator, see list-locks.')
+
+        try:
+            return self._recover(row, slot_name, enabled, timeout)
+        finally:
+            self.unlock()
+
+    def _recover(self, row, slot_name, enabled, timeout):
+        # Keep the apply worker from retrying the old source while the origin is read.
+        self.disable()
+        self.wait_until_stopped(timeout)
+
+        origin = _catalog_row(self.dest, 'replication_origins', 'subname', self.name)
+        resume_lsn = origin['remote_lsn'] if origin is not None else None
+
+        if resume_lsn is None:
+            raise Exception(f'Subscription {self.name} has not applied anything to resume from. It is left disabled; create it again with --copy-data.')
+
+        slot = ReplicationSlots(self.src).get(slot_name)
+
+        # A failover slot or one kept by sync-standby-slots survived.
+        if slot is None:
+            slot = ReplicationSlot.create(self.src, slot_name, failover=bool(row.get('subfailover')))
+            slot.refresh()
+
+        self.slot = slot
+        gap = max(lsn_to_int(slot.confirmed_flush_lsn) - lsn_to_int(resume_lsn), 0)
+
+        # Point the subscription at the new primary.
+        queries = [f'ALTER SUBSCRIPTION {self.name} CONNECTION %s']
+
+        if enabled:
+            queries.append(f'ALTER SUBSCRIPTION {self.name} ENABLE')
+
+        _execute(self.dest, queries, (_full_dsn(self.src),))
+        self.dsn = _full_dsn(self.src)
+
+        if enabled:
+            self.wait_until_streaming(timeout)
+
+        return resume_lsn, slot.confirmed_flush_lsn, gap
+
     @classmethod
     def from_row(cls, src, dest, row):
         slot = ReplicationSlots(src).get(row['subslotname'])
@@ -493,9 +1203,8 @@ class Subscriptions:
         self.cursor = dest.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
     def refresh(self):
-        self.cursor.execute('SELECT * FROM pg_subscription')
         self.subscriptions = [Subscription.from_row(
-            self.src, self.dest, row) for row in self.cursor.fetchall()]
+            self.src, self.dest, row) for row in _catalog(self.dest, 'subscriptions')]
 
     def show(self):
         self.refresh()
@@ -518,26 +1227,39 @@ class Subscriptions:
         print(Style.RESET_ALL)
 
     def get(self, name):
-        self.refresh()
+        row = _catalog_row(self.dest, 'subscriptions', 'subname', name)
 
-        for subscription in self.subscriptions:
-            if subscription.name == name:
-                return subscription
-        return None
+        return Subscription.from_row(self.src, self.dest, row) if row is not None else None
 
 
 class ReplicationOrigin:
     def __init__(self, conn):
         self.conn = conn
         self.name = None
+        self.remote_lsn = None
+        self.local_lsn = None
+        self.subscription = None
+        self.slot_name = None
+        self.slot_lsn = None
 
     @classmethod
     def from_row(cls, conn, row):
         obj = cls(conn)
         obj.name = row['roname']
+        obj.remote_lsn = row['remote_lsn']
+        obj.local_lsn = row['local_lsn']
+        obj.subscription = row['subname']
+        obj.slot_name = row['subslotname']
 
         return obj
 
+    def divergence(self):
+        '''Bytes the destination has applied past what the slot on the source has confirmed.'''
+        if self.remote_lsn is None or self.slot_lsn is None:
+            return None
+
+        return lsn_to_int(self.remote_lsn) - lsn_to_int(self.slot_lsn)
+
     def rewind(self, lsn: str, subscription: Subscription):
         # Check LSN
         if lsn is None:
@@ -552,6 +1274,9 @@ class ReplicationOrigin:
             return
 
         # Check LSN with user
+        if self.remote_lsn is not None:
+            print(Fore.GREEN, f'\bOrigin {self.name} has applied up to {self.remote_lsn} on the source.', Style.RESET_ALL)
+
         lsn_correct = input(
             Fore.GREEN + f'\bPlease confirm you want this LSN {lsn}. [Y/n]: ' + Style.RESET_ALL)
         if lsn_correct.strip() != 'Y':
@@ -563,41 +1288,72 @@ class ReplicationOrigin:
         locked = subscription.lock()
 
         if not locked:
-            print(Fore.RED, '\bCould not acquire locks on source and destination DBs. Is there another instance of this app running?', Style.RESET_ALL)
+            print(Fore.RED, f'\bSubscription {subscription.name} is locked by another operator, see list-locks.', Style.RESET_ALL)
             return
 
-        # Ok go
+        try:
+            self._rewind(lsn, subscription)
+        finally:
+            subscription.unlock()
+
+    def _rewind(self, lsn, subscription):
         query = 'SELECT pg_replication_origin_advance(%s, %s)'
 
         subscription.disable()
 
-        print(Fore.GREEN, '\bGiving the replication worker 5 seconds to shut down...')
-        sleep(5.0)
-
-        self.conn.rollback()  # Flush all transactions
-        self.conn.set_session(autocommit=True)
-        _debug(self.conn.cursor().mogrify(
-            query, (self.name, lsn)).decode('utf-8'))
-        self.conn.cursor().execute(query, (self.name, lsn))
-        self.conn.set_session(autocommit=False)
-        subscription.enable()
+        # The origin can't be advanced while the apply worker is using it.
+        try:
+            subscription.wait_until_stopped()
+        except WaitTimeout as e:
+            print(Fore.RED, f'\b{e} The subscription is left disabled.', Style.RESET_ALL)
+            return
 
-        subscription.unlock()
+        # Advance and enable together; if advancing fails, the subscription stays disabled.
+        _execute(self.conn, [query, f'ALTER SUBSCRIPTION {subscription.name} ENABLE'], (self.name, lsn))
 
     def to_list(self):
-        return [self.name]
+        divergence = self.divergence()
+
+        return [self.name, self.subscription, self.remote_lsn, self.local_lsn, self.slot_name, self.slot_lsn,
+                divergence if divergence is not None else 'N/A']
 
 
 class ReplicationOrigins:
-    def __init__(self, conn):
+    '''Replication origins on the destination with their progress and subscription.
+
+    Pass the source connection to also get the position of each subscription's slot.'''
+
+    def __init__(self, conn, src=None):
         self.conn = conn
+        self.src = src
         self.cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         self.origins = []
 
     def refresh(self):
-        self.cursor.execute('SELECT * FROM pg_replication_origin')
         self.origins = [ReplicationOrigin.from_row(
-            self.conn, row) for row in self.cursor.fetchall()]
+            self.conn, row) for row in _catalog(self.conn, 'replication_origins')]
+
+        if self.src is not None:
+            slots = {row['slot_name']: row['confirmed_flush_lsn'] for row in _catalog(self.src, 'replication_slots')}
+
+            for origin in self.origins:
+                origin.slot_lsn = slots.get(origin.slot_name)
+
+    def record(self, directory):
+        '''Append the position of every subscription to its history file.'''
+        self.refresh()
+
+        # Don't hold a snapshot open between samples.
+        self.conn.rollback()
+        if self.src is not None:
+            self.src.rollback()
+
+        now = time()
+
+        for origin in self.origins:
+            if origin.subscription is not None:
+                History.for_subscription(directory, origin.subscription).append(
+                    now, lsn_to_int(origin.slot_lsn), lsn_to_int(origin.remote_lsn))
 
     def show(self):
         self.refresh()
@@ -608,7 +1364,7 @@ class ReplicationOrigins:
         if len(self.origins) == 0:
             print('No replication origins found.')
         else:
-            table = PrettyTable(['Name'])
+            table = PrettyTable(['Name', 'Subscription', 'Remote LSN', 'Local LSN', 'Slot name', 'Slot flushed LSN', 'Divergence'])
 
             for origin in self.origins:
                 table.add_row(origin.to_list())
@@ -634,48 +1390,201 @@ class ReplicationOrigins:
             return self.origins[-1]
 
 
-class Table:
-    def __init__(self, conn):
-        self.conn = conn
-        self.name = None
-        self.owner = None
+def _standby_slot_status(slot, standby_slot, remote_lsn, standby_version):
+    '''Would a subscription resume if its source failed over to the standby, and what sync-standby-slots does about it.
 
-    @classmethod
-    def from_row(cls, conn, row):
-        obj = cls(conn)
-        obj.name = row['tablename']
-        obj.owner = row['tableowner']
+    slot and standby_slot are pg_replication_slots rows of the slot on the
+    source and on the standby, remote_lsn is what the destination applied.
+    Returns (status, action), action is sync, create, advance or None.'''
+    if slot is None:
+        return 'no slot on source', None
+
+    # PG 17 failover slots are copied by the standby itself.
+    if slot.get('failover') and standby_version >= 170000:
+        if standby_slot is None or not standby_slot.get('synced'):
+            return 'not synced', 'sync'
+        action = None
+    elif standby_version < 160000:
+        return 'lost on failover', None
+    elif standby_slot is None:
+        return 'missing', 'create'
+    else:
+        action = 'advance'
 
-        return obj
+    if remote_lsn is None:
+        return 'ready', None
 
-    def to_list(self):
-        return [self.name, self.owner]
+    standby_lsn = lsn_to_int(standby_slot['confirmed_flush_lsn'])
 
+    # Decoding on the new primary would start after changes the destination doesn't have.
+    if standby_lsn > lsn_to_int(remote_lsn):
+        return 'ahead of destination', None
 
-class Tables:
-    def __init__(self, conn):
-        self.conn = conn
-        self.cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        self.tables = []
+    if standby_lsn == lsn_to_int(remote_lsn):
+        action = None
 
-    def refresh(self):
-        query = "SELECT * FROM pg_tables WHERE schemaname ='public';"
+    return 'ready', action
 
-        self.cursor.execute(query)
 
-        self.tables = [Table.from_row(self.conn, row)
-                       for row in self.cursor.fetchall()]
+class StandbySlots:
+    '''Slots of the subscriptions on a physical standby of the source, which become the source's slots if it fails over.
 
-    def show(self):
-        self.refresh()
+    PG 17 failover slots are synced with pg_sync_replication_slots. Other
+    slots are created on the standby (PG 16+) and advanced to what the
+    destination applied, never past it, so none of the changes the
+    destination still needs are skipped after a failover.'''
 
-        print(Fore.GREEN)
-        print('\nTables\n')
+    def __init__(self, src, dest, standby):
+        self.src = src
+        self.dest = dest
+        self.standby = standby
+        self.slots = []
+
+    def refresh(self):
+        self.slots = []
+
+        for subscription in _catalog(self.dest, 'subscriptions'):
+            name = subscription['subslotname']
+            slot = _catalog_row(self.src, 'replication_slots', 'slot_name', name)
+            standby_slot = _catalog_row(self.standby, 'replication_slots', 'slot_name', name)
+            origin = _catalog_row(self.dest, 'replication_origins', 'subname', subscription['subname'])
+            remote_lsn = origin['remote_lsn'] if origin is not None else None
+            status, action = _standby_slot_status(slot, standby_slot, remote_lsn, self.standby.server_version)
+
+            self.slots.append({
+                'subscription': subscription['subname'],
+                'slot': name,
+                'failover': slot.get('failover', False) if slot is not None else None,
+                'standby_lsn': standby_slot['confirmed_flush_lsn'] if standby_slot is not None else None,
+                'remote_lsn': remote_lsn,
+                'status': status,
+                'action': action,
+            })
+
+    def sync(self):
+        '''Sync, create and advance the standby's slots. Returns the number of slots changed.'''
+        self.refresh()
+
+        actions = [slot for slot in self.slots if slot['action'] is not None]
+        creates = [slot for slot in actions if slot['action'] == 'create']
+        advances = [slot for slot in actions if slot['action'] == 'advance']
+
+        if any(slot['action'] == 'sync' for slot in actions):
+            # The slot sync worker does it already, and the function refuses to run alongside it.
+            if _poll(self.standby, "SELECT current_setting('sync_replication_slots') AS sync")[0]['sync'] != 'on':
+                _execute(self.standby, ['SELECT pg_sync_replication_slots()'])
+
+        if creates:
+            # Creating a slot on a standby waits for a snapshot from the primary; don't wait for the next checkpoint.
+            _execute(self.src, ['SELECT pg_log_standby_snapshot()'])
+
+            # Each waits for its own snapshot, one statement at a time.
+            for slot in creates:
+                _execute(self.standby, ['SELECT pg_create_logical_replication_slot(%s, %s)'], (slot['slot'], 'pgoutput'))
+
+        if advances:
+            queries = ['SELECT pg_replication_slot_advance(%s, %s)'] * len(advances)
+            params = tuple(value for slot in advances for value in (slot['slot'], slot['remote_lsn']))
+
+            _execute(self.standby, queries, params)
+
+        return len(actions)
+
+    def show(self):
+        self.refresh()
+
+        print(Fore.GREEN)
+        print('\nSlots on standby\n')
+
+        if len(self.slots) == 0:
+            print('No subscriptions found.')
+        else:
+            table = PrettyTable(['Subscription', 'Slot name', 'Failover', 'Standby flushed LSN', 'Destination applied LSN', 'Status'])
+
+            for slot in self.slots:
+                table.add_row([slot['subscription'], slot['slot'], slot['failover'], slot['standby_lsn'], slot['remote_lsn'], slot['status']])
+
+            print(table)
+
+        print(Style.RESET_ALL)
+
+
+class Locks:
+    '''Locks held on a server, with whether their holder is still connected.'''
+
+    QUERY = '''SELECT l.object, l.holder, l.pid, l.acquired_at,
+        EXISTS (SELECT 1 FROM pg_stat_activity a WHERE a.pid = l.pid AND a.backend_start <= l.acquired_at) AS connected
+        FROM pglogicalmanager.locks l
+        ORDER BY l.acquired_at'''
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.locks = []
+
+    def refresh(self):
+        exists = _poll(self.conn, "SELECT to_regclass('pglogicalmanager.locks') IS NOT NULL AS exists")[0]['exists']
+
+        self.locks = [dict(row) for row in _poll(self.conn, self.QUERY)] if exists else []
+
+    def release(self, key):
+        '''Release the lock on key, whoever holds it. Returns whether there was one.'''
+        return len(_poll(self.conn, 'DELETE FROM pglogicalmanager.locks WHERE object = %s RETURNING object', (key,))) > 0
+
+
+def _lock_status(lock):
+    return 'held' if lock['connected'] else 'holder gone'
+
+
+class Table:
+    def __init__(self, conn):
+        self.conn = conn
+        self.name = None
+        self.owner = None
+        self.partitions = None # Number of leaf partitions of a partitioned table, at any depth
+
+    @classmethod
+    def from_row(cls, conn, row, partitions=None):
+        obj = cls(conn)
+        obj.name = row['tablename']
+        obj.owner = row['tableowner']
+        obj.partitions = partitions
+
+        return obj
+
+    def to_list(self):
+        return [self.name, self.owner, self.partitions if self.partitions is not None else '']
+
+
+class Tables:
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        self.tables = []
+
+    def _leaves(self, rows):
+        '''Leaf partitions by partitioned table. Only read when there are partitioned tables.'''
+        if not any(row.get('partitioned') for row in rows):
+            return {}
+
+        return Counter((partition['root_schema'], partition['root']) for partition in _catalog(self.conn, 'partitions'))
+
+    def refresh(self):
+        rows = _catalog(self.conn, 'tables')
+        leaves = self._leaves(rows)
+
+        self.tables = [Table.from_row(self.conn, row, leaves[(row['schemaname'], row['tablename'])] if row.get('partitioned') else None)
+                       for row in rows]
+
+    def show(self):
+        self.refresh()
+
+        print(Fore.GREEN)
+        print('\nTables\n')
 
         if len(self.tables) == 0:
             print('\bNo tables found.', Style.RESET_ALL)
         else:
-            print_table = PrettyTable(['Table name', 'Owner'])
+            print_table = PrettyTable(['Table name', 'Owner', 'Partitions'])
 
             for table in self.tables:
                 print_table.add_row(table.to_list())
@@ -685,12 +1594,14 @@ class Tables:
         print(Style.RESET_ALL)
 
     def get(self, name):
-        self.refresh()
+        row = _catalog_row(self.conn, 'tables', 'tablename', name)
 
-        for table in self.tables:
-            if table.name == name:
-                return table
-        return None
+        if row is None:
+            return None
+
+        leaves = self._leaves([row])
+
+        return Table.from_row(self.conn, row, leaves[(row['schemaname'], row['tablename'])] if row.get('partitioned') else None)
 
 
 class Column:
@@ -719,165 +1630,1915 @@ class Columns:
         self.table = table
         self.columns = []
 
-    def refresh(self):
-        query = "SELECT column_name, data_type FROM information_schema.columns WHERE table_schema = 'public' AND table_name = %s ORDER BY column_name"
+    def refresh(self):
+        if 'columns' in _catalogs.get(self.conn, {}):
+            rows = _catalog_rows(self.conn, 'columns', 'table_name', self.table.name)
+        else:
+            query = "SELECT column_name, data_type FROM information_schema.columns WHERE table_schema = 'public' AND table_name = %s ORDER BY column_name"
+
+            self.cursor.execute(query, (self.table.name,))
+            rows = self.cursor.fetchall()
+
+        self.columns = [Column.from_row(
+            self.conn, self.table, row) for row in rows]
+
+    def show(self):
+        self.refresh()
+
+        print(Fore.GREEN)
+        print(f'\nColumns in "{self.table.name}"\n')
+
+        if len(self.columns) == 0:
+            print('No tables found.')
+        else:
+            table = PrettyTable(['Column name', 'Data type'])
+
+            for column in self.columns:
+                table.add_row(column.to_list())
+
+            print(table)
+
+        print(Style.RESET_ALL)
+
+    def get(self, name):
+        self.refresh()
+
+        for column in self.columns:
+            if column.name == name:
+                return column
+        return None
+
+
+class SubscriptionStats:
+    '''Apply throughput of subscriptions and tables on the destination, measured between two samples.'''
+
+    # Share of all applied rows above which a table is highlighted.
+    HOT_TABLE_SHARE = 0.25
+
+    def __init__(self, dest):
+        self.dest = dest
+        self.cursor = dest.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        self.subscriptions = []
+        self.tables = []
+        self.elapsed = None
+
+    def _subscriptions_query(self):
+        # pg_stat_subscription_stats (error and conflict counters) is only available in PG 15+.
+        if self.dest.server_version >= 150000:
+            stats_column = 'to_jsonb(st) AS stats'
+            stats_join = 'LEFT JOIN pg_stat_subscription_stats st ON st.subid = s.subid'
+        else:
+            stats_column = 'NULL::jsonb AS stats'
+            stats_join = ''
+
+        # Parallel apply workers (PG 16+) have no relid either, and a leader.
+        leader_column = 's.leader_pid' if self.dest.server_version >= 160000 else 'NULL::integer AS leader_pid'
+
+        return f'''SELECT s.subname, s.pid, s.relid, {leader_column}, a.wait_event_type, a.wait_event,
+            pg_wal_lsn_diff(s.received_lsn, '0/0') AS received_bytes, {stats_column}
+            FROM pg_stat_subscription s
+            LEFT JOIN pg_stat_activity a ON a.pid = s.pid
+            {stats_join}'''
+
+    def sample(self):
+        '''Take one sample of subscription and table counters. Two queries.'''
+        self.cursor.execute(self._subscriptions_query())
+        subscriptions = {}
+
+        for row in self.cursor.fetchall():
+            # Table sync workers have a relid, the apply worker doesn't.
+            if row['relid'] is not None:
+                subscription = subscriptions.setdefault(row['subname'], _subscription_sample(row['subname']))
+                subscription['sync_workers'] += 1
+                continue
+
+            # Parallel apply workers report no received_lsn: the leader receives for them.
+            if row['leader_pid'] is not None:
+                subscriptions.setdefault(row['subname'], _subscription_sample(row['subname']))
+                continue
+
+            subscription = subscriptions.setdefault(row['subname'], _subscription_sample(row['subname']))
+            subscription['pid'] = row['pid']
+            subscription['received_bytes'] = row['received_bytes']
+            subscription['wait_event'] = _wait_event(row['wait_event_type'], row['wait_event'])
+
+            stats = row['stats'] or {}
+            subscription['apply_errors'] = stats.get('apply_error_count')
+            subscription['sync_errors'] = stats.get('sync_error_count')
+
+            # PG 18+ reports conflicts by type (confl_insert_exists, confl_update_missing, ...).
+            conflicts = [value for key, value in stats.items() if key.startswith('confl_')]
+            subscription['conflicts'] = sum(conflicts) if conflicts else None
+
+        self.cursor.execute('''SELECT t.relid, t.schemaname, t.relname, t.n_tup_ins, t.n_tup_upd, t.n_tup_del,
+            string_agg(sub.subname, ', ') AS subnames
+            FROM pg_stat_user_tables t
+            LEFT JOIN pg_subscription_rel sr ON sr.srrelid = t.relid
+            LEFT JOIN pg_subscription sub ON sub.oid = sr.srsubid
+            WHERE t.schemaname <> 'pglogicalmanager'
+            GROUP BY t.relid, t.schemaname, t.relname, t.n_tup_ins, t.n_tup_upd, t.n_tup_del''')
+
+        tables = {row['relid']: dict(row) for row in self.cursor.fetchall()}
+
+        return {'time': monotonic(), 'subscriptions': subscriptions, 'tables': tables}
+
+    def refresh(self, interval=5.0):
+        '''Sample twice, interval seconds apart, and compute rates.'''
+        before = self.sample()
+        sleep(interval)
+        after = self.sample()
+
+        self.subscriptions, self.tables, self.elapsed = _apply_rates(before, after)
+
+    def show(self, interval=5.0, top=10):
+        print(Fore.BLUE, f'\bSampling apply statistics for {interval} seconds...', Style.RESET_ALL)
+
+        self.refresh(interval)
+
+        print(Fore.GREEN)
+        print('\nSubscription apply rates\n')
+
+        if len(self.subscriptions) == 0:
+            print('No running subscription workers found.')
+        else:
+            table = PrettyTable(['Subscription name', 'Worker PID', 'Sync workers', 'Received bytes/s',
+                                 'Wait event', 'Apply errors', 'Sync errors', 'Conflicts'])
+
+            for subscription in self.subscriptions:
+                table.add_row([subscription['subname'], subscription['pid'], subscription['sync_workers'],
+                               _format_rate(subscription['received_rate']), subscription['wait_event'],
+                               _format_delta(subscription['apply_errors']), _format_delta(subscription['sync_errors']),
+                               _format_delta(subscription['conflicts'])])
+
+            print(table)
+
+        print('\nTable apply rates\n')
+
+        tables = [table for table in self.tables if table['rows_rate'] > 0][:top]
+
+        if len(tables) == 0:
+            print(f'No rows applied in the last {round(self.elapsed, 1)} seconds.')
+        else:
+            table = PrettyTable(['Table name', 'Subscriptions', 'Inserts/s', 'Updates/s', 'Deletes/s', 'Rows/s', 'Share'])
+
+            for row in tables:
+                color = Fore.RED if row['share'] >= self.HOT_TABLE_SHARE else Fore.GREEN
+                table.add_row([color + f'{row["schemaname"]}.{row["relname"]}', row['subnames'],
+                               _format_rate(row['ins_rate']), _format_rate(row['upd_rate']),
+                               _format_rate(row['del_rate']), _format_rate(row['rows_rate']),
+                               f'{round(row["share"] * 100, 1)}%' + Fore.GREEN])
+
+            print(table)
+
+        print(Style.RESET_ALL)
+
+
+def _subscription_sample(subname):
+    return {
+        'subname': subname,
+        'pid': None,
+        'sync_workers': 0,
+        'received_bytes': None,
+        'wait_event': None,
+        'apply_errors': None,
+        'sync_errors': None,
+        'conflicts': None,
+    }
+
+
+def _wait_event(wait_event_type, wait_event):
+    if wait_event_type is None:
+        return 'CPU' # Not waiting on anything, so it's working.
+    return f'{wait_event_type}:{wait_event}'
+
+
+def _delta(before, after):
+    if before is None or after is None:
+        return None
+    return after - before
+
+
+def _apply_rates(before, after):
+    '''Compute per-subscription and per-table rates between two samples.
+
+    Returns subscriptions, tables (sorted by rows applied, busiest first) and elapsed seconds.'''
+    elapsed = max(after['time'] - before['time'], 1e-6)
+
+    subscriptions = []
+
+    for subname, current in sorted(after['subscriptions'].items()):
+        previous = before['subscriptions'].get(subname, {})
+        received = _delta(previous.get('received_bytes'), current['received_bytes'])
+
+        subscription = dict(current)
+        subscription['received_rate'] = float(received) / elapsed if received is not None else None
+        subscription['apply_errors'] = _delta(previous.get('apply_errors'), current['apply_errors'])
+        subscription['sync_errors'] = _delta(previous.get('sync_errors'), current['sync_errors'])
+        subscription['conflicts'] = _delta(previous.get('conflicts'), current['conflicts'])
+        subscriptions.append(subscription)
+
+    tables = []
+
+    for relid, current in after['tables'].items():
+        previous = before['tables'].get(relid)
+
+        # Table created in between samples, nothing to compare to.
+        if previous is None:
+            continue
+
+        table = dict(current)
+        table['ins_rate'] = (current['n_tup_ins'] - previous['n_tup_ins']) / elapsed
+        table['upd_rate'] = (current['n_tup_upd'] - previous['n_tup_upd']) / elapsed
+        table['del_rate'] = (current['n_tup_del'] - previous['n_tup_del']) / elapsed
+        table['rows_rate'] = table['ins_rate'] + table['upd_rate'] + table['del_rate']
+        tables.append(table)
+
+    total = sum(table['rows_rate'] for table in tables)
+
+    for table in tables:
+        table['share'] = table['rows_rate'] / total if total > 0 else 0.0
+
+    tables.sort(key=lambda table: table['rows_rate'], reverse=True)
+
+    return subscriptions, tables, elapsed
+
+
+def _format_rate(rate):
+    if rate is None:
+        return 'N/A'
+    return round(rate, 1)
+
+
+def _format_delta(delta):
+    if delta is None:
+        return 'N/A'
+    return f'+{delta}'
+
+
+class HotTables:
+    '''Write rates and estimated WAL contribution of tables on the source, measured between two samples.'''
+
+    # Rough on-disk cost of a change, used to turn row counts into WAL bytes.
+    TUPLE_HEADER_BYTES = 24
+    INDEX_TUPLE_BYTES = 32
+    DEFAULT_ROW_BYTES = 100 # Empty or never analyzed tables
+
+    def __init__(self, src):
+        self.src = src
+        self.cursor = src.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        self.tables = []
+        self.elapsed = None
+        self.wal_bytes = None
+
+    def sample(self):
+        '''Take one sample of table write counters, sizes and the WAL position. One query.'''
+        self.cursor.execute('''SELECT t.relid, t.schemaname, t.relname, t.n_tup_ins, t.n_tup_upd, t.n_tup_del, t.n_tup_hot_upd,
+            pg_relation_size(t.relid) AS relation_size, pg_total_relation_size(t.relid) AS total_size, c.reltuples,
+            (SELECT count(*) FROM pg_index i WHERE i.indrelid = t.relid) AS indexes,
+            pg_wal_lsn_diff(pg_current_wal_lsn(), '0/0') AS wal_position
+            FROM pg_stat_user_tables t
+            JOIN pg_class c ON c.oid = t.relid
+            WHERE t.schemaname <> 'pglogicalmanager' ''')
+
+        rows = self.cursor.fetchall()
+        wal_position = rows[0]['wal_position'] if len(rows) > 0 else None
+
+        return {'time': monotonic(), 'wal_position': wal_position, 'tables': {row['relid']: dict(row) for row in rows}}
+
+    def refresh(self, interval=60.0):
+        '''Sample twice, interval seconds apart, and rank tables by estimated WAL written.'''
+        before = self.sample()
+        sleep(interval)
+        after = self.sample()
+
+        self.tables, self.elapsed, self.wal_bytes = _write_rates(before, after, self)
+
+    def layout(self, hot_share=0.2):
+        return _recommend_layout(self.tables, hot_share)
+
+    def show(self, interval=60.0, top=20):
+        print(Fore.BLUE, f'\bSampling table writes on the source for {interval} seconds...', Style.RESET_ALL)
+
+        self.refresh(interval)
+
+        print(Fore.GREEN)
+        print('\nTable write rates\n')
+
+        tables = [table for table in self.tables if table['rows_rate'] > 0][:top]
+
+        if len(tables) == 0:
+            print(f'No writes in the last {round(self.elapsed, 1)} seconds.')
+        else:
+            if self.wal_bytes is not None:
+                print(f'Total WAL written: {round(self.wal_bytes / self.elapsed, 1)} bytes/s\n')
+
+            table = PrettyTable(['Table name', 'Inserts/s', 'Updates/s', 'Deletes/s', 'Est. WAL bytes/s', 'WAL share', 'Total size'])
+
+            for row in tables:
+                table.add_row([f'{row["schemaname"]}.{row["relname"]}', _format_rate(row['ins_rate']),
+                               _format_rate(row['upd_rate']), _format_rate(row['del_rate']),
+                               _format_rate(row['wal_rate']), f'{round(row["share"] * 100, 1)}%', row['total_size']])
+
+            print(table)
+
+        print(Style.RESET_ALL)
+
+
+def _estimated_wal_bytes(table, ins, upd, hot_upd, dele, costs):
+    '''Estimate WAL written by a number of row changes to a table.'''
+    if table['reltuples'] is not None and table['reltuples'] > 0:
+        row_bytes = table['relation_size'] / table['reltuples']
+    else:
+        row_bytes = costs.DEFAULT_ROW_BYTES
+
+    # Inserts and updates write a new tuple; all but HOT updates also write every index.
+    heap = (ins + upd) * (row_bytes + costs.TUPLE_HEADER_BYTES)
+    indexes = (ins + upd - hot_upd) * table['indexes'] * costs.INDEX_TUPLE_BYTES
+    deletes = dele * costs.TUPLE_HEADER_BYTES
+
+    return heap + indexes + deletes
+
+
+def _write_rates(before, after, costs=HotTables):
+    '''Compute per-table write rates and estimated WAL contribution between two samples.
+
+    Returns tables (sorted by estimated WAL, largest first), elapsed seconds and WAL bytes written.'''
+    elapsed = max(after['time'] - before['time'], 1e-6)
+    wal_bytes = _delta(before['wal_position'], after['wal_position'])
+
+    tables = []
+
+    for relid, current in after['tables'].items():
+        previous = before['tables'].get(relid)
+
+        if previous is None:
+            continue
+
+        ins = current['n_tup_ins'] - previous['n_tup_ins']
+        upd = current['n_tup_upd'] - previous['n_tup_upd']
+        hot_upd = current['n_tup_hot_upd'] - previous['n_tup_hot_upd']
+        dele = current['n_tup_del'] - previous['n_tup_del']
+
+        table = dict(current)
+        table['ins_rate'] = ins / elapsed
+        table['upd_rate'] = upd / elapsed
+        table['del_rate'] = dele / elapsed
+        table['rows_rate'] = (ins + upd + dele) / elapsed
+        table['estimated_wal'] = _estimated_wal_bytes(current, ins, upd, hot_upd, dele, costs)
+        tables.append(table)
+
+    total = sum(table['estimated_wal'] for table in tables)
+
+    for table in tables:
+        table['share'] = table['estimated_wal'] / total if total > 0 else 0.0
+
+        # Attribute the WAL actually written to tables by their share of the estimate.
+        if wal_bytes is not None:
+            table['wal_rate'] = float(wal_bytes) * table['share'] / elapsed
+        else:
+            table['wal_rate'] = table['estimated_wal'] / elapsed
+
+    tables.sort(key=lambda table: (table['estimated_wal'], table['rows_rate']), reverse=True)
+
+    return tables, elapsed, wal_bytes
+
+
+def _recommend_layout(tables, hot_share=0.2):
+    '''Put every table writing at least hot_share of the WAL in its own publication, and the rest together.'''
+    publications = []
+    rest = []
+
+    for table in tables:
+        name = f'{table["schemaname"]}.{table["relname"]}'
+
+        if table['share'] >= hot_share:
+            publication_name = re.sub(r'[^a-z0-9_]', '_', table['relname'].lower())
+
+            # Same table name in two schemas.
+            if publication_name in (publication['name'] for publication in publications):
+                publication_name = re.sub(r'[^a-z0-9_]', '_', name.lower())
+
+            publications.append({
+                'name': publication_name,
+                'tables': [name],
+                'share': round(table['share'], 4),
+            })
+        else:
+            rest.append(table)
+
+    if len(rest) > 0:
+        publications.append({
+            'name': 'default',
+            'tables': sorted(f'{table["schemaname"]}.{table["relname"]}' for table in rest),
+            'share': round(sum(table['share'] for table in rest), 4),
+        })
+
+    return {'publications': publications}
+
+
+def _read_layout(path):
+    '''Read a publication layout written by analyze-hot-tables.'''
+    with open(path) as file:
+        layout = json.load(file)
+
+    return layout['publications']
+
+
+class ReplicaIdentities:
+    '''Tables whose replica identity breaks or slows down replication, on source and destination.'''
+
+    def __init__(self, src, dest):
+        self.src = src
+        self.dest = dest
+        self.problems = []
+
+    def refresh(self, tables=None):
+        '''Check tables (names, optionally schema qualified), or all tables if None. One catalog query per side.'''
+        self.problems = _identity_problems(_catalog(self.src, 'replica_identity'), _catalog(self.dest, 'replica_identity'),
+                                           tables=tables, dest_version=self.dest.server_version,
+                                           roots=_partition_roots(_catalog(self.src, 'partitions')))
+
+    def errors(self):
+        return [problem for problem in self.problems if problem['severity'] == 'error']
+
+    def show(self, tables=None):
+        self.refresh(tables)
+
+        print(Fore.GREEN)
+        print('\nReplica identity\n')
+
+        if len(self.problems) == 0:
+            print('\bAll tables can be replicated.', Style.RESET_ALL)
+        else:
+            table = PrettyTable(['Table name', 'Side', 'Severity', 'Problem', 'Total size', 'Updates+deletes/s'])
+            table.align['Problem'] = 'l'
+
+            for problem in self.problems:
+                table.add_row([problem['table'], problem['side'], problem['severity'], problem['problem'],
+                               problem['total_size'], _format_rate(problem['write_rate'])])
+
+            print(table)
+
+        print(Style.RESET_ALL)
+
+
+def _qualified_name(name):
+    return name if '.' in name else f'public.{name}'
+
+
+def _partition_roots(partitions):
+    '''Leaf partitions, by name, to the partitioned table at the top of their hierarchy.'''
+    return {f'{row["schemaname"]}.{row["relname"]}': f'{row["root_schema"]}.{row["root"]}' for row in partitions}
+
+
+def _collapse_partitions(rows, roots, key):
+    '''Merge rows of the partitions of a table which have the same key(row) into one row for the table.
+
+    Rows have a table, and a write_rate and total_size which add up, as do
+    statements, if they have any. Merged rows get how many partitions they
+    stand for, out of how many the table has.'''
+    totals = {}
+
+    for root in roots.values():
+        totals[root] = totals.get(root, 0) + 1
+
+    merged = {}
+    collapsed = []
+
+    for row in rows:
+        root = roots.get(row['table'])
+
+        if root is None:
+            collapsed.append(row)
+            continue
+
+        row = dict(row, table=root)
+        group = key(row)
+
+        if group not in merged:
+            merged[group] = dict(row, partitions=0, partitions_total=totals[root], write_rate=0.0, total_size=0, statements=[])
+            collapsed.append(merged[group])
+
+        merged[group]['partitions'] += 1
+        merged[group]['statements'] += row.get('statements', [])
+        merged[group]['write_rate'] += row.get('write_rate') or 0.0
+        merged[group]['total_size'] += row.get('total_size') or 0
+
+    return collapsed
+
+
+def _has_identity(table):
+    '''Can UPDATE and DELETE on this table be replicated, i.e. does it have a usable replica identity.'''
+    if table['relreplident'] == 'd':
+        return table['has_primary_key']
+    if table['relreplident'] == 'i':
+        return table['has_identity_index']
+    return table['relreplident'] == 'f'
+
+
+def _identity_problems(src_tables, dest_tables, tables=None, dest_version=None, roots=None):
+    '''Find tables with missing or slow replica identities.
+
+    Errors break replication: UPDATE and DELETE fail on the source without a
+    replica identity, and apply fails on the destination without one.
+    Warnings slow it down: REPLICA IDENTITY FULL makes apply find rows with a
+    sequential scan, unless the destination can use an index (PostgreSQL 16+).
+
+    Partitions (roots maps them to their partitioned table) are checked one
+    by one, and reported once per partitioned table and problem.
+
+    Sorted by severity, then size and write rate, largest first.'''
+    roots = roots or {}
+    scope = None if tables is None else {_qualified_name(table) for table in tables}
+    dest_tables = {f'{table["schemaname"]}.{table["relname"]}': table for table in dest_tables}
+    problems = []
+
+    for table in src_tables:
+        name = f'{table["schemaname"]}.{table["relname"]}'
+
+        if scope is not None and name not in scope and roots.get(name) not in scope:
+            continue
+
+        dest = dest_tables.get(name)
+
+        def problem(side, severity, description):
+            problems.append({'table': name, 'side': side, 'severity': severity, 'problem': description,
+                             'total_size': table['total_size'], 'write_rate': table['write_rate']})
+
+        if not _has_identity(table):
+            problem('source', 'error', 'No primary key or replica identity, UPDATE and DELETE will fail.')
+        elif table['relreplident'] == 'f':
+            if dest is None or dest_version is None or dest_version < 160000 or dest['indexes'] == 0:
+                problem('source', 'warning', 'REPLICA IDENTITY FULL, apply scans the whole table for every UPDATE and DELETE.')
+
+        if dest is None:
+            problem('destination', 'error', 'Table does not exist.')
+        elif _has_identity(table) and table['relreplident'] != 'f' and not _has_identity(dest):
+            problem('destination', 'error', 'No primary key or replica identity index, applying UPDATE and DELETE will fail.')
+
+    problems = _collapse_partitions(problems, roots, lambda problem: (problem['table'], problem['side'], problem['problem']))
+
+    for problem in problems:
+        if 'partitions' in problem:
+            problem['problem'] += f' ({problem["partitions"]} of {problem["partitions_total"]} partitions)'
+
+    problems.sort(key=lambda problem: (problem['severity'] != 'error', -problem['total_size'], -problem['write_rate']))
+
+    return problems
+
+
+class IndexReadiness:
+    '''Indexes on the source which the destination needs to apply changes quickly, and doesn't have.'''
+
+    def __init__(self, src, dest):
+        self.src = src
+        self.dest = dest
+        self.indexes = []
+
+    def refresh(self, all_indexes=False):
+        '''Compare indexes on both sides. One catalog query per side.'''
+        self.indexes = _index_readiness(_catalog(self.src, 'indexes'), _catalog(self.dest, 'indexes'),
+                                        _catalog(self.src, 'replica_identity'), _catalog(self.dest, 'replica_identity'),
+                                        all_indexes=all_indexes, roots=_partition_roots(_catalog(self.src, 'partitions')))
+
+    def script(self):
+        '''SQL fixing the destination, busiest tables first.'''
+        lines = ['-- CREATE INDEX CONCURRENTLY cannot run in a transaction, run this with psql as is.']
+
+        for index in self.indexes:
+            if index['statements'] and 'partitions' in index:
+                lines.append(f'\n-- {index["table"]}: {index["index"]} is {index["status"]} on {index["partitions"]} partition(s).'
+                             ' Partitions are independent: split them across sessions to build them in parallel.')
+                lines.extend(f'{statement};' for statement in index['statements'])
+            elif index['statements']:
+                lines.append(f'\n-- {index["table"]}: {index["index"]} is {index["status"]}.')
+                lines.extend(f'{statement};' for statement in index['statements'])
+
+        return '\n'.join(lines) + '\n'
+
+    def show(self, all_indexes=False):
+        self.refresh(all_indexes)
+
+        print(Fore.GREEN)
+        print('\nDestination indexes\n')
+
+        if len(self.indexes) == 0:
+            print('\bThe destination has all the indexes it needs.', Style.RESET_ALL)
+        else:
+            table = PrettyTable(['Table name', 'Source index', 'Identity', 'Status', 'Updates+deletes/s'])
+
+            for index in self.indexes:
+                table.add_row([index['table'], index['index'], index['identity'], index['status'], _format_rate(index['write_rate'])])
+
+            print(table)
+
+        print(Style.RESET_ALL)
+
+
+def _index_key(indexdef):
+    '''Index definition without the index name, so the same index compares equal on both sides.'''
+    return re.sub(r'^(CREATE (?:UNIQUE )?INDEX) (?:"(?:[^"]|"")+"|\S+) ON ', r'\1 ON ', indexdef)
+
+
+def _concurrently(indexdef):
+    return re.sub(r'^CREATE (UNIQUE )?INDEX ', r'CREATE \1INDEX CONCURRENTLY ', indexdef)
+
+
+def _index_readiness(src_indexes, dest_indexes, src_tables, dest_tables, all_indexes=False, roots=None):
+    '''Find source indexes which are missing, invalid or not the replica identity on the destination.
+
+    Apply finds rows by the destination's primary key or replica identity
+    index, so those matter; the rest only with all_indexes. Tables missing
+    on the destination are left to check-replica-identity.
+
+    Each index comes with the statements fixing it, and the list is sorted
+    by the table's write rate, busiest first. Indexes of partitions (roots
+    maps them to their partitioned table) are reported once per partitioned
+    table and status, with the statements for every partition.'''
+    write_rates = {f'{table["schemaname"]}.{table["relname"]}': table['write_rate'] for table in src_tables}
+    existing = {f'{table["schemaname"]}.{table["relname"]}' for table in dest_tables}
+    by_table = {}
+
+    for index in dest_indexes:
+        by_table.setdefault(f'{index["schemaname"]}.{index["relname"]}', []).append(index)
+
+    results = []
+
+    for index in src_indexes:
+        name = f'{index["schemaname"]}.{index["relname"]}'
+        identity = index['indisprimary'] or index['indisreplident']
+
+        if name not in existing or not (identity or all_indexes):
+            continue
+
+        candidates = by_table.get(name, [])
+        matches = [dest for dest in candidates if _index_key(dest['indexdef']) == _index_key(index['indexdef'])]
+        valid = [dest for dest in matches if dest['indisvalid']]
+        dest_has_identity = any(dest['indisvalid'] and (dest['indisprimary'] or dest['indisreplident']) for dest in candidates)
+        statements = []
+
+        if len(valid) > 0:
+            if not identity or dest_has_identity:
+                continue
+
+            status = 'not the replica identity'
+            statements.append(f'ALTER TABLE {index["quoted_table"]} REPLICA IDENTITY USING INDEX {valid[0]["quoted_name"]}')
+        else:
+            if len(matches) > 0:
+                status = 'invalid'
+                statements.extend(f'DROP INDEX CONCURRENTLY {dest["quoted_index"]}' for dest in matches)
+            else:
+                status = 'missing'
+
+            statements.append(_concurrently(index['indexdef']))
+
+            if identity and not dest_has_identity:
+                statements.append(f'ALTER TABLE {index["quoted_table"]} REPLICA IDENTITY USING INDEX {index["quoted_name"]}')
+
+        results.append({
+            'table': name,
+            'index': index['indexname'],
+            'identity': 'primary key' if index['indisprimary'] else ('replica identity' if index['indisreplident'] else ''),
+            'status': status,
+            'write_rate': write_rates.get(name, 0.0),
+            'statements': statements,
+        })
+
+    results = _collapse_partitions(results, roots or {}, lambda result: (result['table'], result['identity'], result['status']))
+
+    for result in results:
+        if result.get('partitions', 1) > 1:
+            result['index'] += f' and {result["partitions"] - 1} more'
+
+    results.sort(key=lambda result: (result['write_rate'], result['identity'] != ''), reverse=True)
+
+    return results
+
+
+class SyncProgress:
+    '''Initial copy progress of the tables of a subscription, measured between samples.
+
+    Bytes copied come from pg_stat_progress_copy (PostgreSQL 14+) on the
+    destination, and are compared with the size of the table on the source.
+    COPY sends text, which is rarely the same size as the table on disk, so
+    percentages and ETAs are estimates.'''
+
+    STATES = {'i': 'init', 'd': 'copying', 'f': 'copied', 's': 'synchronized', 'r': 'ready'}
+
+    def __init__(self, subscription):
+        self.subscription = subscription
+        self.tables = []
+        self.totals = None
+        self.sync_workers = None
+
+    def _dest_query(self):
+        if self.subscription.dest.server_version >= 140000:
+            copy_columns = 'p.bytes_processed, p.tuples_processed'
+            copy_join = 'LEFT JOIN pg_stat_progress_copy p ON p.pid = w.pid'
+        else:
+            copy_columns = 'NULL::bigint AS bytes_processed, NULL::bigint AS tuples_processed'
+            copy_join = ''
+
+        return f'''SELECT n.nspname || '.' || c.relname AS table_name, r.srsubstate, w.pid, {copy_columns},
+            current_setting('max_sync_workers_per_subscription')::int AS max_sync_workers
+            FROM pg_subscription_rel r
+            JOIN pg_subscription s ON s.oid = r.srsubid
+            JOIN pg_class c ON c.oid = r.srrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            LEFT JOIN pg_stat_subscription w ON w.subid = s.oid AND w.relid = r.srrelid
+            {copy_join}
+            WHERE s.subname = %s'''
+
+    def sample(self):
+        '''Take one sample of table states and bytes copied. One query per side.'''
+        subscription = self.subscription
+        rows = _poll(subscription.dest, self._dest_query(), (subscription.name,))
+        sizes = {}
+
+        if subscription.publication is not None:
+            sizes_rows = _poll(subscription.src, '''SELECT schemaname || '.' || tablename AS table_name,
+                pg_table_size(format('%%I.%%I', schemaname, tablename)::regclass) AS size
+                FROM pg_publication_tables WHERE pubname = %s''', (subscription.publication.name,))
+            sizes = {row['table_name']: row['size'] for row in sizes_rows}
+
+        tables = {}
+
+        for row in rows:
+            table = dict(row)
+            table['size'] = sizes.get(row['table_name'])
+            tables[row['table_name']] = table
+
+        max_sync_workers = rows[0]['max_sync_workers'] if len(rows) > 0 else None
+
+        return {'time': monotonic(), 'tables': tables, 'max_sync_workers': max_sync_workers}
+
+    def refresh(self, before, after):
+        self.tables, self.totals = _sync_progress(before, after)
+        self.sync_workers = (sum(1 for table in after['tables'].values() if table['pid'] is not None), after['max_sync_workers'])
+
+    def done(self):
+        return all(table['state'] == 'ready' for table in self.tables)
+
+    def show(self):
+        print(Fore.GREEN)
+        print(f'\nInitial sync of {self.subscription.name}\n')
+
+        if len(self.tables) == 0:
+            print('\bThe subscription has no tables.', Style.RESET_ALL)
+            return
+
+        table = PrettyTable(['Table name', 'State', 'Copied', 'Source size', 'Progress', 'Bytes/s', 'ETA'])
+
+        for row in self.tables:
+            table.add_row([row['table_name'], row['state'], _format_bytes(row['copied']), _format_bytes(row['size']),
+                           _format_percent(row['progress']), _format_rate(row['rate']), _format_eta(row['eta'])])
+
+        print(table)
+
+        totals = self.totals
+        workers, max_workers = self.sync_workers
+        print(f'\n{totals["ready"]} of {totals["tables"]} table(s) ready, {_format_percent(totals["progress"])} copied, '
+              f'{_format_rate(totals["rate"])} bytes/s, ETA {_format_eta(totals["eta"])}.')
+        print(f'{workers} of {max_workers} sync worker(s) busy (max_sync_workers_per_subscription).')
+        print(Style.RESET_ALL)
+
+
+def _sync_progress(before, after):
+    '''Per-table and total copy progress, throughput and ETA between two samples.'''
+    elapsed = max(after['time'] - before['time'], 1e-6)
+    tables = []
+
+    for name, current in after['tables'].items():
+        previous = before['tables'].get(name, {})
+        state = SyncProgress.STATES.get(current['srsubstate'], current['srsubstate'])
+        size = current['size']
+
+        if state in ('copied', 'synchronized', 'ready'):
+            copied = size
+        elif state == 'init':
+            copied = 0
+        else:
+            copied = current['bytes_processed']
+
+        rate = None
+
+        if current['bytes_processed'] is not None and previous.get('bytes_processed') is not None:
+            rate = max(current['bytes_processed'] - previous['bytes_processed'], 0) / elapsed
+
+        remaining = max(size - copied, 0) if size is not None and copied is not None else None
+
+        tables.append({
+            'table_name': name,
+            'state': state,
+            'copied': copied,
+            'size': size,
+            'progress': min(copied / size, 1.0) if size and copied is not None else None,
+            'rate': rate,
+            'remaining': remaining,
+            'eta': remaining / rate if remaining is not None and rate else None,
+        })
+
+    tables.sort(key=lambda table: (table['state'] == 'ready', -(table['remaining'] or 0)))
+
+    size = sum(table['size'] or 0 for table in tables)
+    copied = sum(table['copied'] or 0 for table in tables)
+    rates = [table['rate'] for table in tables if table['rate'] is not None]
+    rate = sum(rates) if len(rates) > 0 else None
+    remaining = sum(table['remaining'] or 0 for table in tables if table['state'] != 'ready')
+
+    totals = {
+        'tables': len(tables),
+        'ready': sum(1 for table in tables if table['state'] == 'ready'),
+        'progress': min(copied / size, 1.0) if size > 0 else None,
+        'rate': rate,
+        'eta': remaining / rate if rate else (0.0 if remaining == 0 else None),
+    }
+
+    return tables, totals
+
+
+def _format_bytes(value):
+    if value is None:
+        return 'N/A'
+
+    for unit in ('B', 'kB', 'MB', 'GB'):
+        if abs(value) < 1024:
+            return f'{round(value, 1)} {unit}'
+        value /= 1024
+
+    return f'{round(value, 1)} TB'
+
+
+def _format_percent(value):
+    if value is None:
+        return 'N/A'
+    return f'{round(value * 100, 1)}%'
+
+
+def _format_eta(seconds):
+    if seconds is None:
+        return 'N/A'
+
+    seconds = int(seconds)
+
+    return f'{seconds // 3600}:{seconds % 3600 // 60:02}:{seconds % 60:02}'
+
+
+class WalUsage:
+    '''WAL retained by replication slots on the source, sampled over time, and when it will exceed a budget.'''
+
+    def __init__(self, directory, src=None):
+        self.directory = directory
+        self.src = src
+        self.forecasts = []
+
+    def record(self, capacity=wal_usage.DEFAULT_CAPACITY):
+        '''Sample every slot and the current WAL position, in one query, and append them to their files.'''
+        # Fresh catalogs every time, in their own transaction.
+        _invalidate_catalogs(self.src)
+        _prefetch(self.src, ['replication_slots', 'wal_lsn'])
+
+        slots = ReplicationSlots(self.src)
+        slots.refresh()
+
+        now = time()
+        wal_lsn = lsn_to_int(_catalog(self.src, 'wal_lsn')[0]['pg_current_wal_lsn'])
+
+        for slot in slots.slots:
+            wal_usage.WalSamples.for_slot(self.directory, slot.name, capacity).append(
+                now, wal_lsn, lsn_to_int(slot.restart_lsn), lsn_to_int(slot.confirmed_flush_lsn))
+
+        # Slots that are gone are forgotten.
+        current = {slot.name for slot in slots.slots}
+
+        for name in wal_usage.slots(self.directory):
+            if name not in current:
+                os.remove(wal_usage.WalSamples.for_slot(self.directory, name).path)
+
+        return slots.slots
+
+    def refresh(self, budget, window=None):
+        self.forecasts = []
+
+        for name in wal_usage.slots(self.directory):
+            forecast = wal_usage.forecast(wal_usage.WalSamples.for_slot(self.directory, name).samples(), budget, window)
+            forecast['slot'] = name
+            self.forecasts.append(forecast)
+
+        # Soonest to run out first, slots that never do last.
+        self.forecasts.sort(key=lambda forecast: (forecast['seconds'] is None, forecast['seconds'] or 0, forecast['slot']))
+
+    def alerts(self, within):
+        '''Slots that exceed the budget within this many seconds.'''
+        return [forecast for forecast in self.forecasts if forecast['seconds'] is not None and forecast['seconds'] <= within]
+
+    def show(self, budget, window=None):
+        self.refresh(budget, window)
+
+        print(Fore.GREEN)
+        print(f'\nWAL retained by replication slots (budget: {_format_bytes(budget)})\n')
+
+        if len(self.forecasts) == 0:
+            print(f'No samples in {self.directory}. Is record-wal-usage running?')
+        else:
+            table = PrettyTable(['Slot name', 'Retained', 'Lag', 'WAL written/s', 'Applied/s', 'Growth/s', 'Over budget in'])
+
+            for forecast in self.forecasts:
+                table.add_row([
+                    forecast['slot'],
+                    _format_bytes(forecast['retained']),
+                    _format_bytes(forecast['lag']),
+                    _format_bytes(forecast['wal_rate']),
+                    _format_bytes(forecast['apply_rate']),
+                    _format_bytes(forecast['growth']),
+                    _format_eta(forecast['seconds']) if forecast['seconds'] is not None else 'Never',
+                ])
+
+            print(table)
+
+        print(Style.RESET_ALL)
+
+
+class SourceLoad:
+    '''Load on the source, from one cheap query per sample: busy sessions, bytes read from disk and WAL written.'''
+
+    QUERY = '''SELECT extract(epoch FROM clock_timestamp()) AS sampled_at,
+        (SELECT count(*) FROM pg_stat_activity
+            WHERE state = 'active' AND backend_type = 'client backend' AND pid <> pg_backend_pid()) AS active_sessions,
+        (SELECT sum(blks_read) FROM pg_stat_database) * current_setting('block_size')::bigint AS read_bytes,
+        pg_wal_lsn_diff(pg_current_wal_lsn(), '0/0') AS wal_bytes'''
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.before = None
+        self.load = {}
+
+    def refresh(self):
+        '''Sample, and compute the load since the previous sample. Rates are None on the first one.'''
+        after = {name: float(value) if value is not None else None for name, value in dict(_poll(self.conn, self.QUERY)[0]).items()}
+
+        self.load = _source_load(self.before, after)
+        self.before = after
+
+        return self.load
+
+
+def _source_load(before, after):
+    load = {'active_sessions': after['active_sessions'], 'read_rate': None, 'wal_rate': None}
+
+    if before is None or after['sampled_at'] <= before['sampled_at']:
+        return load
+
+    elapsed = after['sampled_at'] - before['sampled_at']
+    load['read_rate'] = _delta(before['read_bytes'], after['read_bytes']) / elapsed
+    load['wal_rate'] = _delta(before['wal_bytes'], after['wal_bytes']) / elapsed
+
+    return load
+
+
+def _format_load(load):
+    return (f'{int(load["active_sessions"])} active sessions, {_format_bytes(load["read_rate"])}/s read, '
+            f'{_format_bytes(load["wal_rate"])}/s WAL')
+
+
+def _load_limits(max_active_sessions, max_read_rate, max_wal_rate):
+    '''Limits for throttle.over_limits, from command line options. Sizes are per second.'''
+    return {
+        'active_sessions': max_active_sessions,
+        'read_rate': wal_usage.parse_size(max_read_rate) if max_read_rate is not None else None,
+        'wal_rate': wal_usage.parse_size(max_wal_rate) if max_wal_rate is not None else None,
+    }
+
+
+class BacklogSummary:
+    '''Changes in a pgoutput stream, by table, operation and transaction.'''
+
+    def __init__(self, top=10):
+        self.top = top
+        self.decoder = pgoutput.Decoder()
+        self.tables = {}
+        self.transactions = [] # Min-heap of the largest transactions
+        self.current = None
+        self.messages = 0
+        self.bytes = 0
+        self.commits = 0
+
+    def add(self, lsn, payload):
+        self.messages += 1
+        self.bytes += len(payload)
+
+        message = self.decoder.decode(payload)
+        kind = type(message)
+
+        if kind is pgoutput.Insert:
+            self._change('I', message.relation.relid, len(payload))
+        elif kind is pgoutput.Update:
+            self._change('U', message.relation.relid, len(payload))
+        elif kind is pgoutput.Delete:
+            self._change('D', message.relation.relid, len(payload))
+        elif kind is pgoutput.Begin:
+            self.current = {'xid': message.xid, 'changes': 0, 'bytes': 0, 'begin_lsn': lsn, 'relids': set()}
+        elif kind is pgoutput.Commit:
+            self.commits += 1
+
+            if self.current is not None:
+                self.current['commit_lsn'] = message.end_lsn
+                entry = (self.current['bytes'], self.current['xid'], self.current)
+
+                if len(self.transactions) < self.top:
+                    heapq.heappush(self.transactions, entry)
+                else:
+                    heapq.heappushpop(self.transactions, entry)
+
+            self.current = None
+        elif kind is pgoutput.Truncate:
+            relids = [relation.relid for relation in message.relations]
+
+            for relid in relids:
+                self._table(relid)['T'] += 1
+            self._count(len(payload), *relids)
+
+    def _change(self, op, relid, size):
+        table = self._table(relid)
+        table[op] += 1
+        table['bytes'] += size
+        self._count(size, relid)
+
+    def _table(self, relid):
+        table = self.tables.get(relid)
+
+        if table is None:
+            table = self.tables[relid] = {'I': 0, 'U': 0, 'D': 0, 'T': 0, 'bytes': 0}
+
+        return table
+
+    def _count(self, size, *relids):
+        if self.current is not None:
+            self.current['changes'] += 1
+            self.current['bytes'] += size
+            self.current['relids'].update(relids)
+
+    def largest_transactions(self):
+        return [entry[2] for entry in sorted(self.transactions, key=lambda entry: entry[:2], reverse=True)]
+
+    def table_name(self, relid):
+        relation = self.decoder.relations.get(relid)
+
+        if relation is None or relation.namespace is None:
+            return f'oid {relid}'
+
+        return f'{relation.namespace}.{relation.name}'
+
+
+class SlotInspector:
+    '''Summarize the changes waiting in a replication slot without consuming them.
+
+    Streams from a temporary copy of the slot over a replication connection
+    (PG 12+), or peeks at the slot itself, which must not be in use.'''
+
+    def __init__(self, src, slot_name, publications):
+        self.src = src
+        self.slot_name = slot_name
+        self.publications = publications
+
+    def _end_lsn(self):
+        cursor = self.src.cursor()
+        cursor.execute('SELECT pg_current_wal_lsn()')
+        lsn = cursor.fetchone()[0]
+        self.src.rollback()
+
+        return lsn
+
+    def stream(self, idle_timeout=5.0):
+        '''Stream (lsn, payload) from a temporary copy of the slot, up to the current end of WAL.'''
+        if self.src.server_version < 120000:
+            raise UnsupportedFeature(self.src.dsn, self.src.server_version, 'Copying replication slots', 12)
+
+        end_lsn = lsn_to_int(self._end_lsn())
+        copy_name = f'{self.slot_name}_inspect_{os.getpid()}'
+        conn = psycopg2.connect(_full_dsn(self.src), connect_timeout=5,
+                                connection_factory=psycopg2.extras.LogicalReplicationConnection)
+
+        try:
+            cursor = conn.cursor()
+
+            # Temporary slots go away with the connection, even if we crash.
+            query = 'SELECT pg_copy_logical_replication_slot(%s, %s, true)'
+            _debug(cursor.mogrify(query, (self.slot_name, copy_name)).decode('utf-8'))
+            cursor.execute(query, (self.slot_name, copy_name))
+
+            cursor.start_replication(slot_name=copy_name, decode=False, options={
+                'proto_version': '1',
+                'publication_names': ','.join(self.publications),
+            })
+
+            last_message = monotonic()
+
+            while True:
+                message = cursor.read_message()
+
+                if message is None:
+                    waited = monotonic() - last_message
+
+                    # Nothing else is coming for this publication.
+                    if waited >= idle_timeout:
+                        break
+
+                    select.select([cursor], [], [], idle_timeout - waited)
+                    continue
+
+                last_message = monotonic()
+
+                yield message.data_start, message.payload
+
+                if message.data_start >= end_lsn:
+                    break
+        finally:
+            conn.close()
+
+    def peek(self, limit=None, batch_size=10000):
+        '''Stream (lsn, payload) by peeking at the slot, up to the current end of WAL.'''
+        end_lsn = self._end_lsn()
+        cursor = self.src.cursor(name=f'{self.slot_name}_peek') # Server-side, fetches in batches
+        cursor.itersize = batch_size
+        query = '''SELECT lsn, data FROM pg_logical_slot_peek_binary_changes(%s, %s, %s,
+            'proto_version', '1', 'publication_names', %s)'''
+        params = (self.slot_name, end_lsn, limit, ','.join(self.publications))
+
+        _debug(cursor.mogrify(query, params).decode('utf-8'))
+        cursor.execute(query, params)
+
+        try:
+            for lsn, data in cursor:
+                yield lsn_to_int(lsn), data
+        finally:
+            cursor.close()
+            self.src.rollback()
+
+    def summarize(self, peek=False, top=10, limit=None, idle_timeout=5.0, record=None):
+        '''Summarize the backlog, optionally recording the raw stream to a file for pgoutput benchmarks.'''
+        messages = self.peek(limit=limit) if peek else self.stream(idle_timeout=idle_timeout)
+        summary = BacklogSummary(top=top)
+
+        for lsn, payload in messages:
+            summary.add(lsn, payload)
+
+            if record is not None:
+                pgoutput.write_stream(record, [(lsn, payload)])
+
+            if limit is not None and summary.messages >= limit:
+                break
+
+        return summary
+
+    def show(self, peek=False, top=10, limit=None, idle_timeout=5.0, record=None):
+        started = monotonic()
+        summary = self.summarize(peek=peek, top=top, limit=limit, idle_timeout=idle_timeout, record=record)
+        elapsed = max(monotonic() - started, 1e-6)
+
+        print(Fore.GREEN)
+        print(f'\nChanges waiting in "{self.slot_name}"\n')
+        print(f'{summary.commits} transactions, {summary.messages} messages, {summary.bytes} bytes '
+              f'read in {round(elapsed, 1)} seconds ({round(summary.messages / elapsed)} messages/s).\n')
+
+        if summary.decoder.skipped:
+            skipped = ', '.join(f'{count} {kind!r}' for kind, count in sorted(summary.decoder.skipped.items()))
+            print(f'Skipped messages of unknown types: {skipped}.\n')
+
+        if len(summary.tables) == 0:
+            print('No changes found.')
+        else:
+            table = PrettyTable(['Table name', 'Inserts', 'Updates', 'Deletes', 'Truncates', 'Bytes'])
+
+            for relid, counts in sorted(summary.tables.items(), key=lambda item: item[1]['bytes'], reverse=True):
+                table.add_row([summary.table_name(relid), counts['I'], counts['U'], counts['D'], counts['T'], counts['bytes']])
+
+            print(table)
+
+            print('\nLargest transactions\n')
+
+            table = PrettyTable(['XID', 'Changes', 'Bytes', 'First LSN', 'Commit LSN', 'Tables'])
+
+            for transaction in summary.largest_transactions():
+                table.add_row([transaction['xid'], transaction['changes'], transaction['bytes'],
+                               int_to_lsn(transaction['begin_lsn']), int_to_lsn(transaction['commit_lsn']),
+                               ', '.join(sorted(summary.table_name(relid) for relid in transaction['relids']))])
+
+            print(table)
+
+        print(Style.RESET_ALL)
+
+
+def _ensure_connected(source_only=False, prefetch=None):
+    '''Connect to source and destination, in parallel.
+
+    prefetch declares the catalogs the command reads, e.g. {'src': ['replication_slots'], 'dest': ['subscriptions']}.
+    They are fetched along with the privilege checks, so each server costs one round trip after connecting.'''
+    src_dsn = os.getenv('SOURCE_DB_DSN')
+    dest_dsn = os.getenv('DEST_DB_DSN')
+    prefetch = prefetch or {}
+
+    # Running in the agent: connections are already open, only fetch catalogs it doesn't have.
+    lent = getattr(_agent_connections, 'connections', None)
+
+    if lent is not None:
+        src, dest = lent
+        _track(src, 'Source')
+
+        if not source_only:
+            _track(dest, 'Destination')
+
+        try:
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                src_future = executor.submit(_prefetch, src, prefetch.get('src', ()))
+                dest_future = executor.submit(_prefetch, dest, prefetch.get('dest', ()))
+                src_future.result()
+                dest_future.result()
+        except (psycopg2.InterfaceError, psycopg2.OperationalError) as e:
+            print(Fore.RED, f'\bAgent lost its connection to source/destination DB: {e}', Style.RESET_ALL)
+            exit(1)
+
+        return src, None if source_only else dest
+
+    try:
+        print(Fore.BLUE, '\bConnecting to source and destination databases...', Style.RESET_ALL)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            src_future = executor.submit(_connect, src_dsn, prefetch.get('src', ()))
+
+            if not source_only:
+                dest_future = executor.submit(_connect, dest_dsn, prefetch.get('dest', ()))
+
+            src = src_future.result()
+            dest = dest_future.result() if not source_only else None
+
+        # Including the queries checking privileges and prefetching catalogs.
+        _track(src, 'Source', (0, 0.0))
+
+        if dest is not None:
+            _track(dest, 'Destination', (0, 0.0))
+
+        print(Fore.BLUE, '\bConnection established.', Style.RESET_ALL)
+    except (TypeError, psycopg2.ProgrammingError, psycopg2.OperationalError) as e:
+        print(
+            Fore.RED, f'\bCould not connect to source/destination DB: {e}', Style.RESET_ALL)
+        exit(1)
+    except NotSuperUserError as e:
+        print(
+            Fore.RED, f'\b{e.dsn} is not a SUPERUSER which is required.', Style.RESET_ALL)
+        exit(1)
+    except BelowMinimumVersion as e:
+        print(
+            Fore.RED, f'\b{e.dsn} (version: {e.server_version}): PostgreSQL 10 or higher is required.', Style.RESET_ALL)
+        exit(1)
+    finally:
+        print(Fore.BLUE, f'\bSource (primary): {src_dsn}', Style.RESET_ALL)
+        print(
+            Fore.BLUE, f'\bDestination (replica): {dest_dsn}', Style.RESET_ALL)
+
+    # Never mix them up, heh.
+    return src, dest
+
+
+class _Client(click.Group):
+    '''Sends the command to the agent instead, if one is running. See agent.py.'''
+
+    def main(self, args=None, **kwargs):
+        if getattr(_agent_connections, 'connections', None) is None:
+            from .agent import forward
+
+            exit_code = forward(sys.argv[1:] if args is None else list(args))
+
+            if exit_code is not None:
+                sys.exit(exit_code)
+
+        return super().main(args, **kwargs)
+
+
+@click.group(cls=_Client)
+@click.option('--stats', is_flag=True, default=False, help='Show how many queries the command sent to each server, and how long they took.')
+def main(stats):
+    '''PostgreSQL logical replication manager'''
+    _query_stats.connections = {}
+
+    if stats:
+        click.get_current_context().call_on_close(_show_stats)
+
+
+@main.command()
+@click.argument('name', required=True)
+def create_replication_slot(name):
+    '''Manually create a replication slot. Will be created on the source database.'''
+    src, _ = _ensure_connected(source_only=True, prefetch={'src': ['replication_slots']})
+
+    slot = ReplicationSlots(src).get(name)
+
+    if slot is not None:
+        print(Fore.GREEN,
+              f'\bReplication slot {name} already exists.', Style.RESET_ALL)
+    else:
+        ReplicationSlot.create(src, name)
+
+
+@main.command()
+@click.argument('name', required=True)
+def drop_replication_slot(name):
+    '''Manually drop a replication slot.'''
+    src, _ = _ensure_connected(source_only=True, prefetch={'src': ['replication_slots']})
+
+    slot = ReplicationSlots(src).get(name)
+
+    if slot is None:
+        print(Fore.GREEN,
+              f'\bReplication slot {name} does not exist.', Style.RESET_ALL)
+    else:
+        slot.drop()
+
+
+@main.command()
+@click.argument('name', required=True)
+@click.option('--publication', '-p', 'publications', multiple=True, help='Publication to decode changes for. Default is the publication of the subscription using the slot.')
+@click.option('--peek', is_flag=True, default=False, help='Peek at the slot instead of streaming a temporary copy of it. The slot must not be in use. Required before PostgreSQL 12.')
+@click.option('--top', default=10, help='Number of largest transactions to show. Default is 10.')
+@click.option('--limit', required=False, type=int, help='Stop after this many messages.')
+@click.option('--idle-timeout', default=5.0, help='Stop streaming when no changes arrive for this many seconds. Default is 5.')
+@click.option('--record', required=False, type=click.File('wb'), help='Also save the raw stream to this file, e.g. for benchmark-pgoutput.')
+def inspect_replication_slot(name, publications, peek, top, limit, idle_timeout, record):
+    '''Summarize the changes waiting in a replication slot by table and transaction. Does not consume the slot.'''
+    src, dest = _ensure_connected(prefetch={'src': ['replication_slots']})
+
+    if ReplicationSlots(src).get(name) is None:
+        print(Fore.GREEN,
+              f'\bReplication slot {name} does not exist.', Style.RESET_ALL)
+        return
+
+    if len(publications) == 0:
+        cursor = dest.cursor()
+        cursor.execute('SELECT subpublications FROM pg_subscription WHERE subslotname = %s', (name,))
+        row = cursor.fetchone()
+
+        if row is None:
+            print(Fore.RED, f'\bNo subscription uses {name}, please specify --publication.', Style.RESET_ALL)
+            exit(1)
+
+        publications = row[0]
+
+    try:
+        SlotInspector(src, name, publications).show(peek=peek, top=top, limit=limit, idle_timeout=idle_timeout, record=record)
+    except UnsupportedFeature as e:
+        print(Fore.RED, f'\b{e} Use --peek instead.', Style.RESET_ALL)
+        exit(1)
+
+
+@main.command()
+def list_replication_slots():
+    src, _ = _ensure_connected(source_only=True, prefetch={'src': ['replication_slots']})
+
+    ReplicationSlots(src).show()
+
+
+@main.command()
+def list_subscriptions():
+    '''List all current subscriptions.'''
+    src, dest = _ensure_connected(prefetch={'src': ['replication_slots', 'publications', 'wal_lsn'], 'dest': ['subscriptions']})
+    Subscriptions(src, dest).show()
+
+
+@main.command()
+@click.argument('name')
+@click.option('--enabled/--disabled', default=True, help='Start the subscription right after creation. Default is yes.')
+@click.option('--copy-data/--no-copy', default=False, help='Copy all existing data from publisher to subscriber. Default is no.')
+@click.option('--replication-slot', required=False, help='Replication slot on the source to attach the subscription to.')
+@click.option('--layout', required=False, type=click.Path(exists=True, dir_okay=False), help='Publication layout written by analyze-hot-tables. Creates one subscription per publication.')
+@click.option('--table', '-t', 'tables', multiple=True, help='Publish only this table. Can be repeated. Default is all tables.')
+@click.option('--streaming', type=click.Choice(['off', 'on', 'parallel', 'auto']), required=False, help='Stream large transactions before they commit. PostgreSQL 14+, parallel 16+. auto picks the best supported.')
+@click.option('--binary/--no-binary', default=None, help='Send data in binary format. PostgreSQL 14+.')
+@click.option('--disable-on-error/--no-disable-on-error', default=None, help='Disable the subscription when apply fails instead of retrying. PostgreSQL 15+.')
+@click.option('--failover/--no-failover', default=None, help='Sync the replication slot to standbys of the source, so it survives a failover. PostgreSQL 17+. Default is yes where supported.')
+@click.option('--via-partition-root', is_flag=True, default=False, help='Publish changes to partitions as changes to their partitioned table, e.g. when the destination partitions differently. '
+              'Partitioned tables are then copied by one worker, not one per partition. PostgreSQL 13+.')
+@click.option('--ignore-replica-identity', is_flag=True, default=False, help='Create the subscription even if tables have no replica identity.')
+@click.option('--wait-timeout', default=60.0, help='Seconds to wait for the subscription to start streaming. 0 doesn\'t wait. Default is 60.')
+@click.option('--wait-for-sync', is_flag=True, default=False, help='Also wait until the initial copy of all tables is done.')
+def create_subscription(name, enabled, copy_data, replication_slot, layout, tables, streaming, binary, disable_on_error, failover,
+                        via_partition_root, ignore_replica_identity, wait_timeout, wait_for_sync):
+    '''Create a logical replication subscription.'''
+    src, dest = _ensure_connected(prefetch={'src': SUBSCRIPTION_CATALOGS['src'] + ('replica_identity', 'partitions'),
+                                            'dest': SUBSCRIPTION_CATALOGS['dest'] + ('replica_identity',)})
+    options = {'streaming': streaming, 'binary': binary, 'disable_on_error': disable_on_error, 'failover': failover}
+
+    try:
+        # Check options before creating anything.
+        _subscription_options(src, dest, **options)
+
+        if via_partition_root and src.server_version < 130000:
+            raise UnsupportedFeature(src.dsn, src.server_version, 'publish_via_partition_root', 13)
+    except UnsupportedFeature as e:
+        print(Fore.RED, f'\b{e}', Style.RESET_ALL)
+        exit(1)
+
+    if layout is not None:
+        published = [table for publication in _read_layout(layout) for table in publication['tables']]
+    else:
+        published = list(tables) or None
+
+    identities = ReplicaIdentities(src, dest)
+    identities.refresh(published)
+
+    if len(identities.problems) > 0:
+        identities.show(published)
+
+        if len(identities.errors()) > 0 and not ignore_replica_identity:
+            print(Fore.RED, '\bFix the errors above first, or use --ignore-replica-identity.', Style.RESET_ALL)
+            exit(1)
+
+    if layout is None:
+        subscriptions = [Subscription.create(src, dest, name, copy_data=copy_data, enabled=enabled, replication_slot=replication_slot,
+                                             tables=list(tables), via_partition_root=via_partition_root, **options)]
+    elif len(tables) > 0:
+        print(Fore.RED, '\bThe layout already lists the tables, --table cannot be used with it.', Style.RESET_ALL)
+        exit(1)
+    elif replication_slot is not None:
+        print(Fore.RED, '\bA layout creates one replication slot per publication, --replication-slot cannot be used with it.', Style.RESET_ALL)
+        exit(1)
+    else:
+        subscriptions = [Subscription.create(src, dest, f'{name}_{publication["name"]}', copy_data=copy_data,
+                                             enabled=enabled, tables=publication['tables'], via_partition_root=via_partition_root, **options)
+                         for publication in _read_layout(layout)]
+
+    if not enabled or wait_timeout <= 0:
+        return
+
+    try:
+        for subscription in subscriptions:
+            if not subscription.enabed:
+                print(Fore.GREEN, f'\bSubscription {subscription.name} already exists and is disabled, not waiting for it.', Style.RESET_ALL)
+                continue
+
+            subscription.wait_until_streaming(wait_timeout)
+
+            if wait_for_sync and copy_data:
+                subscription.wait_until_synced()
+    except WaitTimeout as e:
+        print(Fore.RED, f'\bThe subscription was created, but: {e}', Style.RESET_ALL)
+        exit(1)
+
+
+@main.command()
+@click.argument('name')
+@click.argument('tables', nargs=-1, required=True)
+@click.option('--columns', '-c', required=False, help='Comma separated list of columns to publish. PostgreSQL 15+.')
+@click.option('--where', '-w', required=False, help='Publish only rows matching this expression. PostgreSQL 15+.')
+@click.option('--copy-data/--no-copy', default=True, help='Copy existing data of the new tables. Default is yes.')
+def add_subscription_tables(name, tables, columns, where, copy_data):
+    '''Add tables to a subscription. Only the new tables are copied, in parallel.'''
+    src, dest = _ensure_connected(prefetch=SUBSCRIPTION_CATALOGS)
+    sub = Subscriptions(src, dest).get(name)
+
+    if sub is None:
+        print(Fore.GREEN,
+              f'\bNo subscription with name {name} exists.', Style.RESET_ALL)
+        return
+    if sub.publication is None or sub.publication.all_tables:
+        print(Fore.RED, f'\bSubscription {name} does not use a FOR TABLE publication, it has all tables already.', Style.RESET_ALL)
+        exit(1)
+
+    specs = [{
+        'name': table,
+        'columns': columns.split(',') if columns else None,
+        'where': where,
+    } for table in tables]
+
+    try:
+        sub.add_tables(specs, copy_data=copy_data)
+    except UnsupportedFeature as e:
+        print(Fore.RED, f'\b{e}', Style.RESET_ALL)
+        exit(1)
+
+    if copy_data:
+        cursor = dest.cursor()
+        cursor.execute('SHOW max_sync_workers_per_subscription')
+        workers = cursor.fetchone()[0]
+
+        print(Fore.GREEN, f'\bCopying {len(tables)} new table(s), up to {workers} at a time (max_sync_workers_per_subscription).', Style.RESET_ALL)
+
+
+@main.command()
+@click.argument('name')
+@click.argument('tables', nargs=-1, required=True)
+def remove_subscription_tables(name, tables):
+    '''Stop replicating tables. Data already on the destination is kept.'''
+    src, dest = _ensure_connected(prefetch=SUBSCRIPTION_CATALOGS)
+    sub = Subscriptions(src, dest).get(name)
+
+    if sub is None:
+        print(Fore.GREEN,
+              f'\bNo subscription with name {name} exists.', Style.RESET_ALL)
+    elif sub.publication is None or sub.publication.all_tables:
+        print(Fore.RED, f'\bSubscription {name} does not use a FOR TABLE publication, tables cannot be removed from it.', Style.RESET_ALL)
+        exit(1)
+    else:
+        sub.drop_tables(list(tables))
+
+
+@main.command()
+@click.option('--table', '-t', 'tables', multiple=True, help='Check only this table. Can be repeated. Default is all tables.')
+def check_replica_identity(tables):
+    '''Find tables without a primary key or replica identity, or with REPLICA IDENTITY FULL, on both sides.'''
+    src, dest = _ensure_connected(prefetch={'src': ['replica_identity', 'partitions'], 'dest': ['replica_identity']})
+    ReplicaIdentities(src, dest).show(list(tables) or None)
+
+
+@main.command()
+@click.option('--all', 'all_indexes', is_flag=True, default=False, help='Check every index, not only the ones apply uses to find rows.')
+@click.option('--output', '-o', required=False, type=click.Path(dir_okay=False), help='Write a SQL script creating the missing indexes to this file.')
+def check_indexes(all_indexes, output):
+    '''Find indexes the destination needs to apply changes quickly, by comparing them with the source.'''
+    src, dest = _ensure_connected(prefetch={'src': ['indexes', 'replica_identity', 'partitions'], 'dest': ['indexes', 'replica_identity']})
+
+    readiness = IndexReadiness(src, dest)
+    readiness.show(all_indexes)
+
+    if output is not None:
+        with open(output, 'w') as file:
+            file.write(readiness.script())
+
+        print(Fore.GREEN, f'\bScript written to {output}. Run it on the destination: psql "$DEST_DB_DSN" -f {output}', Style.RESET_ALL)
+
+
+@main.command()
+@click.option('--file', '-f', 'path', required=True, type=click.Path(exists=True, dir_okay=False), help='Topology file, YAML or JSON.')
+@click.option('--dry-run', is_flag=True, default=False, help='Show the changes without making them.')
+def apply(path, dry_run):
+    '''Create, change and drop subscriptions, slots and publications to match a topology file.'''
+    from . import topology
+
+    try:
+        desired = topology.load(path)
+    except topology.TopologyError as e:
+        print(Fore.RED, f'\b{e}', Style.RESET_ALL)
+        exit(1)
+
+    src, dest = _ensure_connected(prefetch=topology.CATALOGS)
+    changes, conflicts = topology.plan(desired, topology.snapshot(src, dest))
+
+    for conflict in conflicts:
+        print(Fore.RED, f'\b{conflict}', Style.RESET_ALL)
+
+    if len(conflicts) > 0:
+        exit(1)
+
+    if len(changes) == 0:
+        print(Fore.GREEN, '\bNothing to do, the topology is up to date.', Style.RESET_ALL)
+        return
+
+    print(Fore.GREEN)
+    print('\nChanges\n')
+
+    table = PrettyTable(['Stage', 'Server', 'Change'])
+    table.align['Change'] = 'l'
+
+    for change in sorted(changes, key=lambda change: (change.stage, change.server != 'src')):
+        table.add_row([change.stage + 1, 'source' if change.server == 'src' else 'destination', change.description])
+
+    print(table)
+    print(Style.RESET_ALL)
+
+    if dry_run:
+        return
+
+    started = monotonic()
+
+    try:
+        topology.run(changes, src, dest)
+    except (UnsupportedFeature, WaitTimeout) as e:
+        print(Fore.RED, f'\b{e}', Style.RESET_ALL)
+        exit(1)
+
+    print(Fore.GREEN, f'\bApplied {len(changes)} change(s) in {round(monotonic() - started, 2)} seconds.', Style.RESET_ALL)
+
+
+@main.command()
+def list_publications():
+    '''List all publications on the source.'''
+    src, _ = _ensure_connected(source_only=True, prefetch={'src': ['publications']})
+    Publications(src).show()
+
+
+@main.command()
+@click.argument('name')
+def list_publication_tables(name):
+    '''List tables in a publication, with their column lists and row filters.'''
+    src, _ = _ensure_connected(source_only=True, prefetch={'src': ['publications']})
+    publication = Publications(src).get(name)
+
+    if publication is None:
+        print(Fore.GREEN,
+              f'\bNo publication with name {name} exists.', Style.RESET_ALL)
+        return
+
+    members = publication.members()
+
+    print(Fore.GREEN)
+    print(f'\nTables in "{name}"\n')
+
+    if len(members) == 0:
+        print('No tables found.')
+    else:
+        table = PrettyTable(['Table name', 'Columns', 'Row filter'])
+
+        for member in members:
+            columns = member.get('attnames')
+            table.add_row([f'{member["schemaname"]}.{member["tablename"]}',
+                           ', '.join(columns) if columns else 'all', member.get('rowfilter') or 'none'])
+
+        print(table)
+
+    print(Style.RESET_ALL)
+
+
+def _left_behind(sub, e):
+    '''Report what Subscription.drop left on the source when the slot wasn't released in time.'''
+    left = [f'replication slot {sub.slot.name}'] + ([f'publication {sub.publication.name}'] if sub.publication is not None else [])
+
+    print(Fore.RED, f'\b{e} Subscription {sub.name} was dropped on the destination, but {" and ".join(left)} '
+          f'are left on the source. Once the slot is released, drop it with drop-replication-slot {sub.slot.name}'
+          + (f' and the publication with DROP PUBLICATION {sub.publication.name}.' if sub.publication is not None else '.'), Style.RESET_ALL)
+
+
+@main.command()
+@click.argument('name')
+def drop_subscription(name):
+    '''Drop a logical replication subscription. This will stop the replication immediately.'''
+    src, dest = _ensure_connected(prefetch=SUBSCRIPTION_CATALOGS)
+    sub = Subscriptions(src, dest).get(name)
+
+    if sub is None:
+        print(Fore.GREEN,
+              f'\bNo subscription with name {name} exists.', Style.RESET_ALL)
+        return
+
+    try:
+        sub.drop()
+    except WaitTimeout as e:
+        _left_behind(sub, e)
+        exit(1)
+
+
+@main.command()
+@click.argument('name')
+@click.option('--streaming', type=click.Choice(['off', 'on', 'parallel', 'auto']), required=False, help='Stream large transactions before they commit. PostgreSQL 14+, parallel 16+. auto picks the best supported.')
+@click.option('--binary/--no-binary', default=None, help='Send data in binary format. PostgreSQL 14+.')
+@click.option('--disable-on-error/--no-disable-on-error', default=None, help='Disable the subscription when apply fails instead of retrying. PostgreSQL 15+.')
+@click.option('--failover/--no-failover', default=None, help='Sync the replication slot to standbys of the source. Restarts the subscription. PostgreSQL 17+.')
+def alter_subscription(name, streaming, binary, disable_on_error, failover):
+    '''Change streaming, binary transfer, error handling and slot failover of a subscription.'''
+    src, dest = _ensure_connected(prefetch=SUBSCRIPTION_CATALOGS)
+    sub = Subscriptions(src, dest).get(name)
+
+    if sub is None:
+        print(Fore.GREEN,
+              f'\bNo subscription with name {name} exists.', Style.RESET_ALL)
+        return
+
+    try:
+        sub.alter(streaming=streaming, binary=binary, disable_on_error=disable_on_error, failover=failover)
+    except UnsupportedFeature as e:
+        print(Fore.RED, f'\b{e}', Style.RESET_ALL)
+        exit(1)
+    except WaitTimeout as e:
+        print(Fore.RED, f'\b{e}', Style.RESET_ALL)
+        exit(1)
+
+
+@main.command()
+@click.argument('name')
+@click.option('--streaming', is_flag=True, default=False, help='Wait until the subscription is streaming from its replication slot.')
+@click.option('--synced', is_flag=True, default=False, help='Wait until the initial copy of all tables is done.')
+@click.option('--lag', required=False, type=int, help='Wait until replication lag is at most this many bytes.')
+@click.option('--stopped', is_flag=True, default=False, help='Wait until all workers of the subscription have stopped.')
+@click.option('--timeout', default=600.0, help='Give up after this many seconds. 0 waits forever. Default is 600.')
+def wait_for_subscription(name, streaming, synced, lag, stopped, timeout):
+    '''Wait until the subscription is streaming, synced, caught up or stopped. Exits with 1 on timeout.'''
+    src, dest = _ensure_connected(prefetch=SUBSCRIPTION_CATALOGS)
+    subscription = Subscriptions(src, dest).get(name)
+
+    if subscription is None:
+        print(Fore.RED, f'\bNo subscription with name {name} exists.', Style.RESET_ALL)
+        exit(1)
+
+    if not (streaming or synced or stopped or lag is not None):
+        streaming = True
 
-        self.cursor.execute(query, (self.table.name,))
+    timeout = timeout if timeout > 0 else None
+    started = monotonic()
 
-        self.columns = [Column.from_row(
-            self.conn, self.table, row) for row in self.cursor.fetchall()]
+    try:
+        if stopped:
+            subscription.wait_until_stopped(timeout)
+        if streaming:
+            subscription.wait_until_streaming(timeout)
+        if synced:
+            subscription.wait_until_synced(timeout)
+        if lag is not None:
+            subscription.wait_for_lag(lag, timeout)
+    except WaitTimeout as e:
+        print(Fore.RED, f'\b{e}', Style.RESET_ALL)
+        exit(1)
 
-    def show(self):
-        self.refresh()
+    print(Fore.GREEN, f'\bDone in {round(monotonic() - started, 1)} seconds.', Style.RESET_ALL)
 
-        print(Fore.GREEN)
-        print(f'\nColumns in "{self.table.name}"\n')
 
-        if len(self.columns) == 0:
-            print('No tables found.')
-        else:
-            table = PrettyTable(['Column name', 'Data type'])
+@main.command()
+@click.argument('name')
+@click.option('--interval', '-i', default=5.0, help='Seconds between samples. Default is 5.')
+@click.option('--watch', '-w', is_flag=True, default=False, help='Keep showing progress until all tables are ready.')
+def sync_progress(name, interval, watch):
+    '''Show initial copy progress of the tables of a subscription, with throughput and ETA.'''
+    src, dest = _ensure_connected(prefetch=SUBSCRIPTION_CATALOGS)
+    subscription = Subscriptions(src, dest).get(name)
+
+    if subscription is None:
+        print(Fore.RED, f'\bNo subscription with name {name} exists.', Style.RESET_ALL)
+        exit(1)
 
-            for column in self.columns:
-                table.add_row(column.to_list())
+    progress = SyncProgress(subscription)
+    before = progress.sample()
 
-            print(table)
+    while True:
+        sleep(interval)
+        after = progress.sample()
 
-        print(Style.RESET_ALL)
+        progress.refresh(before, after)
+        progress.show()
 
-    def get(self, name):
-        self.refresh()
+        if not watch or progress.done():
+            break
 
-        for column in self.columns:
-            if column.name == name:
-                return column
-        return None
+        before = after
 
 
-def _ensure_connected(source_only=False):
-    src_dsn = os.getenv('SOURCE_DB_DSN')
-    dest_dsn = os.getenv('DEST_DB_DSN')
+@main.command()
+@click.argument('names', nargs=-1)
+@click.option('--window', '-w', 'windows', multiple=True, help='When the subscriptions may run, e.g. "Mon-Fri 20:00-06:00". Can be repeated. Default is always.')
+@click.option('--max-active-sessions', type=int, default=None, help='Disable the subscriptions while the source has more active sessions.')
+@click.option('--max-read-rate', default=None, help='Disable the subscriptions while the source reads more from disk per second, e.g. 200MB.')
+@click.option('--max-wal-rate', default=None, help='Disable the subscriptions while the source writes more WAL per second, e.g. 50MB.')
+@click.option('--interval', '-i', default=30.0, help='Seconds between checks. Default is 30.')
+@click.option('--count', '-c', default=0, help='Number of checks. Default is 0, i.e. until stopped.')
+def throttle_subscriptions(names, windows, max_active_sessions, max_read_rate, max_wal_rate, interval, count):
+    '''Enable subscriptions inside their time windows while the source's load is within limits, and disable them otherwise.
+    Default is all subscriptions. Subscriptions disabled by anything else, e.g. by hand or after an apply error, are left disabled.'''
+    src, dest = _ensure_connected(prefetch=SUBSCRIPTION_CATALOGS)
 
     try:
-        print(Fore.BLUE, '\bConnecting to source and destination databases...', Style.RESET_ALL)
-        src = psycopg2.connect(src_dsn, connect_timeout=5)
+        windows = [throttle.parse_window(window) for window in windows]
+        limits = _load_limits(max_active_sessions, max_read_rate, max_wal_rate)
+    except ValueError as e:
+        print(Fore.RED, f'\b{e}', Style.RESET_ALL)
+        exit(1)
 
-        if not source_only:
-            dest = psycopg2.connect(dest_dsn, connect_timeout=5)
-        else:
-            dest = None
+    load = SourceLoad(src)
+    checks = 0
+    # Only subscriptions disabled here are enabled again, not those disabled by hand or by disable_on_error.
+    disabled = set()
 
-        print(Fore.BLUE, '\bConnection established.', Style.RESET_ALL)
+    while count == 0 or checks < count:
+        load.refresh()
+        scheduled = throttle.in_windows(windows)
 
-        if not _superuser(src) and not _memberof(src, role='rds_superuser'):
-            raise NotSuperUserError(src.dsn)
-        if dest is not None and not _superuser(dest) and not _memberof(src, role='rds_superuser'):
-            raise NotSuperUserError(dest.dsn)
-        if src.server_version < 100000:
-            raise BelowMinimumVersion(src.dsn, src.server_version)
-        if dest is not None and dest.server_version < 100000:
-            raise BelowMinimumVersion(src.dsn, src.server_version)
-    except (TypeError, psycopg2.ProgrammingError, psycopg2.OperationalError) as e:
-        print(
-            Fore.RED, f'\bCould not connect to source/destination DB: {e}', Style.RESET_ALL)
-        exit(1)
-    except NotSuperUserError as e:
-        print(
-            Fore.RED, f'\b{e.dsn} is not a SUPERUSER which is required.', Style.RESET_ALL)
-        exit(1)
-    except BelowMinimumVersion as e:
-        print(
-            Fore.RED, f'\b{e.dsn} (version: {e.server_version}): PostgreSQL 10 or higher is required.', Style.RESET_ALL)
-        exit(1)
-    finally:
-        print(Fore.BLUE, f'\bSource (primary): {src_dsn}', Style.RESET_ALL)
-        print(
-            Fore.BLUE, f'\bDestination (replica): {dest_dsn}', Style.RESET_ALL)
+        # Someone else may have enabled or disabled them since.
+        _invalidate_catalogs(dest)
+        _prefetch(dest, ['subscriptions'])
 
-    # Never mix them up, heh.
-    return src, dest
+        for row in _catalog(dest, 'subscriptions'):
+            if names and row['subname'] not in names:
+                continue
 
+            enabled, reason = throttle.decide(row['subenabled'], scheduled, load.load, limits)
 
-@click.group()
-def main():
-    '''PostgreSQL logical replication manager'''
-    pass
+            if enabled == row['subenabled'] or (enabled and row['subname'] not in disabled):
+                continue
 
+            subscription = Subscription.from_row(src, dest, row)
 
-@main.command()
-@click.argument('name', required=True)
-def create_replication_slot(name):
-    '''Manually create a replication slot. Will be created on the source database.'''
-    src, _ = _ensure_connected(source_only=True)
+            if enabled:
+                subscription.enable()
+                disabled.discard(subscription.name)
+                print(Fore.GREEN, f'\bEnabled {subscription.name}: {_format_load(load.load)}.', Style.RESET_ALL)
+                continue
 
-    slot = ReplicationSlots(src).get(name)
+            # Disabling stops table copies in progress, which then start over: worse for the source than finishing them.
+            if scheduled and any(table['srsubstate'] == 'd' for table in subscription.unsynced_tables()):
+                print(Fore.BLUE, f'\bNot disabling {subscription.name} for {reason}, it is copying tables.', Style.RESET_ALL)
+                continue
 
-    if slot is not None:
-        print(Fore.GREEN,
-              f'\bReplication slot {name} already exists.', Style.RESET_ALL)
-    else:
-        ReplicationSlot.create(src, name)
+            subscription.disable()
+            disabled.add(subscription.name)
+            print(Fore.BLUE, f'\bDisabled {subscription.name}, {reason}: {_format_load(load.load)}.', Style.RESET_ALL)
+
+        checks += 1
+
+        if count == 0 or checks < count:
+            sleep(interval)
 
 
 @main.command()
-@click.argument('name', required=True)
-def drop_replication_slot(name):
-    '''Manually drop a replication slot.'''
-    src, _ = _ensure_connected(source_only=True)
+@click.argument('name')
+@click.argument('tables', nargs=-1)
+@click.option('--rate', '-r', required=True, help='Bytes of tables to copy per second, on average, e.g. 20MB.')
+@click.option('--burst', default=None, help='Bytes of tables to copy right away, before the rate applies, e.g. 1GB. Default is a minute at --rate.')
+@click.option('--max-in-flight', default=2, help='Tables copying at the same time, a partitioned table counting once. Default is 2.')
+@click.option('--max-active-sessions', type=int, default=None, help='Wait while the source has more active sessions.')
+@click.option('--max-read-rate', default=None, help='Wait while the source reads more from disk per second, e.g. 200MB.')
+@click.option('--max-wal-rate', default=None, help='Wait while the source writes more WAL per second, e.g. 50MB.')
+def copy_tables(name, tables, rate, burst, max_in_flight, max_active_sessions, max_read_rate, max_wal_rate):
+    '''Add tables to a subscription one at a time, so copying them reads at most --rate bytes per second from the source.
+    Default is all tables not in the subscription yet, smallest first.'''
+    src, dest = _ensure_connected(prefetch={'src': SUBSCRIPTION_CATALOGS['src'] + ('replica_identity', 'publication_tables', 'partitions'),
+                                            'dest': SUBSCRIPTION_CATALOGS['dest']})
+    sub = Subscriptions(src, dest).get(name)
 
-    slot = ReplicationSlots(src).get(name)
+    if sub is None:
+        print(Fore.RED, f'\bNo subscription with name {name} exists.', Style.RESET_ALL)
+        exit(1)
+    if sub.publication is None or sub.publication.all_tables:
+        print(Fore.RED, f'\bSubscription {name} does not use a FOR TABLE publication, it has all tables already.', Style.RESET_ALL)
+        exit(1)
 
-    if slot is None:
-        print(Fore.GREEN,
-              f'\bReplication slot {name} does not exist.', Style.RESET_ALL)
-    else:
-        slot.drop()
+    try:
+        rate = wal_usage.parse_size(rate)
+        bucket = throttle.TokenBucket(rate, wal_usage.parse_size(burst) if burst is not None else rate * 60)
+        limits = _load_limits(max_active_sessions, max_read_rate, max_wal_rate)
+    except ValueError as e:
+        print(Fore.RED, f'\b{e}', Style.RESET_ALL)
+        exit(1)
 
+    # Unlogged and temporary tables can't be published.
+    rows = _catalog(src, 'replica_identity')
+    sizes = {f'{row["schemaname"]}.{row["relname"]}': int(row['total_size']) for row in rows if row['relpersistence'] == 'p'}
+    unlogged = {f'{row["schemaname"]}.{row["relname"]}' for row in rows if row['relpersistence'] != 'p'}
+    published = {row['table_name'] for row in _catalog_rows(src, 'publication_tables', 'pubname', sub.publication.name)}
+
+    # A partitioned table is copied as one, its partitions in parallel by the sync workers.
+    roots = _partition_roots(_catalog(src, 'partitions'))
+    units = {name: size for name, size in sizes.items() if name not in roots}
+
+    for partition, root in roots.items():
+        units[root] = units.get(root, 0) + sizes.get(partition, 0)
+
+    published |= {partition for partition, root in roots.items() if root in published}
+
+    if tables:
+        tables = [_qualified_name(table) for table in tables]
+        sizes.update(units)
+        unpublishable = [table for table in tables if table in unlogged]
+        unknown = [table for table in tables if table not in sizes and table not in unlogged]
+
+        if unpublishable:
+            print(Fore.RED, f'\bUnlogged or temporary tables can\'t be published: {", ".join(unpublishable)}.', Style.RESET_ALL)
+            exit(1)
+        if unknown:
+            print(Fore.RED, f'\bNo such table(s) on the source: {", ".join(unknown)}.', Style.RESET_ALL)
+            exit(1)
+    else:
+        sizes = units
+        tables = sorted(units, key=lambda table: units[table])
 
-@main.command()
-def list_replication_slots():
-    src, _ = _ensure_connected(source_only=True)
+    tables = [table for table in tables if table not in published]
+    load = SourceLoad(src)
+    load.refresh()
 
-    ReplicationSlots(src).show()
+    def copying():
+        '''Tables being copied, a partitioned table counting once.'''
+        return {roots.get(table['table_name'], table['table_name']) for table in sub.unsynced_tables()}
 
+    def ready():
+        return len(copying()) < max_in_flight and not throttle.over_limits(load.refresh(), limits)
 
-@main.command()
-def list_subscriptions():
-    '''List all current subscriptions.'''
-    src, dest = _ensure_connected()
-    Subscriptions(src, dest).show()
+    for i, table in enumerate(tables):
+        delay = bucket.delay(sizes[table])
 
+        if delay > 0:
+            print(Fore.BLUE, f'\bWaiting {_format_eta(delay)} for the rate limit before copying {table}...', Style.RESET_ALL)
 
-@main.command()
-@click.argument('name')
-@click.option('--enabled/--disabled', default=True, help='Start the subscription right after creation. Default is yes.')
-@click.option('--copy-data/--no-copy', default=False, help='Copy all existing data from publisher to subscriber. Default is no.')
-@click.option('--replication-slot', required=False, help='Replication slot on the source to attach the subscription to.')
-def create_subscription(name, enabled, copy_data, replication_slot):
-    '''Create a logical replication subscription.'''
-    src, dest = _ensure_connected()
-    Subscription.create(src, dest, name, copy_data=copy_data, enabled=enabled, replication_slot=replication_slot)
+        bucket.take(sizes[table])
 
+        # Rates need a few seconds between samples to mean anything.
+        _wait(ready, f'fewer than {max_in_flight} tables copying and the source load within limits', timeout=None,
+              show=lambda _: _format_load(load.load), initial=5.0, maximum=30.0)
 
-@main.command()
-@click.argument('name')
-def drop_subscription(name):
-    '''Drop a logical replication subscription. This will stop the replication immediately.'''
-    src, dest = _ensure_connected()
-    sub = Subscriptions(src, dest).get(name)
+        sub.add_tables([table], copy_data=True)
+        print(Fore.GREEN, f'\bCopying {table} ({_format_bytes(sizes[table])}), {i + 1} of {len(tables)}.', Style.RESET_ALL)
 
-    if sub is None:
-        print(Fore.GREEN,
-              f'\bNo subscription with name {name} exists.', Style.RESET_ALL)
-    else:
-        sub.drop()
+    print(Fore.GREEN, f'\bAdded {len(tables)} table(s). See the copy with sync-progress {name}.', Style.RESET_ALL)
 
 
 @main.command()
 @click.argument('name')
 def enable_subscription(name):
     '''Enable a logical replication subscription.'''
-    src, dest = _ensure_connected()
+    src, dest = _ensure_connected(prefetch=SUBSCRIPTION_CATALOGS)
     sub = Subscriptions(src, dest).get(name)
 
     if sub is None:
@@ -891,7 +3552,7 @@ def enable_subscription(name):
 @click.argument('name')
 def disable_subscription(name):
     '''Disable a logical replication subscription.'''
-    src, dest = _ensure_connected()
+    src, dest = _ensure_connected(prefetch=SUBSCRIPTION_CATALOGS)
     sub = Subscriptions(src, dest).get(name)
 
     if sub is None:
@@ -903,44 +3564,315 @@ def disable_subscription(name):
 
 @main.command()
 def list_replication_origins():
-    '''Show all replication origins.'''
-    _, dest = _ensure_connected()
-    ReplicationOrigins(dest).show()
+    '''Show all replication origins with their progress and subscription.'''
+    src, dest = _ensure_connected(prefetch={'src': ['replication_slots'], 'dest': ['replication_origins']})
+    ReplicationOrigins(dest, src=src).show()
 
 
 @main.command()
 @click.argument('origin')
 @click.option('--subscription', '-s', help='The name of the logical subscription using this origin.', required=True)
-@click.option('--lsn', '-l', help='The WAL offset (LSN) to rewind to. Example: 0/16EDE8A0', required=True)
-def rewind_replication_origin(origin, subscription, lsn):
+@click.option('--lsn', '-l', help='The WAL offset (LSN) to rewind to. Example: 0/16EDE8A0', required=False)
+@click.option('--ago', '-a', help='Rewind to where the subscription was this long ago, from its recorded history. Example: 10m', required=False)
+def rewind_replication_origin(origin, subscription, lsn, ago):
     '''Rewind logical subscription to LSN. Very dangerous.'''
-    src, dest = _ensure_connected()
-    origin = ReplicationOrigins(dest).get(origin)
+    if (lsn is None) == (ago is None):
+        print(Fore.RED, '\bSpecify either --lsn or --ago.', Style.RESET_ALL)
+        exit(1)
+
+    if ago is not None:
+        lsn = _history_lsn(subscription, ago)
+
+        if lsn is None:
+            exit(1)
+
+    src, dest = _ensure_connected(prefetch={'src': ['replication_slots', 'publications'], 'dest': ['subscriptions', 'replication_origins']})
+    origin_name = origin
+    origin = ReplicationOrigins(dest).get(origin_name)
     sub = Subscriptions(src, dest).get(subscription)
 
     if origin is None:
         print(Fore.GREEN,
-              f'\bNo origin with name {name} exists.', Style.RESET_ALL)
-    elif subscription is None:
+              f'\bNo origin with name {origin_name} exists.', Style.RESET_ALL)
+    elif sub is None:
         print(Fore.GREEN,
-              f'\bNo subscription with name {name} exists.', Style.RESET_ALL)
+              f'\bNo subscription with name {subscription} exists.', Style.RESET_ALL)
     else:
         origin.rewind(lsn, sub)
 
 
+def _history_lsn(subscription, ago):
+    '''Find the origin position of the subscription some time ago in its history.'''
+    try:
+        target = time() - parse_duration(ago)
+    except ValueError as e:
+        print(Fore.RED, f'\b{e}', Style.RESET_ALL)
+        return None
+
+    record = History.for_subscription(HISTORY_DIR, subscription).at(target)
+
+    if record is None:
+        print(Fore.RED, f'\bNo history recorded for {subscription} {ago} ago. Is record-replication-history running?', Style.RESET_ALL)
+        return None
+
+    timestamp, slot_lsn, origin_lsn = record
+
+    # The origin wasn't reporting progress yet, the slot position is the next best thing.
+    lsn = int_to_lsn(origin_lsn) or int_to_lsn(slot_lsn)
+
+    print(Fore.GREEN, f'\b{subscription} was at {lsn} {round(time() - timestamp)} seconds ago.', Style.RESET_ALL)
+
+    return lsn
+
+
+@main.command()
+@click.option('--interval', '-i', default=60.0, help='Seconds between samples. Default is 60.')
+@click.option('--count', '-c', default=0, help='Number of samples to take. Default is 0, i.e. until stopped.')
+def record_replication_history(interval, count):
+    '''Record slot and origin positions of every subscription, for rewind-replication-origin --ago.'''
+    src, dest = _ensure_connected()
+    origins = ReplicationOrigins(dest, src=src)
+    samples = 0
+
+    print(Fore.GREEN, f'\bRecording replication history to {HISTORY_DIR} every {interval} seconds.', Style.RESET_ALL)
+
+    while count == 0 or samples < count:
+        origins.record(HISTORY_DIR)
+        samples += 1
+
+        if count == 0 or samples < count:
+            sleep(interval)
+
+
+@main.command()
+@click.option('--interval', '-i', default=60.0, help='Seconds between samples. Default is 60.')
+@click.option('--count', '-c', default=0, help='Number of samples to take. Default is 0, i.e. until stopped.')
+@click.option('--capacity', default=wal_usage.DEFAULT_CAPACITY, help='Samples kept per slot, oldest are overwritten. Default is a week of minutes.')
+def record_wal_usage(interval, count, capacity):
+    '''Record the WAL written on the source and retained by every slot, for forecast-wal-usage.'''
+    src, _ = _ensure_connected(source_only=True)
+    usage = WalUsage(WAL_USAGE_DIR, src=src)
+    samples = 0
+
+    print(Fore.GREEN, f'\bRecording WAL usage to {WAL_USAGE_DIR} every {interval} seconds.', Style.RESET_ALL)
+
+    while count == 0 or samples < count:
+        usage.record(capacity)
+        samples += 1
+
+        if count == 0 or samples < count:
+            sleep(interval)
+
+
+@main.command()
+@click.option('--budget', '-b', default=WAL_BUDGET, help=f'WAL a slot may retain, e.g. 50GB. Default is {WAL_BUDGET} (WAL_BUDGET).')
+@click.option('--window', '-w', default=None, help='Measure rates over this much recent history, e.g. 1h. Default is all samples.')
+@click.option('--alert-within', default=None, help='Exit with an error if a slot will exceed the budget within this long, e.g. 24h.')
+def forecast_wal_usage(budget, window, alert_within):
+    '''Show WAL retained by every slot, how fast it grows, and when it will exceed the budget.'''
+    try:
+        budget = wal_usage.parse_size(budget)
+        window = parse_duration(window) if window is not None else None
+        alert_within = parse_duration(alert_within) if alert_within is not None else None
+    except ValueError as e:
+        print(Fore.RED, f'\b{e}', Style.RESET_ALL)
+        exit(1)
+
+    usage = WalUsage(WAL_USAGE_DIR)
+    usage.show(budget, window)
+
+    if alert_within is not None:
+        alerts = usage.alerts(alert_within)
+
+        for forecast in alerts:
+            print(Fore.RED, f'\b{forecast["slot"]} will retain more than {_format_bytes(budget)} of WAL in {_format_eta(forecast["seconds"])}.', Style.RESET_ALL)
+
+        if alerts:
+            exit(1)
+
+
+@main.command()
+@click.argument('subscription')
+@click.option('--last', '-n', default=20, help='Number of most recent samples to show. Default is 20.')
+def show_replication_history(subscription, last):
+    '''Show the recorded slot and origin positions of a subscription.'''
+    history = History.for_subscription(HISTORY_DIR, subscription)
+
+    if not os.path.exists(history.path):
+        print(Fore.GREEN, f'\bNo history recorded for {subscription}.', Style.RESET_ALL)
+        return
+
+    print(Fore.GREEN)
+    print(f'\nReplication history of "{subscription}"\n')
+
+    table = PrettyTable(['Seconds ago', 'Slot flushed LSN', 'Origin remote LSN'])
+    now = time()
+
+    for timestamp, slot_lsn, origin_lsn in history.records(last):
+        table.add_row([round(now - timestamp), int_to_lsn(slot_lsn), int_to_lsn(origin_lsn)])
+
+    print(table)
+    print(Style.RESET_ALL)
+
+
 @main.command()
 @click.argument('name')
 def reverse_subscription(name):
     '''Reverse the subscription. Source becomes destination, destination becomes source.
     Useful when primary becomes the replica and replica is promoted to primary.'''
-    src, dest = _ensure_connected()
+    src, dest = _ensure_connected(prefetch={'src': ['replication_slots', 'publications', 'wal_lsn'], 'dest': ['subscriptions']})
     sub = Subscriptions(src, dest).get(name)
 
     if sub is None:
         print(Fore.GREEN,
               f'\bNo subscription with name {name} exists.', Style.RESET_ALL)
-    else:
+        return
+
+    try:
         sub.reverse()
+    except WaitTimeout as e:
+        _left_behind(sub, e)
+        exit(1)
+
+
+def _connect_standby(standby):
+    '''Connect to the physical standby of the source, from --standby or STANDBY_DB_DSN.'''
+    dsn = standby or os.getenv('STANDBY_DB_DSN')
+
+    if dsn is None:
+        print(Fore.RED, '\bNo standby, use --standby or set STANDBY_DB_DSN.', Style.RESET_ALL)
+        exit(1)
+
+    try:
+        conn = _connect(dsn, ['replication_slots'])
+    except (psycopg2.ProgrammingError, psycopg2.OperationalError) as e:
+        print(Fore.RED, f'\bCould not connect to standby: {e}', Style.RESET_ALL)
+        exit(1)
+    except NotSuperUserError as e:
+        print(Fore.RED, f'\b{e.dsn} is not a SUPERUSER which is required.', Style.RESET_ALL)
+        exit(1)
+    except BelowMinimumVersion as e:
+        print(Fore.RED, f'\b{e.dsn} (version: {e.server_version}): PostgreSQL 10 or higher is required.', Style.RESET_ALL)
+        exit(1)
+
+    _track(conn, 'Standby', (0, 0.0))
+
+    return conn
+
+
+STANDBY_CATALOGS = {'src': ['replication_slots'], 'dest': ['subscriptions', 'replication_origins']}
+
+
+@main.command()
+@click.option('--standby', required=False, help='DSN of a physical standby of the source. Default is STANDBY_DB_DSN.')
+def list_standby_slots(standby):
+    '''Show whether every subscription would resume if the source failed over to the standby.'''
+    src, dest = _ensure_connected(prefetch=STANDBY_CATALOGS)
+    standby = _connect_standby(standby)
+
+    StandbySlots(src, dest, standby).show()
+
+
+@main.command()
+@click.option('--standby', required=False, help='DSN of a physical standby of the source. Default is STANDBY_DB_DSN.')
+@click.option('--interval', '-i', default=60.0, help='Seconds between syncs. Default is 60.')
+@click.option('--count', '-c', default=0, help='Number of syncs. Default is 0, i.e. until stopped.')
+def sync_standby_slots(standby, interval, count):
+    '''Keep the slots of every subscription on a physical standby of the source, so they survive a failover.'''
+    src, dest = _ensure_connected(prefetch=STANDBY_CATALOGS)
+    standby = _connect_standby(standby)
+    slots = StandbySlots(src, dest, standby)
+    syncs = 0
+
+    print(Fore.GREEN, f'\bSyncing slots to {standby.dsn} every {interval} seconds.', Style.RESET_ALL)
+
+    while count == 0 or syncs < count:
+        for conn, catalogs in ((src, STANDBY_CATALOGS['src']), (dest, STANDBY_CATALOGS['dest']), (standby, ['replication_slots'])):
+            _invalidate_catalogs(conn)
+            _prefetch(conn, catalogs)
+
+        try:
+            slots.sync()
+        except psycopg2.Error as e:
+            print(Fore.RED, f'\bCould not sync slots: {e}', Style.RESET_ALL)
+
+        syncs += 1
+
+        if count == 0 or syncs < count:
+            sleep(interval)
+
+    _prefetch(standby, ['replication_slots'])
+    slots.show()
+
+
+@main.command()
+@click.argument('name')
+@click.option('--timeout', default=60.0, help='Seconds to wait for the subscription to stop and to stream again. Default is 60.')
+def recover_subscription(name, timeout):
+    '''Resume a subscription after its source failed over to a standby and lost the replication slot.
+    Point SOURCE_DB_DSN at the new primary first.'''
+    src, dest = _ensure_connected(prefetch={'src': ['replication_slots', 'publications'], 'dest': ['subscriptions']})
+    subscription = Subscriptions(src, dest).get(name)
+
+    if subscription is None:
+        print(Fore.RED, f'\bNo subscription with name {name} exists.', Style.RESET_ALL)
+        exit(1)
+
+    try:
+        resume_lsn, slot_lsn, gap = subscription.recover(timeout)
+    except WaitTimeout as e:
+        print(Fore.RED, f'\b{e} The subscription is left disabled.', Style.RESET_ALL)
+        exit(1)
+    except Exception as e:
+        print(Fore.RED, f'\b{e}', Style.RESET_ALL)
+        exit(1)
+
+    print(Fore.GREEN, f'\b{name} resumes from {resume_lsn} on {src.dsn}, slot {subscription.slot.name} starts at {slot_lsn}.', Style.RESET_ALL)
+
+    if gap > 0:
+        print(Fore.RED, f'\bChanges in {_format_bytes(gap)} of WAL between {resume_lsn} and {slot_lsn} were not replicated. '
+              'Check rows written to the published tables around the failover.', Style.RESET_ALL)
+
+
+@main.command()
+def list_locks():
+    '''Show the locks held on the source and destination, by whom and since when.
+    Locks don't expire: one is held until its holder releases it or disconnects.'''
+    src, dest = _ensure_connected()
+
+    print(Fore.GREEN)
+    print('\nLocks\n')
+
+    table = PrettyTable(['Server', 'Object', 'Holder', 'Backend PID', 'Acquired at', 'Status'])
+
+    for server, conn in (('source', src), ('destination', dest)):
+        locks = Locks(conn)
+        locks.refresh()
+
+        for lock in locks.locks:
+            table.add_row([server, lock['object'], lock['holder'], lock['pid'], lock['acquired_at'], _lock_status(lock)])
+
+    if len(table.rows) == 0:
+        print('No locks held.')
+    else:
+        print(table)
+
+    print(Style.RESET_ALL)
+
+
+@main.command()
+@click.argument('key')
+def release_lock(key):
+    '''Release a lock on both servers, e.g. subscription/test_sub, whoever holds it.
+    Locks don't expire, so this is how to free one whose holder hangs while still connected.
+    Locks of holders that disconnected, e.g. after a crash, are taken over automatically.'''
+    src, dest = _ensure_connected()
+    released = [server for server, conn in (('source', src), ('destination', dest)) if Locks(conn).release(key)]
+
+    if released:
+        print(Fore.GREEN, f'\bReleased {key} on {" and ".join(released)}.', Style.RESET_ALL)
+    else:
+        print(Fore.GREEN, f'\bNo lock on {key}.', Style.RESET_ALL)
 
 
 def _write_config(source, destination):
@@ -970,7 +3902,7 @@ def reverse_configuration():
 @click.option('--source/--destination', help='List tables on the source or destination.', required=True)
 def list_tables(source):
     '''List the tables on the source/destination.'''
-    src, dest = _ensure_connected()
+    src, dest = _ensure_connected(prefetch={'src' if source else 'dest': ['tables', 'partitions']})
 
     if source:
         Tables(src).show()
@@ -983,7 +3915,7 @@ def list_tables(source):
 @click.option('--source/--destination', help='List the columns on the source or destination table.', required=True)
 def list_columns(table_name, source):
     '''List columns in a table. Specify source or destination if they are not in sync.'''
-    src, dest = _ensure_connected()
+    src, dest = _ensure_connected(prefetch={'src' if source else 'dest': ['tables', 'columns']})
 
     conn = src if source else dest
     conn_name = 'source' if source else 'destination'
@@ -995,6 +3927,87 @@ def list_columns(table_name, source):
     else:
         Columns(conn, table).show()
 
+
+@main.command()
+@click.option('--interval', '-i', default=5.0, help='Seconds between the two samples. Default is 5.')
+@click.option('--top', default=10, help='Number of busiest tables to show. Default is 10.')
+def subscription_stats(interval, top):
+    '''Show apply rates, errors and conflicts for subscriptions and tables on the destination.'''
+    _, dest = _ensure_connected()
+    SubscriptionStats(dest).show(interval=interval, top=top)
+
+
+@main.command()
+@click.option('--interval', '-i', default=60.0, help='Seconds between the two samples. Default is 60.')
+@click.option('--top', default=20, help='Number of busiest tables to show. Default is 20.')
+@click.option('--hot-share', default=0.2, help='Tables writing at least this share of the WAL get their own publication. Default is 0.2.')
+@click.option('--output', '-o', required=False, type=click.Path(dir_okay=False), help='Write the recommended publication layout to this file.')
+def analyze_hot_tables(interval, top, hot_share, output):
+    '''Rank source tables by write volume and recommend a publication layout.'''
+    src, _ = _ensure_connected(source_only=True)
+
+    tables = HotTables(src)
+    tables.show(interval=interval, top=top)
+
+    layout = tables.layout(hot_share=hot_share)
+
+    print(Fore.GREEN)
+    print('\nRecommended publications\n')
+
+    table = PrettyTable(['Publication', 'Tables', 'WAL share'])
+
+    for publication in layout['publications']:
+        table.add_row([publication['name'], len(publication['tables']), f'{round(publication["share"] * 100, 1)}%'])
+
+    print(table)
+    print(Style.RESET_ALL)
+
+    if output is not None:
+        with open(output, 'w') as file:
+            json.dump(layout, file, indent=2)
+
+        print(Fore.GREEN, f'\bLayout written to {output}. Use it with create-subscription --layout={output}.', Style.RESET_ALL)
+
+
+@main.command()
+@click.argument('recordings', nargs=-1, required=True, type=click.File('rb'))
+@click.option('--repeat', default=3, help='Decode each recording this many times and keep the best. Default is 3.')
+def benchmark_pgoutput(recordings, repeat):
+    '''Measure pgoutput decoding throughput on streams saved with inspect-replication-slot --record.'''
+    table = PrettyTable(['Recording', 'Messages', 'Bytes', 'Messages/s', 'MB/s'])
+
+    for recording in recordings:
+        result = pgoutput.benchmark(recording.read(), repeat=repeat)
+        table.add_row([recording.name, result['messages'], result['bytes'],
+                       round(result['messages_per_second']), round(result['mb_per_second'], 1)])
+
+    print(Fore.GREEN)
+    print('\npgoutput decoding\n')
+    print(table)
+    print(Style.RESET_ALL)
+
+
+@main.command()
+@click.option('--pool-size', default=4, help='Connections to keep open to each database. Default is 4.')
+@click.option('--catalog-ttl', default=1.0, help='Seconds to reuse fetched catalogs for. Default is 1.')
+def start_agent(pool_size, catalog_ttl):
+    '''Keep connections and catalogs warm and run commands for the CLI. Runs until stopped.'''
+    from .agent import Agent
+
+    Agent(AGENT_SOCKET, pool_size=pool_size, catalog_ttl=catalog_ttl).serve()
+
+
+@main.command()
+def stop_agent():
+    '''Stop the agent started with start-agent.'''
+    from .agent import stop
+
+    if stop(AGENT_SOCKET):
+        print(Fore.GREEN, '\bAgent stopped.', Style.RESET_ALL)
+    else:
+        print(Fore.GREEN, '\bNo agent is running.', Style.RESET_ALL)
+
+
 @main.command()
 def version():
     print(__version__)
@@ -0,0 +1,251 @@
+'''Streaming decoder for the pgoutput logical decoding protocol (version 1).
+
+Messages are parsed in place with struct over a memoryview of the payload.
+Column values in Insert, Update and Delete messages are memoryview slices
+of the payload, i.e. nothing is copied until the caller asks for it, e.g.
+with bytes(value) or str(value, 'utf-8'). Relation metadata is cached by
+the decoder, as the protocol sends it only once per relation per session.
+
+Streams can be recorded to a file and decoded offline, which is what the
+benchmark does.
+
+See https://www.postgresql.org/docs/current/protocol-logicalrep-message-formats.html
+'''
+
+import re
+import struct
+from collections import namedtuple
+from time import perf_counter
+
+Begin = namedtuple('Begin', ['final_lsn', 'commit_time', 'xid'])
+Commit = namedtuple('Commit', ['flags', 'lsn', 'end_lsn', 'commit_time'])
+Origin = namedtuple('Origin', ['lsn', 'name'])
+Relation = namedtuple('Relation', ['relid', 'namespace', 'name', 'replica_identity', 'columns'])
+Column = namedtuple('Column', ['name', 'type_oid', 'type_modifier', 'key'])
+Type = namedtuple('Type', ['oid', 'namespace', 'name'])
+Insert = namedtuple('Insert', ['relation', 'new'])
+Update = namedtuple('Update', ['relation', 'old', 'new'])  # old is None unless REPLICA IDENTITY is FULL or the key changed
+Delete = namedtuple('Delete', ['relation', 'old'])
+Truncate = namedtuple('Truncate', ['relations', 'cascade', 'restart_identity'])
+Message = namedtuple('Message', ['transactional', 'lsn', 'prefix', 'content'])
+
+# Value of a TOASTed column that didn't change, so wasn't sent.
+UNCHANGED_TOAST = object()
+
+_BEGIN = struct.Struct('>qqI')
+_COMMIT = struct.Struct('>bqqq')
+_INT8 = struct.Struct('>b')
+_INT16 = struct.Struct('>h')
+_INT32 = struct.Struct('>I')
+_INT64 = struct.Struct('>q')
+_COLUMN = struct.Struct('>Ii')
+_TRUNCATE = struct.Struct('>Ib')
+_MESSAGE = struct.Struct('>bq')
+
+_NUL = re.compile(b'\0')
+
+# Recorded streams: lsn and payload length, followed by the payload.
+_RECORD = struct.Struct('<QI')
+
+
+class DecodeError(Exception):
+    pass
+
+
+class Decoder:
+    '''Decodes pgoutput messages, one payload at a time.'''
+
+    def __init__(self):
+        self.relations = {}
+        self.types = {}
+        self.skipped = {} # Messages of unknown types, by type
+
+    def decode(self, payload):
+        '''Decode one message. Payload is any bytes-like object.
+
+        Message types this decoder doesn't know, e.g. from a newer protocol
+        version, are counted in skipped and decode to None.'''
+        view = payload if isinstance(payload, memoryview) else memoryview(payload)
+
+        if len(view) == 0:
+            raise DecodeError('Empty message.')
+
+        kind = view[0]
+
+        if kind == 0x49: # I
+            relation = self._relation(_INT32.unpack_from(view, 1)[0])
+            new, _ = self._tuple(view, 6)
+            return Insert(relation, new)
+        if kind == 0x55: # U
+            relation = self._relation(_INT32.unpack_from(view, 1)[0])
+            old = None
+            offset = 5
+
+            if view[offset] in (0x4B, 0x4F): # K or O
+                old, offset = self._tuple(view, offset + 1)
+
+            new, _ = self._tuple(view, offset + 1) # Skip N
+            return Update(relation, old, new)
+        if kind == 0x44: # D
+            relation = self._relation(_INT32.unpack_from(view, 1)[0])
+            old, _ = self._tuple(view, 6)
+            return Delete(relation, old)
+        if kind == 0x42: # B
+            return Begin(*_BEGIN.unpack_from(view, 1))
+        if kind == 0x43: # C
+            return Commit(*_COMMIT.unpack_from(view, 1))
+        if kind == 0x52: # R
+            return self._decode_relation(view)
+        if kind == 0x54: # T
+            count, options = _TRUNCATE.unpack_from(view, 1)
+            relids = struct.unpack_from(f'>{count}I', view, 6)
+            return Truncate(tuple(self._relation(relid) for relid in relids), bool(options & 1), bool(options & 2))
+        if kind == 0x4F: # O
+            lsn = _INT64.unpack_from(view, 1)[0]
+            name, _ = _string(view, 9)
+            return Origin(lsn, name)
+        if kind == 0x59: # Y
+            oid = _INT32.unpack_from(view, 1)[0]
+            namespace, offset = _string(view, 5)
+            name, _ = _string(view, offset)
+            self.types[oid] = Type(oid, namespace, name)
+            return self.types[oid]
+        if kind == 0x4D: # M
+            transactional, lsn = _MESSAGE.unpack_from(view, 1)
+            prefix, offset = _string(view, 10)
+            length = _INT32.unpack_from(view, offset)[0]
+            return Message(bool(transactional), lsn, prefix, view[offset + 4:offset + 4 + length])
+
+        self.skipped[chr(kind)] = self.skipped.get(chr(kind), 0) + 1
+
+        return None
+
+    def stream(self, messages):
+        '''Decode a stream of (lsn, payload), yielding (lsn, message).'''
+        decode = self.decode
+
+        for lsn, payload in messages:
+            yield lsn, decode(payload)
+
+    def _decode_relation(self, view):
+        relid = _INT32.unpack_from(view, 1)[0]
+        namespace, offset = _string(view, 5)
+        name, offset = _string(view, offset)
+        replica_identity = chr(view[offset])
+        count = _INT16.unpack_from(view, offset + 1)[0]
+        offset += 3
+        columns = []
+
+        for _ in range(count):
+            flags = view[offset]
+            column_name, offset = _string(view, offset + 1)
+            type_oid, type_modifier = _COLUMN.unpack_from(view, offset)
+            offset += 8
+            columns.append(Column(column_name, type_oid, type_modifier, bool(flags & 1)))
+
+        # Empty namespace means pg_catalog.
+        relation = Relation(relid, namespace or 'pg_catalog', name, replica_identity, tuple(columns))
+        self.relations[relid] = relation
+
+        return relation
+
+    def _relation(self, relid):
+        relation = self.relations.get(relid)
+
+        # Stream started after the Relation message was sent, e.g. a recording cut short.
+        if relation is None:
+            relation = self.relations[relid] = Relation(relid, None, f'oid {relid}', None, ())
+
+        return relation
+
+    def _tuple(self, view, offset):
+        '''Read TupleData. Returns the column values and the offset after them.'''
+        count = _INT16.unpack_from(view, offset)[0]
+        offset += 2
+        values = []
+        append = values.append
+        unpack_int32 = _INT32.unpack_from
+
+        for _ in range(count):
+            kind = view[offset]
+            offset += 1
+
+            if kind == 0x74 or kind == 0x62: # t (text) or b (binary)
+                length = unpack_int32(view, offset)[0]
+                offset += 4
+                append(view[offset:offset + length])
+                offset += length
+            elif kind == 0x6E: # n
+                append(None)
+            elif kind == 0x75: # u
+                append(UNCHANGED_TOAST)
+            else:
+                raise DecodeError(f'Unknown tuple value type {chr(kind)!r}.')
+
+        return tuple(values), offset
+
+
+def _string(view, offset):
+    '''Read a NUL-terminated string, return it and the offset after it.'''
+    # re searches the view's buffer in place, whatever it is a slice of: no copy of the rest of the payload.
+    match = _NUL.search(view, offset)
+
+    if match is None:
+        raise DecodeError('Unterminated string.')
+
+    end = match.start()
+
+    return str(view[offset:end], 'utf-8'), end + 1
+
+
+def write_stream(file, messages):
+    '''Record (lsn, payload) messages to a binary file object.'''
+    count = 0
+
+    for lsn, payload in messages:
+        file.write(_RECORD.pack(lsn, len(payload)))
+        file.write(payload)
+        count += 1
+
+    return count
+
+
+def read_stream(data):
+    '''Read (lsn, payload) messages from a recording. Payloads are views into data.'''
+    view = memoryview(data)
+    offset = 0
+    end = len(view)
+
+    while offset + _RECORD.size <= end:
+        lsn, length = _RECORD.unpack_from(view, offset)
+        offset += _RECORD.size
+        yield lsn, view[offset:offset + length]
+        offset += length
+
+
+def benchmark(data, repeat=3):
+    '''Decode a recorded stream repeat times. Returns the best run's throughput.'''
+    messages = list(read_stream(data))
+    size = sum(len(payload) for _, payload in messages)
+    best = None
+
+    for _ in range(repeat):
+        decoder = Decoder()
+        decode = decoder.decode
+        started = perf_counter()
+
+        for _, payload in messages:
+            decode(payload)
+
+        elapsed = perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+
+    best = max(best, 1e-9)
+
+    return {
+        'messages': len(messages),
+        'bytes': size,
+        'seconds': best,
+        'messages_per_second': len(messages) / best,
+        'mb_per_second': size / best / 1024 / 1024,
+    }
@@ -0,0 +1,147 @@
+'''Keep replication from overloading the source: a token bucket for copies, schedules and load limits for subscriptions.
+
+Initial copies are done by the destination's table sync workers, at full
+speed, so the tool throttles what it controls: how many bytes of tables it
+hands them per second, through a token bucket, and when subscriptions run,
+by enabling them inside their time windows while the source's load stays
+below its limits, and disabling them otherwise.
+'''
+
+import re
+from datetime import datetime, timedelta
+from time import monotonic, sleep as _sleep
+
+DAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+# A disabled subscription is enabled again only once load drops this far below its limits, so it doesn't flap.
+RESUME_RATIO = 0.8
+
+
+class TokenBucket:
+    '''Tokens, e.g. bytes, accrue at rate per second, up to capacity.
+
+    Taking more than capacity is allowed once the bucket is full, and leaves
+    it in debt, so a single large table still gets copied, and the tables after
+    it wait until it's paid off: the average rate never exceeds rate.'''
+
+    def __init__(self, rate, capacity=None, clock=monotonic, sleep=_sleep):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount):
+        '''Seconds until amount can be taken.'''
+        self._refill()
+
+        return max((min(amount, self.capacity) - self.tokens) / self.rate, 0.0)
+
+    def take(self, amount):
+        '''Wait until amount can be taken, and take it. Returns the seconds waited.'''
+        waited = 0.0
+        delay = self.delay(amount)
+
+        while delay > 0:
+            self.sleep(delay)
+            waited += delay
+            delay = self.delay(amount)
+
+        self.tokens -= amount
+
+        return waited
+
+
+class Window:
+    '''Days of the week and a time of day, e.g. Mon-Fri 20:00-06:00. A window past midnight belongs to the day it starts.'''
+
+    def __init__(self, days, start, end):
+        self.days = days # Weekday numbers, Monday is 0
+        self.start = start # Minutes since midnight
+        self.end = end
+
+    def __contains__(self, moment):
+        minute = moment.hour * 60 + moment.minute
+
+        if self.start < self.end:
+            return moment.weekday() in self.days and self.start <= minute < self.end
+
+        # Past midnight: the evening of a day, or the morning after.
+        if minute >= self.start:
+            return moment.weekday() in self.days
+
+        return minute < self.end and (moment - timedelta(days=1)).weekday() in self.days
+
+
+def _parse_days(spec):
+    days = set()
+
+    for part in spec.lower().split(','):
+        first, _, last = part.partition('-')
+
+        if first[:3] not in DAYS or (last and last[:3] not in DAYS):
+            raise ValueError(f'Invalid days: {spec}. Examples: Mon-Fri, Sat,Sun.')
+
+        start = DAYS.index(first[:3])
+        end = DAYS.index(last[:3]) if last else start
+        days.update((start + i) % 7 for i in range((end - start) % 7 + 1))
+
+    return days
+
+
+def _parse_time(spec):
+    hours, minutes = spec.split(':')
+
+    return int(hours) * 60 + int(minutes)
+
+
+def parse_window(spec):
+    '''Parse a window like "Mon-Fri 20:00-06:00", "Sat,Sun" or "22:00-05:00".'''
+    match = re.fullmatch(r'\s*([A-Za-z,\-]+)?\s*(?:(\d{1,2}:\d{2})\s*-\s*(\d{1,2}:\d{2}))?\s*', spec)
+
+    if match is None or match.group(1) is None and match.group(2) is None:
+        raise ValueError(f'Invalid window: {spec}. Examples: "Mon-Fri 20:00-06:00", "Sat,Sun", "22:00-05:00".')
+
+    days, start, end = match.groups()
+    days = _parse_days(days) if days else set(range(7))
+
+    if start is None:
+        return Window(days, 0, 24 * 60)
+
+    return Window(days, _parse_time(start), _parse_time(end))
+
+
+def in_windows(windows, moment=None):
+    '''Is the moment in any of the windows. No windows means always.'''
+    moment = moment or datetime.now()
+
+    return len(windows) == 0 or any(moment in window for window in windows)
+
+
+def over_limits(load, limits, ratio=1.0):
+    '''Metrics of load above ratio times their limit, e.g. ['active_sessions']. Limits of None are not checked.'''
+    return [name for name, limit in limits.items()
+            if limit is not None and load.get(name) is not None and load[name] > limit * ratio]
+
+
+def decide(enabled, scheduled, load, limits):
+    '''Should a subscription run: (enabled, reason).
+
+    It runs inside its schedule, as long as the source's load is within
+    limits. Once disabled for load, it's enabled again only when the load
+    is back under RESUME_RATIO of the limits.'''
+    if not scheduled:
+        return False, 'outside schedule'
+
+    over = over_limits(load, limits, 1.0 if enabled else RESUME_RATIO)
+
+    if over:
+        return False, 'source load: ' + ', '.join(over)
+
+    return True, None
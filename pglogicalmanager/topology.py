@@ -0,0 +1,358 @@
+'''Declarative replication topology: the subscriptions that should exist, and what it takes to get there.
+
+A topology file lists subscriptions on the destination. Their replication
+slots and publications on the source follow the same naming as
+create-subscription, i.e. <name>_slot and <name>_publication:
+
+    prune: false  # Drop subscriptions which aren't listed, with their slots and publications
+    subscriptions:
+      - name: orders
+        tables: [public.orders, public.items]  # Default is all tables
+        replication_slot: orders_slot          # Default is orders_slot
+        enabled: true                          # Default is true
+        copy_data: true                        # When creating the subscription or adding tables. Default is false
+        streaming: auto                        # streaming, binary and disable_on_error are left alone if not set
+        binary: true
+
+The plan is computed against one snapshot of the catalogs of both servers,
+so applying a topology that is already in place costs one query per server.
+Changes run in two stages, each on both servers at the same time:
+
+    1. source: create slots, create and alter publications; destination: drop subscriptions
+    2. source: drop slots and publications; destination: create, alter and refresh subscriptions
+'''
+
+import json
+import re
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .manager import (_catalog, _execute, _full_dsn, _qualified_name, _quote_table, _resolve_streaming,
+                      _subscription_options, _table_spec, _check_table_specs, _poll, _wait)
+
+# PyYAML is optional, topologies can also be written in JSON.
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+# Catalogs the plan is computed from.
+CATALOGS = {'src': ['replication_slots', 'publications', 'publication_tables'], 'dest': ['subscriptions']}
+
+SUBSCRIPTION_KEYS = {'name', 'tables', 'replication_slot', 'enabled', 'copy_data', 'streaming', 'binary', 'disable_on_error'}
+
+# Statements in the same group on the same server are sent together, see run().
+SLOTS, DDL, REFRESH = 'slots', 'ddl', 'refresh'
+
+Change = namedtuple('Change', ['stage', 'server', 'group', 'kind', 'name', 'args', 'description'])
+
+
+class TopologyError(Exception):
+    pass
+
+
+def load(path):
+    '''Read a topology from a YAML or JSON file.'''
+    with open(path) as file:
+        text = file.read()
+
+    if path.endswith('.json'):
+        topology = json.loads(text)
+    elif yaml is None:
+        raise TopologyError('PyYAML is needed to read YAML topologies: pip install pg-logical-manager[yaml]. Or use JSON.')
+    else:
+        topology = yaml.safe_load(text)
+
+    return validate(topology)
+
+
+def validate(topology):
+    '''Check a topology and fill in defaults.'''
+    if not isinstance(topology, dict) or not isinstance(topology.get('subscriptions', []), list):
+        raise TopologyError('A topology is a mapping with a list of subscriptions.')
+
+    subscriptions = []
+    names = set()
+
+    for subscription in topology.get('subscriptions', []):
+        if not isinstance(subscription, dict) or 'name' not in subscription:
+            raise TopologyError(f'Every subscription needs a name: {subscription}')
+
+        unknown = set(subscription) - SUBSCRIPTION_KEYS
+        name = subscription['name']
+
+        if unknown:
+            raise TopologyError(f'Unknown settings for subscription {name}: {", ".join(sorted(unknown))}')
+        if name in names:
+            raise TopologyError(f'Subscription {name} is listed twice.')
+
+        names.add(name)
+        subscriptions.append({
+            'name': name,
+            'tables': subscription.get('tables'),
+            'replication_slot': subscription.get('replication_slot') or f'{name}_slot',
+            'publication': f'{name}_publication',
+            'enabled': subscription.get('enabled', True),
+            'copy_data': subscription.get('copy_data', False),
+            'streaming': subscription.get('streaming'),
+            'binary': subscription.get('binary'),
+            'disable_on_error': subscription.get('disable_on_error'),
+        })
+
+    return {'prune': bool(topology.get('prune', False)), 'subscriptions': subscriptions}
+
+
+def snapshot(src, dest):
+    '''The state of both servers, from the catalogs prefetched when connecting.'''
+    publication_tables = {}
+    table_specs = {}
+
+    for row in _catalog(src, 'publication_tables'):
+        publication_tables.setdefault(row['pubname'], set()).add(row['table_name'])
+        table_specs[(row['pubname'], row['table_name'])] = {'columns': row.get('columns'), 'where': row.get('row_filter')}
+
+    return {
+        'slots': {row['slot_name'] for row in _catalog(src, 'replication_slots')},
+        'publications': {row['pubname']: row['puballtables'] for row in _catalog(src, 'publications')},
+        'publication_tables': publication_tables,
+        'table_specs': table_specs,
+        'subscriptions': {row['subname']: row for row in _catalog(dest, 'subscriptions')},
+        'src_version': src.server_version,
+        'dest_version': dest.server_version,
+    }
+
+
+def _table_name(spec):
+    return _qualified_name(spec if isinstance(spec, str) else spec['name'])
+
+
+def _normalize_filter(where):
+    '''Row filter without casts, parentheses, spaces or case, as Postgres deparses it with all of them.'''
+    if not where:
+        return None
+
+    where = re.sub(r'::(?:character varying|double precision|timestamp with(?:out)? time zone|"?\w+"?)(?:\[\])?', '', where)
+
+    return re.sub(r'[\s()]', '', where).lower()
+
+
+def _spec_differences(spec, current):
+    '''How a table's column list and row filter in the topology differ from the publication.'''
+    spec = {'name': spec} if isinstance(spec, str) else spec
+    differences = []
+
+    if set(spec.get('columns') or []) != set(current['columns'] or []):
+        differences.append(f'columns {", ".join(current["columns"] or ["all"])}, not {", ".join(spec.get("columns") or ["all"])}')
+    if _normalize_filter(spec.get('where')) != _normalize_filter(current['where']):
+        differences.append(f'row filter {current["where"] or "none"}, not {spec.get("where") or "none"}')
+
+    return differences
+
+
+def _current_options(row):
+    '''Subscription options as create-subscription renders them. Missing on versions without them.'''
+    options = {}
+    streaming = row.get('substream')
+
+    # Boolean before PG 16, then f, t or p.
+    if streaming is not None:
+        options['streaming'] = {True: 'on', False: 'off', 't': 'on', 'f': 'off', 'p': 'parallel'}[streaming]
+    if row.get('subbinary') is not None:
+        options['binary'] = str(row['subbinary']).lower()
+    if row.get('subdisableonerr') is not None:
+        options['disable_on_error'] = str(row['subdisableonerr']).lower()
+
+    return options
+
+
+def plan(topology, live):
+    '''Changes taking the live state to the topology. Returns changes and conflicts, which need a human.'''
+    changes = []
+    conflicts = []
+    wanted = {subscription['name'] for subscription in topology['subscriptions']}
+
+    def change(stage, server, group, kind, name, args, description):
+        changes.append(Change(stage, server, group, kind, name, args, description))
+
+    for subscription in topology['subscriptions']:
+        name = subscription['name']
+        slot = subscription['replication_slot']
+        publication = subscription['publication']
+        tables = subscription['tables']
+        existing = live['subscriptions'].get(name)
+
+        if slot not in live['slots']:
+            change(0, 'src', SLOTS, 'create_slot', slot, (), f'Create replication slot {slot}')
+
+        if publication not in live['publications']:
+            change(0, 'src', DDL, 'create_publication', publication, (tables,),
+                   f'Create publication {publication} for {len(tables)} table(s)' if tables else f'Create publication {publication} for all tables')
+        elif live['publications'][publication] != (not tables):
+            conflicts.append(f'Publication {publication} is {"" if live["publications"][publication] else "not "}FOR ALL TABLES. '
+                             'Drop it, or change the topology.')
+        elif tables:
+            current = live['publication_tables'].get(publication, set())
+            add = [table for table in tables if _table_name(table) not in current]
+            remove = sorted(current - {_table_name(table) for table in tables})
+
+            # Changing them in place would leave the destination with rows the new filter or columns don't match.
+            for table in tables:
+                current_spec = live['table_specs'].get((publication, _table_name(table)))
+                differences = _spec_differences(table, current_spec) if current_spec is not None else []
+
+                if differences:
+                    conflicts.append(f'Table {_table_name(table)} in publication {publication} has {" and ".join(differences)}. '
+                                     'Remove it from the topology, apply, then add it back to copy it again.')
+
+            if add:
+                change(0, 'src', DDL, 'add_tables', publication, (add,), f'Add {len(add)} table(s) to publication {publication}')
+            if remove:
+                change(0, 'src', DDL, 'drop_tables', publication, (remove,), f'Remove {len(remove)} table(s) from publication {publication}')
+            if existing is not None and (add or remove):
+                change(1, 'dest', REFRESH, 'refresh_publication', name, (subscription['copy_data'],),
+                       f'Refresh publication of subscription {name}')
+
+        if existing is None:
+            change(1, 'dest', DDL, 'create_subscription', name, (subscription,), f'Create subscription {name}')
+            continue
+
+        if existing['subslotname'] != slot or publication not in existing['subpublications']:
+            conflicts.append(f'Subscription {name} uses slot {existing["subslotname"]} and publications '
+                             f'{", ".join(existing["subpublications"])}, not {slot} and {publication}.')
+            continue
+
+        desired = {
+            'streaming': _resolve_streaming(subscription['streaming'], live['src_version'], live['dest_version']),
+            'binary': str(subscription['binary']).lower() if subscription['binary'] is not None else None,
+            'disable_on_error': str(subscription['disable_on_error']).lower() if subscription['disable_on_error'] is not None else None,
+        }
+        current = _current_options(existing)
+        options = {option: value for option, value in desired.items() if value is not None and current.get(option) != value}
+
+        if options:
+            change(1, 'dest', DDL, 'alter_subscription', name, (options,),
+                   f'Set {", ".join(f"{option} = {value}" for option, value in options.items())} on subscription {name}')
+
+        if existing['subenabled'] != subscription['enabled']:
+            kind = 'enable_subscription' if subscription['enabled'] else 'disable_subscription'
+            change(1, 'dest', DDL, kind, name, (), f'{"Enable" if subscription["enabled"] else "Disable"} subscription {name}')
+
+    if topology['prune']:
+        keep = {subscription['publication'] for subscription in topology['subscriptions']}
+        keep_slots = {subscription['replication_slot'] for subscription in topology['subscriptions']}
+
+        for name, existing in sorted(live['subscriptions'].items()):
+            if name in wanted:
+                continue
+
+            change(0, 'dest', DDL, 'drop_subscription', name, (), f'Drop subscription {name}')
+
+            if existing['subslotname'] in live['slots'] and existing['subslotname'] not in keep_slots:
+                change(1, 'src', DDL, 'drop_slot', existing['subslotname'], (), f'Drop replication slot {existing["subslotname"]}')
+
+            for publication in existing['subpublications']:
+                if publication in live['publications'] and publication not in keep:
+                    change(1, 'src', DDL, 'drop_publication', publication, (), f'Drop publication {publication}')
+
+    return changes, conflicts
+
+
+def render(change, src, dest):
+    '''SQL of one change.'''
+    conn = src if change.server == 'src' else dest
+    kind = change.kind
+    name = change.name
+
+    if kind == 'create_slot':
+        return conn.cursor().mogrify('SELECT pg_create_logical_replication_slot(%s, %s)', (name, 'pgoutput')).decode('utf-8')
+    if kind == 'create_publication':
+        tables = change.args[0]
+
+        if not tables:
+            return f'CREATE PUBLICATION {name} FOR ALL TABLES'
+
+        _check_table_specs(conn, tables)
+        return f'CREATE PUBLICATION {name} FOR TABLE {", ".join(_table_spec(table) for table in tables)}'
+    if kind == 'add_tables':
+        _check_table_specs(conn, change.args[0])
+        return f'ALTER PUBLICATION {name} ADD TABLE {", ".join(_table_spec(table) for table in change.args[0])}'
+    if kind == 'drop_tables':
+        return f'ALTER PUBLICATION {name} DROP TABLE {", ".join(_quote_table(table) for table in change.args[0])}'
+    if kind == 'drop_slot':
+        return conn.cursor().mogrify('SELECT pg_drop_replication_slot(%s)', (name,)).decode('utf-8')
+    if kind == 'drop_publication':
+        return f'DROP PUBLICATION {name}'
+    if kind == 'create_subscription':
+        subscription = change.args[0]
+        options = _subscription_options(src, dest, streaming=subscription['streaming'], binary=subscription['binary'],
+                                        disable_on_error=subscription['disable_on_error'])
+        options = ''.join(f', {option}' for option in options)
+        query = (f'CREATE SUBSCRIPTION {name} CONNECTION %s PUBLICATION {subscription["publication"]} '
+                 f'WITH (copy_data = {str(subscription["copy_data"]).lower()}, slot_name = {subscription["replication_slot"]}, '
+                 f'create_slot = false, enabled = {str(subscription["enabled"]).lower()}{options})')
+        return conn.cursor().mogrify(query, (_full_dsn(src),)).decode('utf-8')
+    if kind == 'alter_subscription':
+        options = _subscription_options(src, dest, **change.args[0])
+        return f'ALTER SUBSCRIPTION {name} SET ({", ".join(options)})'
+    if kind == 'enable_subscription':
+        return f'ALTER SUBSCRIPTION {name} ENABLE'
+    if kind == 'disable_subscription':
+        return f'ALTER SUBSCRIPTION {name} DISABLE'
+    if kind == 'refresh_publication':
+        return f'ALTER SUBSCRIPTION {name} REFRESH PUBLICATION WITH (copy_data = {str(change.args[0]).lower()})'
+    if kind == 'drop_subscription':
+        # Without a slot, DROP SUBSCRIPTION can run in the same transaction as the rest; the slot is dropped in stage 2.
+        return f'ALTER SUBSCRIPTION {name} DISABLE; ALTER SUBSCRIPTION {name} SET (slot_name = NONE); DROP SUBSCRIPTION {name}'
+
+    raise ValueError(f'Unknown change: {kind}')
+
+
+def _run_server(conn, statements):
+    '''Run a server's statements of one stage, in as few round trips as possible.
+
+    Slots are created before anything else is written in the transaction,
+    which Postgres requires, and REFRESH PUBLICATION can't run in a
+    transaction block, so those go on their own.'''
+    for group in (SLOTS, DDL):
+        batch = [statement for statement_group, statement in statements if statement_group == group]
+
+        if batch:
+            _execute(conn, batch)
+
+    for statement_group, statement in statements:
+        if statement_group == REFRESH:
+            _execute(conn, [statement])
+
+
+def _wait_inactive(src, slots):
+    '''Slots of dropped subscriptions stay active until their walsender exits.'''
+    query = 'SELECT count(*) FROM pg_replication_slots WHERE slot_name = ANY(%s) AND active'
+
+    _wait(lambda: _poll(src, query, (list(slots),))[0][0] == 0, 'dropped subscriptions to disconnect from their slots')
+
+
+def run(changes, src, dest):
+    '''Apply changes, stage by stage, on both servers at the same time.'''
+    # Render everything first, so unsupported options fail before anything changes.
+    rendered = [(change, render(change, src, dest)) for change in changes]
+
+    for stage in sorted({change.stage for change in changes}):
+        statements = {'src': [], 'dest': []}
+
+        for change, statement in rendered:
+            if change.stage == stage:
+                statements[change.server].append((change.group, statement))
+
+        dropped_slots = [change.name for change in changes if change.stage == stage and change.kind == 'drop_slot']
+
+        def run_src():
+            if dropped_slots:
+                _wait_inactive(src, dropped_slots)
+
+            _run_server(src, statements['src'])
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(run_src), executor.submit(_run_server, dest, statements['dest'])]
+
+            for future in futures:
+                future.result()
@@ -0,0 +1,62 @@
+'''Wait for a condition, polling quickly at first and backing off exponentially.
+
+Most conditions the tool waits for hold within milliseconds (a worker
+stopping, a slot becoming active), a few take minutes or hours (lag
+catching up, tables syncing). Starting with a short interval and
+doubling it up to a cap finishes the quick ones as soon as they hold,
+without polling the server many times a second on the slow ones.
+'''
+
+from time import monotonic, sleep as _sleep
+
+
+class WaitTimeout(Exception):
+    def __init__(self, description, elapsed, value):
+        super().__init__()
+        self.description = description
+        self.elapsed = elapsed
+        self.value = value # Last value of the check
+
+    def __str__(self):
+        return f'Timed out after {round(self.elapsed, 1)} seconds waiting for {self.description}.'
+
+
+def backoff(initial=0.05, maximum=5.0, factor=2.0):
+    '''Poll intervals: initial, initial * factor, and so on, up to maximum.'''
+    interval = initial
+
+    while True:
+        yield interval
+        interval = min(interval * factor, maximum)
+
+
+def wait_for(check, description, timeout=60.0, initial=0.05, maximum=5.0, factor=2.0, progress=None,
+             clock=monotonic, sleep=_sleep):
+    '''Call check until it returns a true value, and return that value.
+
+    progress(value, elapsed) is called after every check that failed, with
+    what it returned, e.g. to report the remaining lag. Raises WaitTimeout
+    if the condition doesn't hold within timeout seconds; None waits forever.'''
+    started = clock()
+    intervals = backoff(initial, maximum, factor)
+
+    while True:
+        value = check()
+        elapsed = clock() - started
+
+        if value:
+            return value
+
+        if timeout is not None and elapsed >= timeout:
+            raise WaitTimeout(description, elapsed, value)
+
+        if progress is not None:
+            progress(value, elapsed)
+
+        interval = next(intervals)
+
+        # Check one last time right at the deadline.
+        if timeout is not None:
+            interval = min(interval, timeout - elapsed)
+
+        sleep(interval)
@@ -0,0 +1,178 @@
+'''WAL written on the source and retained by each replication slot, sampled over time.
+
+Every slot gets its own file: a header, then a ring of fixed-width samples:
+
+    header: magic (4 bytes), capacity (uint32), samples written (uint64)
+    sample: timestamp (float64), pg_current_wal_lsn (uint64), slot restart_lsn (uint64), slot confirmed_flush_lsn (uint64)
+
+Once the ring is full, the oldest sample is overwritten, so a collector can
+run for months in constant disk space, and reading a file back never takes
+more than capacity samples (~320 kB at the default week of minutes).
+'''
+
+import os
+import re
+import struct
+
+from .history import INVALID_LSN
+
+HEADER = struct.Struct('<4sIQ')
+SAMPLE = struct.Struct('<dQQQ')
+MAGIC = b'PGWU'
+
+# A week of samples taken every minute.
+DEFAULT_CAPACITY = 7 * 24 * 60
+
+_SIZE_UNITS = {'': 1, 'b': 1, 'kb': 1024, 'mb': 1024 ** 2, 'gb': 1024 ** 3, 'tb': 1024 ** 4}
+
+
+def parse_size(size):
+    '''Parse a size like 512MB, 50GB or 1.5TB into bytes. Units are powers of 1024.'''
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmgt]?b?)\s*', size, re.IGNORECASE)
+
+    if match is None:
+        raise ValueError(f'Invalid size: {size}. Examples: 512MB, 50GB, 1TB.')
+
+    value, unit = match.groups()
+
+    return int(float(value) * _SIZE_UNITS[unit.lower()])
+
+
+class WalSamples:
+    '''Sample ring of one slot.'''
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.capacity = capacity # Only used when creating the file
+
+    @classmethod
+    def for_slot(cls, directory, slot, capacity=DEFAULT_CAPACITY):
+        return cls(os.path.join(directory, f'{slot}.wal'), capacity)
+
+    def _header(self, file):
+        file.seek(0)
+        data = file.read(HEADER.size)
+
+        if len(data) < HEADER.size:
+            return None
+
+        magic, capacity, written = HEADER.unpack(data)
+
+        if magic != MAGIC or capacity == 0:
+            raise ValueError(f'{self.path} is not a WAL usage file.')
+
+        return capacity, written
+
+    def append(self, timestamp, wal_lsn, restart_lsn, flushed_lsn):
+        '''Add a sample, overwriting the oldest one if the ring is full.
+
+        restart_lsn never goes backwards on the same slot and server: when it
+        does, the source was restored from a backup or failed over to a
+        standby that was behind, and the ring starts over rather than mix
+        the two histories.'''
+        directory = os.path.dirname(self.path)
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(self.path, 'r+b' if os.path.exists(self.path) else 'w+b') as file:
+            header = self._header(file)
+            capacity, written = header if header is not None else (self.capacity, 0)
+
+            if written > 0 and restart_lsn != INVALID_LSN:
+                file.seek(HEADER.size + ((written - 1) % capacity) * SAMPLE.size)
+                data = file.read(SAMPLE.size)
+
+                if len(data) == SAMPLE.size and restart_lsn < SAMPLE.unpack(data)[2]:
+                    written = 0
+                    file.seek(0)
+                    file.write(HEADER.pack(MAGIC, capacity, written))
+                    file.truncate(HEADER.size)
+
+            file.seek(HEADER.size + (written % capacity) * SAMPLE.size)
+            file.write(SAMPLE.pack(timestamp, wal_lsn, restart_lsn, flushed_lsn))
+
+            # The header is written last: a crash before it leaves the previous samples intact.
+            file.seek(0)
+            file.write(HEADER.pack(MAGIC, capacity, written + 1))
+
+    def samples(self):
+        '''Samples in the ring, oldest first.'''
+        if not os.path.exists(self.path):
+            return []
+
+        with open(self.path, 'rb') as file:
+            header = self._header(file)
+
+            if header is None:
+                return []
+
+            capacity, written = header
+            data = file.read(capacity * SAMPLE.size)
+
+        count = min(written, capacity, len(data) // SAMPLE.size)
+        first = written % capacity if written > capacity else 0
+
+        return [SAMPLE.unpack_from(data, ((first + i) % capacity) * SAMPLE.size) for i in range(count)]
+
+
+def slots(directory):
+    '''Slots with samples in directory.'''
+    if not os.path.isdir(directory):
+        return []
+
+    return sorted(name[:-len('.wal')] for name in os.listdir(directory) if name.endswith('.wal'))
+
+
+def forecast(samples, budget, window=None):
+    '''Rates over the last window seconds of samples, and when retained WAL exceeds budget bytes.
+
+    Retained WAL is what the slot keeps on the source's disk: the WAL written
+    since its restart_lsn. growth is how fast that changed over the window.
+    restart_lsn only moves at checkpoints and can stay well behind what the
+    subscriber confirmed, so this, not the WAL insert rate less the apply
+    rate, is what fills the disk. seconds is when the budget is exceeded at
+    that growth: 0 if it already is, None if retained WAL isn't growing.'''
+    result = {'retained': None, 'lag': None, 'wal_rate': None, 'apply_rate': None, 'growth': None, 'seconds': None}
+
+    if len(samples) == 0:
+        return result
+
+    timestamp, wal_lsn, restart_lsn, flushed_lsn = samples[-1]
+
+    if restart_lsn != INVALID_LSN:
+        result['retained'] = max(wal_lsn - restart_lsn, 0)
+
+    if flushed_lsn != INVALID_LSN:
+        result['lag'] = max(wal_lsn - flushed_lsn, 0)
+
+    if window is not None:
+        samples = [sample for sample in samples if sample[0] >= timestamp - window]
+
+    first = samples[0]
+    elapsed = timestamp - first[0]
+
+    if elapsed <= 0:
+        return result
+
+    result['wal_rate'] = (wal_lsn - first[1]) / elapsed
+
+    # A slot that hasn't confirmed anything yet applies nothing.
+    if first[3] != INVALID_LSN and flushed_lsn != INVALID_LSN:
+        result['apply_rate'] = (flushed_lsn - first[3]) / elapsed
+    else:
+        result['apply_rate'] = 0.0
+
+    # A slot that lost its WAL retains nothing.
+    if first[2] != INVALID_LSN and restart_lsn != INVALID_LSN:
+        result['growth'] = (result['retained'] - max(first[1] - first[2], 0)) / elapsed
+
+    if result['growth'] is None:
+        return result
+
+    if result['retained'] >= budget:
+        result['seconds'] = 0.0
+    elif result['growth'] > 0:
+        result['seconds'] = (budget - result['retained']) / result['growth']
+
+    return result
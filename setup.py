@@ -20,7 +20,8 @@ setuptools.setup(
         'python-dotenv>=0.10.3',
     ],
     extras_require={
-        'dev': 'pytest'
+        'dev': 'pytest',
+        'yaml': 'PyYAML',
     },
     packages=setuptools.find_packages(exclude=('tests',)),
     classifiers=[
@@ -0,0 +1,218 @@
+'''Stand-in for psycopg2 connections, serving canned catalogs of any size without a database.
+
+    server = FakeServer.source(subscriptions=10000)
+    conn = server.connect('postgres://localhost/src')
+
+Catalog queries (CATALOG_QUERIES, alone or prefetched together by
+_connect) are answered from the canned rows, queries containing a string
+in server.results with its rows (or what a function of the query returns
+or raises), and anything else with no rows.
+Every query is recorded, and can cost simulated round-trip latency, so tests
+can check how many round trips a command takes at any scale.
+
+Run it to see how commands scale: python -m tests.fake
+'''
+
+import re
+from time import perf_counter, sleep
+
+import psycopg2.extensions
+
+from pglogicalmanager.manager import CATALOG_QUERIES
+
+_CATALOG_NAMES = {query: name for name, query in CATALOG_QUERIES.items()}
+
+# Catalogs in the prefetch query: (SELECT coalesce(json_agg(c), '[]') FROM (<query>) c) AS <name>
+_PREFETCHED = re.compile(r"\) c\) AS (\w+)")
+
+
+class Row(dict):
+    '''Row like psycopg2's DictRow: by column name or position.'''
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return list(self.values())[key]
+        return super().__getitem__(key)
+
+
+class FakeServer:
+    def __init__(self, catalogs=None, server_version=160001, latency=0.0, superuser=True):
+        self.catalogs = catalogs or {}
+        self.server_version = server_version
+        self.latency = latency # Seconds per round trip
+        self.superuser = superuser
+        self.results = {} # Rows of queries containing the key, e.g. {'RETURNING holder': [{'holder': 'me'}]}
+        self.queries = []
+        self.connections = 0
+
+    @classmethod
+    def source(cls, subscriptions=0, tables=0, columns=5, **kwargs):
+        '''Source with a slot and a publication per subscription, and tables with columns.'''
+        return cls({
+            'replication_slots': [{'slot_name': f'sub_{i}_slot', 'plugin': 'pgoutput', 'slot_type': 'logical',
+                                   'confirmed_flush_lsn': '0/1000', 'active': True} for i in range(subscriptions)],
+            'publications': [{'pubname': f'sub_{i}_publication', 'puballtables': True} for i in range(subscriptions)],
+            'publication_tables': [],
+            'wal_lsn': [{'pg_current_wal_lsn': '0/1800'}],
+            'tables': _tables(tables),
+            'columns': _columns(tables, columns),
+        }, **kwargs)
+
+    @classmethod
+    def destination(cls, subscriptions=0, tables=0, columns=5, **kwargs):
+        '''Destination with subscriptions matching FakeServer.source, and the same tables.'''
+        return cls({
+            'subscriptions': [{'subname': f'sub_{i}', 'subenabled': True, 'subconninfo': 'postgres://localhost/src',
+                               'subslotname': f'sub_{i}_slot', 'subpublications': [f'sub_{i}_publication']}
+                              for i in range(subscriptions)],
+            'tables': _tables(tables),
+            'columns': _columns(tables, columns),
+        }, **kwargs)
+
+    def connect(self, dsn, **kwargs):
+        # TCP, TLS and authentication take a few round trips.
+        self.round_trip(3)
+        self.connections += 1
+
+        return FakeConnection(self, dsn)
+
+    def round_trip(self, count=1):
+        if self.latency > 0:
+            sleep(self.latency * count)
+
+    def execute(self, query):
+        '''Answer a query. Returns rows.'''
+        self.queries.append(query)
+        self.round_trip()
+
+        for text, rows in self.results.items():
+            if text in query:
+                return [Row(row) for row in (rows(query) if callable(rows) else rows)]
+
+        name = _CATALOG_NAMES.get(query)
+
+        if name is not None:
+            return [Row(row) for row in self.catalogs.get(name, [])]
+
+        prefetched = _PREFETCHED.findall(query)
+
+        if query.startswith('SELECT ') and (prefetched or ' AS superuser' in query):
+            row = Row()
+
+            if ' AS superuser' in query:
+                row['superuser'] = self.superuser
+
+            for name in prefetched:
+                row[name] = self.catalogs.get(name, [])
+
+            return [row]
+
+        return []
+
+
+class FakeConnection:
+    def __init__(self, server, dsn):
+        self.server = server
+        self.dsn = dsn
+        self.server_version = server.server_version
+        self.autocommit = False
+        self.closed = 0
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        # Counted like _connect's connections do, for --stats.
+        self.queries = 0
+        self.query_time = 0.0
+
+    def cursor(self, *args, **kwargs):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.server.round_trip()
+        self.status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        self.rollback()
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+
+    def mogrify(self, query, params=None):
+        if params is not None:
+            query = query % tuple(psycopg2.extensions.adapt(param).getquoted().decode('utf-8') for param in params)
+
+        return query.encode('utf-8')
+
+    def execute(self, query, params=None):
+        started = perf_counter()
+        self.rows = self.conn.server.execute(self.mogrify(query, params).decode('utf-8'))
+        self.conn.queries += 1
+        self.conn.query_time += perf_counter() - started
+
+        if not self.conn.autocommit:
+            self.conn.status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if len(self.rows) > 0 else None
+
+
+class FakeCluster:
+    '''Source and destination, connected to by DSN, e.g. in place of psycopg2.connect.'''
+
+    def __init__(self, src, dest, src_dsn='postgres://localhost/src', dest_dsn='postgres://localhost/dest'):
+        self.servers = {src_dsn: src, dest_dsn: dest}
+        self.src_dsn = src_dsn
+        self.dest_dsn = dest_dsn
+
+    def connect(self, dsn, **kwargs):
+        return self.servers[dsn].connect(dsn, **kwargs)
+
+
+def _tables(count):
+    return [{'schemaname': 'public', 'tablename': f'table_{i}', 'tableowner': 'postgres'} for i in range(count)]
+
+
+def _columns(tables, columns):
+    return [{'table_name': f'table_{i}', 'column_name': f'column_{j}', 'data_type': 'integer'}
+            for i in range(tables) for j in range(columns)]
+
+
+def _benchmark():
+    import os
+    from time import perf_counter
+
+    import psycopg2
+    from click.testing import CliRunner
+
+    from pglogicalmanager import list_subscriptions, list_columns
+
+    print(f'{"Objects":>8} {"Command":<20} {"Queries":>8} {"Seconds":>8}')
+
+    for count in (100, 1000, 10000):
+        for command, args in ((list_subscriptions, []), (list_columns, [f'table_{count - 1}', '--source'])):
+            cluster = FakeCluster(FakeServer.source(subscriptions=count, tables=count, latency=0.001),
+                                  FakeServer.destination(subscriptions=count, latency=0.001))
+            os.environ['SOURCE_DB_DSN'] = cluster.src_dsn
+            os.environ['DEST_DB_DSN'] = cluster.dest_dsn
+            psycopg2.connect = cluster.connect
+
+            started = perf_counter()
+            CliRunner().invoke(command, args)
+            elapsed = perf_counter() - started
+            queries = sum(len(server.queries) for server in cluster.servers.values())
+
+            print(f'{count:>8} {command.name:<20} {queries:>8} {elapsed:>8.3f}')
+
+
+if __name__ == '__main__':
+    _benchmark()
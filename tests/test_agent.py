@@ -0,0 +1,112 @@
+'''Test commands are forwarded to the agent and run on its pooled connections.'''
+import os
+import stat
+import threading
+from time import monotonic
+
+import psycopg2.extensions
+import pytest
+
+from pglogicalmanager.agent import Agent, forward, stop
+from pglogicalmanager.manager import NotSuperUserError, _catalogs, _invalidate_catalogs
+
+from tests.fake import FakeCluster, FakeServer
+
+
+class Conn:
+    '''Pooled connection which fails on any query.'''
+    dsn = 'postgres://localhost:5432/src'
+    server_version = 160001
+    closed = 0
+
+    def cursor(self, *args, **kwargs):
+        return self
+
+    def execute(self, query, params=None):
+        raise AssertionError(f'Unexpected query: {query}')
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+@pytest.fixture
+def agent(tmp_path, monkeypatch):
+    monkeypatch.setenv('SOURCE_DB_DSN', 'postgres://localhost:5432/src')
+    monkeypatch.setenv('DEST_DB_DSN', 'postgres://localhost:5432/dest')
+
+    src, dest = Conn(), Conn()
+    _catalogs[src] = {'tables': [{'tablename': 'warm', 'tableowner': 'postgres'}], 'partitions': []}
+
+    agent = Agent(str(tmp_path / 'agent.sock'), catalog_ttl=3600)
+    agent.refreshed[(src, dest)] = monotonic()
+    agent.pool.put((src, dest))
+    thread = threading.Thread(target=agent.serve_forever)
+    thread.start()
+
+    yield agent
+
+    stop(agent.path)
+    thread.join()
+    agent.server_close()
+    _invalidate_catalogs(src)
+
+
+def test_socket_mode(agent):
+    # Created that way, never open to others even briefly.
+    assert stat.S_IMODE(os.stat(agent.path).st_mode) == 0o600
+
+
+def test_forward(agent, capsys):
+    assert forward(['list-tables', '--source'], path=agent.path) == 0
+    assert 'warm' in capsys.readouterr().out
+
+    # Connections went back to the pool.
+    assert agent.pool.qsize() == 1
+
+
+def test_forward_stats(agent, capsys):
+    assert forward(['--stats', 'list-tables', '--source'], path=agent.path) == 0
+    assert 'Queries' in capsys.readouterr().out
+
+
+def test_forward_usage_error(agent, capsys):
+    assert forward(['list-tables'], path=agent.path) == 2
+    assert "Missing option '--source" in capsys.readouterr().out
+
+
+def test_local(agent, monkeypatch):
+    # Interactive commands run in the CLI.
+    assert forward(['reverse-subscription', 'test_sub'], path=agent.path) is None
+    assert forward(['--stats', 'wait-for-subscription', 'test_sub'], path=agent.path) is None
+    assert forward(['--stats'], path=agent.path) is None
+
+    # So does everything with a different configuration.
+    monkeypatch.setenv('DEST_DB_DSN', 'postgres://localhost:5432/other')
+    assert forward(['list-tables', '--source'], path=agent.path) is None
+
+
+def test_no_agent(tmp_path):
+    assert forward(['list-tables', '--source'], path=str(tmp_path / 'agent.sock')) is None
+
+
+def test_connect_not_superuser(tmp_path, monkeypatch):
+    cluster = FakeCluster(FakeServer.source(), FakeServer.destination(superuser=False))
+    opened = []
+
+    def connect(dsn, **kwargs):
+        opened.append(cluster.connect(dsn, **kwargs))
+        return opened[-1]
+
+    monkeypatch.setattr(psycopg2, 'connect', connect)
+    monkeypatch.setenv('SOURCE_DB_DSN', cluster.src_dsn)
+    monkeypatch.setenv('DEST_DB_DSN', cluster.dest_dsn)
+    agent = Agent(str(tmp_path / 'agent.sock'))
+
+    with pytest.raises(NotSuperUserError):
+        agent.connect()
+
+    # Neither the one that failed the check nor the one that didn't is left open.
+    assert len(opened) == 2
+    assert all(conn.closed for conn in opened)
+
+    agent.server_close()
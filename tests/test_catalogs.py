@@ -0,0 +1,72 @@
+'''Test prefetched catalogs are used instead of querying.'''
+import pytest
+
+from pglogicalmanager import ReplicationSlots, Subscriptions, Tables, Columns
+from pglogicalmanager.manager import _catalogs, _invalidate_catalogs
+
+
+class NoQueries:
+    '''Connection which fails on any query.'''
+    dsn = 'postgres://localhost:5432/src'
+    server_version = 160001
+
+    def cursor(self, *args, **kwargs):
+        return self
+
+    def execute(self, query, params=None):
+        raise AssertionError(f'Unexpected query: {query}')
+
+
+@pytest.fixture
+def src():
+    conn = NoQueries()
+    _catalogs[conn] = {
+        'replication_slots': [{'slot_name': 'test_slot', 'plugin': 'pgoutput', 'slot_type': 'logical', 'confirmed_flush_lsn': '0/1000'}],
+        'publications': [{'pubname': 'test_sub_publication', 'puballtables': True}],
+        'wal_lsn': [{'pg_current_wal_lsn': '0/1800'}],
+        'tables': [{'tablename': 'test', 'tableowner': 'postgres'}],
+        'columns': [{'table_name': 'test', 'column_name': 'id', 'data_type': 'integer'},
+                    {'table_name': 'other', 'column_name': 'id', 'data_type': 'bigint'}],
+    }
+
+    yield conn
+
+    _invalidate_catalogs(conn)
+
+
+@pytest.fixture
+def dest():
+    conn = NoQueries()
+    _catalogs[conn] = {
+        'subscriptions': [{'subname': 'test_sub', 'subenabled': True, 'subconninfo': 'postgres://localhost:5432/src',
+                           'subslotname': 'test_slot', 'subpublications': ['test_sub_publication']}],
+    }
+
+    yield conn
+
+    _invalidate_catalogs(conn)
+
+
+def test_subscriptions_from_prefetched_catalogs(src, dest):
+    subscription = Subscriptions(src, dest).get('test_sub')
+
+    assert subscription.slot.name == 'test_slot'
+    assert subscription.publication.name == 'test_sub_publication'
+    assert subscription.replication_lag() == 0x800
+
+
+def test_tables_from_prefetched_catalogs(src):
+    table = Tables(src).get('test')
+    columns = Columns(src, table)
+    columns.refresh()
+
+    assert [column.type for column in columns.columns] == ['integer']
+
+
+def test_invalidate(src):
+    assert ReplicationSlots(src).get('test_slot') is not None
+
+    _invalidate_catalogs(src)
+
+    with pytest.raises(AssertionError):
+        ReplicationSlots(src).get('test_slot')
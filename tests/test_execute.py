@@ -0,0 +1,66 @@
+'''Test statements are batched into one round trip.'''
+import psycopg2.extensions
+
+from pglogicalmanager.manager import _execute, _round_trips
+
+
+class Conn:
+    '''Records round trips.'''
+
+    def __init__(self, in_transaction=False):
+        self.autocommit = False
+        self.round_trips = []
+        self.in_transaction = in_transaction
+
+    def get_transaction_status(self):
+        if self.in_transaction:
+            return psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def rollback(self):
+        self.round_trips.append('ROLLBACK')
+        self.in_transaction = False
+
+    def cursor(self):
+        return self
+
+    def mogrify(self, query, params):
+        return (query % tuple(f"'{param}'" for param in params)).encode('utf-8')
+
+    def execute(self, query):
+        assert self.autocommit # No BEGIN
+        self.round_trips.append(query)
+
+
+def test_one_round_trip():
+    conn = Conn()
+    saved = _round_trips['saved']
+
+    _execute(conn, ['ALTER SUBSCRIPTION test_sub DISABLE',
+                    'ALTER SUBSCRIPTION test_sub SET (slot_name = NONE)',
+                    'DROP SUBSCRIPTION test_sub'])
+
+    assert conn.round_trips == ['ALTER SUBSCRIPTION test_sub DISABLE; ALTER SUBSCRIPTION test_sub SET (slot_name = NONE); DROP SUBSCRIPTION test_sub']
+    assert not conn.autocommit
+
+    # One per statement otherwise.
+    assert _round_trips['saved'] - saved == 2
+
+
+def test_nothing_saved(capsys):
+    conn = Conn(in_transaction=True)
+    saved = _round_trips['saved']
+
+    _execute(conn, ['ALTER SUBSCRIPTION test_sub ENABLE'])
+
+    assert conn.round_trips == ['ROLLBACK', 'ALTER SUBSCRIPTION test_sub ENABLE']
+    assert _round_trips['saved'] == saved
+    assert 'saved' not in capsys.readouterr().out
+
+
+def test_params_and_open_transaction():
+    conn = Conn(in_transaction=True)
+
+    _execute(conn, ['SELECT pg_replication_origin_advance(%s, %s)', 'ALTER SUBSCRIPTION test_sub ENABLE'], ('pg_16389', '0/16EDE8A0'))
+
+    assert conn.round_trips == ['ROLLBACK', "SELECT pg_replication_origin_advance('pg_16389', '0/16EDE8A0'); ALTER SUBSCRIPTION test_sub ENABLE"]
@@ -0,0 +1,133 @@
+'''Test slots are kept on standbys and recreated after a failover.'''
+import psycopg2
+
+from pglogicalmanager.manager import ReplicationSlot, StandbySlots, Subscription, Subscriptions, _connect, _invalidate_catalogs, _standby_slot_status
+
+from tests.fake import FakeCluster, FakeServer
+
+
+def slot(lsn, failover=False, synced=False):
+    return {'slot_name': 'test_slot', 'plugin': 'pgoutput', 'slot_type': 'logical', 'confirmed_flush_lsn': lsn,
+            'failover': failover, 'synced': synced}
+
+
+def test_standby_slot_status():
+    # PG 17 failover slots are synced by the standby.
+    assert _standby_slot_status(slot('0/100', failover=True), None, '0/100', 170000) == ('not synced', 'sync')
+    assert _standby_slot_status(slot('0/100', failover=True), slot('0/100', synced=True), '0/100', 170000) == ('ready', None)
+
+    # Otherwise created on the standby and advanced to what the destination applied.
+    assert _standby_slot_status(slot('0/100'), None, '0/100', 160000) == ('missing', 'create')
+    assert _standby_slot_status(slot('0/100'), slot('0/80'), '0/100', 160000) == ('ready', 'advance')
+    assert _standby_slot_status(slot('0/100'), slot('0/100'), '0/100', 170000) == ('ready', None)
+
+    # Would skip changes the destination doesn't have yet.
+    assert _standby_slot_status(slot('0/100'), slot('0/200'), '0/100', 160000) == ('ahead of destination', None)
+
+    # No logical slots on standbys before PG 16.
+    assert _standby_slot_status(slot('0/100'), None, '0/100', 150000) == ('lost on failover', None)
+
+
+def test_create_failover_slot(monkeypatch):
+    server = FakeServer(server_version=170000)
+    monkeypatch.setattr(psycopg2, 'connect', server.connect)
+    conn = _connect('postgres://localhost/src')
+
+    ReplicationSlot.create(conn, 'test_slot', failover=True)
+
+    assert server.queries[-1] == "SELECT pg_create_logical_replication_slot('test_slot', 'pgoutput', false, false, true)"
+
+
+def test_create_with_existing_slot(monkeypatch, capsys):
+    # A slot created before failover was the default.
+    src = FakeServer.source(subscriptions=1, server_version=170000)
+    dest = FakeServer.destination(server_version=170000)
+    cluster = FakeCluster(src, dest)
+    monkeypatch.setattr(psycopg2, 'connect', cluster.connect)
+    src_conn, dest_conn = _connect(cluster.src_dsn), _connect(cluster.dest_dsn)
+
+    Subscription.create(src_conn, dest_conn, 'sub_0', replication_slot='sub_0_slot')
+
+    # Created disabled, so setting failover alters the slot, then enabled.
+    assert not any('pg_create_logical_replication_slot' in query for query in src.queries)
+    assert 'enabled = false, failover = true)' in dest.queries[-3]
+    assert dest.queries[-2:] == ['ALTER SUBSCRIPTION sub_0 SET (failover = true)', 'ALTER SUBSCRIPTION sub_0 ENABLE']
+
+    # An existing subscription is left as it was.
+    dest.catalogs['subscriptions'] = FakeServer.destination(subscriptions=1).catalogs['subscriptions']
+    queries = len(dest.queries)
+    _invalidate_catalogs(dest_conn)
+
+    Subscription.create(src_conn, dest_conn, 'sub_0', replication_slot='sub_0_slot')
+
+    assert not any(query.startswith(('CREATE', 'ALTER')) for query in dest.queries[queries:])
+    assert 'sub_0_slot is not a failover slot' in capsys.readouterr().out
+
+    for conn in (src_conn, dest_conn):
+        _invalidate_catalogs(conn)
+
+
+def test_sync_standby_slots(monkeypatch):
+    src = FakeServer.source(subscriptions=3, server_version=160000)
+    dest = FakeServer.destination(subscriptions=3, server_version=160000)
+    standby = FakeServer(server_version=160000)
+    dest.catalogs['replication_origins'] = [{'roname': f'pg_{i}', 'subname': f'sub_{i}', 'subslotname': f'sub_{i}_slot',
+                                             'remote_lsn': '0/1000', 'local_lsn': '0/10'} for i in range(3)]
+    standby.catalogs['replication_slots'] = [
+        {'slot_name': 'sub_0_slot', 'confirmed_flush_lsn': '0/1000'},
+        {'slot_name': 'sub_1_slot', 'confirmed_flush_lsn': '0/800'},
+    ]
+    servers = {'src': src, 'dest': dest, 'standby': standby}
+    monkeypatch.setattr(psycopg2, 'connect', lambda dsn, **kwargs: servers[dsn].connect(dsn))
+
+    conns = [_connect(name, catalogs) for name, catalogs in
+             (('src', ['replication_slots']), ('dest', ['subscriptions', 'replication_origins']), ('standby', ['replication_slots']))]
+    slots = StandbySlots(*conns)
+
+    assert slots.sync() == 2
+    assert [slot['status'] for slot in slots.slots] == ['ready', 'ready', 'missing']
+    assert src.queries[-1] == 'SELECT pg_log_standby_snapshot()'
+    assert standby.queries[-2:] == [
+        "SELECT pg_create_logical_replication_slot('sub_2_slot', 'pgoutput')",
+        "SELECT pg_replication_slot_advance('sub_1_slot', '0/1000')",
+    ]
+
+    for conn in conns:
+        _invalidate_catalogs(conn)
+
+
+def test_recover(monkeypatch):
+    src = FakeServer.source(subscriptions=1, server_version=160000)
+    dest = FakeServer.destination(subscriptions=1, server_version=160000)
+    dest.catalogs['replication_origins'] = [{'roname': 'pg_0', 'subname': 'sub_0', 'subslotname': 'sub_0_slot',
+                                             'remote_lsn': '0/1000', 'local_lsn': '0/10'}]
+    servers = {'src': src, 'dest': dest}
+    monkeypatch.setattr(psycopg2, 'connect', lambda dsn, **kwargs: servers[dsn].connect(dsn))
+
+    def create_slot(query):
+        # The new primary decodes from where it is now, past what the destination applied.
+        src.catalogs['replication_slots'].append(dict(slot('0/1800'), slot_name='sub_0_slot'))
+        return []
+
+    for server in servers.values():
+        server.results['RETURNING holder'] = [{'holder': 'me'}]
+
+    src.results['pg_create_logical_replication_slot'] = create_slot
+    src.results['SELECT active FROM pg_replication_slots'] = [{'active': True}]
+    dest.results['FROM pg_stat_subscription'] = [{'count': 0}]
+
+    # The slot didn't survive the failover.
+    src.catalogs['replication_slots'] = []
+    src_conn = _connect('src', ['replication_slots', 'publications'])
+    dest_conn = _connect('dest', ['subscriptions'])
+    subscription = Subscriptions(src_conn, dest_conn).get('sub_0')
+
+    assert subscription.recover(timeout=1.0) == ('0/1000', '0/1800', 0x800)
+
+    assert "SELECT pg_create_logical_replication_slot('sub_0_slot', 'pgoutput')" in src.queries
+    altered = [query for query in dest.queries if query.startswith('ALTER SUBSCRIPTION')]
+    assert altered == ['ALTER SUBSCRIPTION sub_0 DISABLE', "ALTER SUBSCRIPTION sub_0 CONNECTION 'src'; ALTER SUBSCRIPTION sub_0 ENABLE"]
+    assert subscription.dsn == 'src'
+
+    for conn in (src_conn, dest_conn):
+        _invalidate_catalogs(conn)
@@ -0,0 +1,61 @@
+'''Test the replication history file.'''
+import pytest
+
+from pglogicalmanager.history import History, RECORD, lsn_to_int, int_to_lsn, parse_duration
+
+
+def test_lsn_conversion():
+    assert lsn_to_int('0/16EDE8A0') == 0x16EDE8A0
+    assert lsn_to_int('1/0') == 1 << 32
+    assert int_to_lsn(lsn_to_int('AB/16EDE8A0')) == 'AB/16EDE8A0'
+    assert lsn_to_int(None) == 0
+    assert int_to_lsn(0) is None
+
+
+def test_parse_duration():
+    assert parse_duration('90') == 90
+    assert parse_duration('10m') == 600
+    assert parse_duration('1.5h') == 5400
+
+    with pytest.raises(ValueError):
+        parse_duration('ten minutes')
+
+
+def test_lookup(tmp_path):
+    history = History.for_subscription(str(tmp_path), 'test_sub')
+
+    assert history.at(100.0) is None
+
+    for i in range(1000):
+        history.append(1000.0 + i * 60, i * 100, i * 100 + 50)
+
+    assert len(history.records()) == 1000
+    assert history.records(2) == [(1000.0 + 998 * 60, 99800, 99850), (1000.0 + 999 * 60, 99900, 99950)]
+    assert history.records(0) == []
+    assert len(history.records(5000)) == 1000
+    assert history.at(999.0) is None
+    assert history.at(1000.0) == (1000.0, 0, 50)
+    assert history.at(1000.0 + 60 * 500 + 30) == (1000.0 + 60 * 500, 50000, 50050)
+    assert history.at(10 ** 9)[1] == 99900
+
+
+def test_append_after_partial_write(tmp_path):
+    history = History(str(tmp_path / 'test_sub.history'))
+    history.append(1.0, 1, 1)
+
+    # Crash in the middle of writing the second record.
+    with open(history.path, 'ab') as file:
+        file.write(RECORD.pack(2.0, 2, 2)[:7])
+
+    history.append(3.0, 3, 3)
+
+    assert history.records() == [(1.0, 1, 1), (3.0, 3, 3)]
+
+
+def test_clock_going_backwards(tmp_path):
+    history = History(str(tmp_path / 'test_sub.history'))
+    history.append(10.0, 1, 1)
+    history.append(5.0, 2, 2)
+
+    assert history.records() == [(10.0, 1, 1), (10.0, 2, 2)]
+    assert history.at(10.0) == (10.0, 2, 2)
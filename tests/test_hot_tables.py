@@ -0,0 +1,53 @@
+'''Test write rate ranking and publication layout recommendation.'''
+import json
+
+from pglogicalmanager.manager import _write_rates, _recommend_layout, _read_layout
+
+
+def table_sample(relid, relname, ins=0, upd=0, hot_upd=0, dele=0, reltuples=1000, relation_size=100000, indexes=1):
+    return {'relid': relid, 'schemaname': 'public', 'relname': relname, 'n_tup_ins': ins, 'n_tup_upd': upd,
+            'n_tup_hot_upd': hot_upd, 'n_tup_del': dele, 'reltuples': reltuples, 'relation_size': relation_size,
+            'total_size': relation_size, 'indexes': indexes}
+
+
+def samples():
+    before = {'time': 0.0, 'wal_position': 0, 'tables': {
+        1: table_sample(1, 'events'),
+        2: table_sample(2, 'users'),
+        3: table_sample(3, 'countries'),
+    }}
+    after = {'time': 10.0, 'wal_position': 1000000, 'tables': {
+        1: table_sample(1, 'events', ins=10000),
+        2: table_sample(2, 'users', upd=100, hot_upd=100),
+        3: table_sample(3, 'countries'),
+    }}
+
+    return before, after
+
+
+def test_write_rates():
+    tables, elapsed, wal_bytes = _write_rates(*samples())
+
+    assert wal_bytes == 1000000
+    assert [table['relname'] for table in tables] == ['events', 'users', 'countries']
+    assert tables[0]['ins_rate'] == 1000.0
+    assert tables[0]['share'] > 0.9
+    assert tables[2]['share'] == 0.0
+
+    # The WAL actually written is attributed to tables by share.
+    assert sum(table['wal_rate'] for table in tables) == 100000.0
+
+
+def test_recommend_layout(tmp_path):
+    tables, _, _ = _write_rates(*samples())
+    layout = _recommend_layout(tables, hot_share=0.2)
+
+    assert layout['publications'][0]['name'] == 'events'
+    assert layout['publications'][0]['tables'] == ['public.events']
+    assert layout['publications'][1]['name'] == 'default'
+    assert layout['publications'][1]['tables'] == ['public.countries', 'public.users']
+
+    path = tmp_path / 'layout.json'
+    path.write_text(json.dumps(layout))
+
+    assert _read_layout(str(path)) == layout['publications']
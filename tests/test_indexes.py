@@ -0,0 +1,74 @@
+'''Test destination indexes are compared with the source.'''
+from pglogicalmanager.manager import IndexReadiness, _catalogs, _index_key, _index_readiness, _invalidate_catalogs
+
+
+def index(relname, indexname, columns, primary=False, replident=False, unique=True, valid=True):
+    unique_sql = 'UNIQUE ' if unique else ''
+    return {'schemaname': 'public', 'relname': relname, 'indexname': indexname,
+            'quoted_table': f'public.{relname}', 'quoted_index': f'public.{indexname}', 'quoted_name': indexname,
+            'indisprimary': primary, 'indisreplident': replident, 'indisunique': unique, 'indisvalid': valid,
+            'indexdef': f'CREATE {unique_sql}INDEX {indexname} ON public.{relname} USING btree ({columns})'}
+
+
+def table(relname, write_rate=0.0):
+    return {'schemaname': 'public', 'relname': relname, 'write_rate': write_rate}
+
+
+SRC_INDEXES = [
+    index('users', 'users_pkey', 'id', primary=True),
+    index('events', 'events_pkey', 'id', primary=True),
+    index('events', 'events_created_at_idx', 'created_at', unique=False),
+    index('orders', 'orders_pkey', 'id', primary=True),
+    index('items', 'items_pkey', 'id', primary=True),
+]
+DEST_INDEXES = [
+    index('users', 'users_pkey', 'id', primary=True),
+    index('orders', 'orders_pkey_ccnew', 'id', valid=False), # Failed CREATE INDEX CONCURRENTLY
+    index('items', 'items_id_key', 'id'), # Same index, under another name, not the identity
+]
+SRC_TABLES = [table('users', 1.0), table('events', 100.0), table('orders', 10.0), table('items', 5.0)]
+DEST_TABLES = [table('users'), table('events'), table('orders'), table('items')]
+
+
+def test_index_key():
+    assert _index_key('CREATE UNIQUE INDEX users_pkey ON public.users USING btree (id)') == \
+        _index_key('CREATE UNIQUE INDEX "Users key" ON public.users USING btree (id)')
+
+
+def test_readiness():
+    results = _index_readiness(SRC_INDEXES, DEST_INDEXES, SRC_TABLES, DEST_TABLES)
+
+    # Busiest first, only identity indexes.
+    assert [(result['index'], result['status']) for result in results] == [
+        ('events_pkey', 'missing'),
+        ('orders_pkey', 'invalid'),
+        ('items_pkey', 'not the replica identity'),
+    ]
+    assert results[0]['statements'] == [
+        'CREATE UNIQUE INDEX CONCURRENTLY events_pkey ON public.events USING btree (id)',
+        'ALTER TABLE public.events REPLICA IDENTITY USING INDEX events_pkey',
+    ]
+    assert results[1]['statements'][0] == 'DROP INDEX CONCURRENTLY public.orders_pkey_ccnew'
+    assert results[2]['statements'] == ['ALTER TABLE public.items REPLICA IDENTITY USING INDEX items_id_key']
+
+
+def test_all_indexes():
+    results = _index_readiness(SRC_INDEXES, DEST_INDEXES, SRC_TABLES, DEST_TABLES, all_indexes=True)
+
+    assert [result['index'] for result in results][:2] == ['events_pkey', 'events_created_at_idx']
+
+
+def test_script():
+    src, dest = object(), object()
+    _catalogs[src] = {'indexes': SRC_INDEXES, 'replica_identity': SRC_TABLES, 'partitions': []}
+    _catalogs[dest] = {'indexes': DEST_INDEXES, 'replica_identity': DEST_TABLES}
+
+    readiness = IndexReadiness(src, dest)
+    readiness.refresh()
+    script = readiness.script()
+
+    _invalidate_catalogs(src)
+    _invalidate_catalogs(dest)
+
+    assert script.index('events_pkey') < script.index('orders_pkey')
+    assert 'CREATE UNIQUE INDEX CONCURRENTLY orders_pkey ON public.orders USING btree (id);' in script
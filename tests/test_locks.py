@@ -0,0 +1,119 @@
+'''Test locks are per object, and taken on both servers or neither.'''
+import psycopg2
+import psycopg2.errors
+import pytest
+
+from pglogicalmanager import Subscription
+from pglogicalmanager.manager import ReplicationOrigin, _connect, _lock_key, _lock_status
+
+from tests.fake import FakeServer
+
+LOCKED = {'RETURNING holder': [{'holder': 'me'}]}
+
+
+def subscription(monkeypatch, src, dest):
+    servers = {'src': src, 'dest': dest}
+    monkeypatch.setattr(psycopg2, 'connect', lambda dsn, **kwargs: servers[dsn].connect(dsn))
+
+    sub = Subscription()
+    sub.name = 'test_sub'
+    sub.src = _connect('src')
+    sub.dest = _connect('dest')
+
+    return sub
+
+
+def test_lock_keys():
+    assert _lock_key('subscription', 'a') != _lock_key('subscription', 'b')
+
+
+def test_lock_both(monkeypatch):
+    src, dest = FakeServer(), FakeServer()
+    src.results.update(LOCKED)
+    dest.results.update(LOCKED)
+    sub = subscription(monkeypatch, src, dest)
+
+    assert sub.lock()
+    assert "VALUES ('subscription/test_sub'" in dest.queries[-1]
+
+    sub.unlock()
+
+    assert src.queries[-1].startswith('DELETE FROM pglogicalmanager.locks')
+    assert dest.queries[-1].startswith('DELETE FROM pglogicalmanager.locks')
+
+
+def test_lock_neither(monkeypatch):
+    '''Held by someone else on the destination: the source lock is released.'''
+    src, dest = FakeServer(), FakeServer()
+    src.results.update(LOCKED)
+    sub = subscription(monkeypatch, src, dest)
+
+    assert not sub.lock()
+    assert src.queries[-1] == "DELETE FROM pglogicalmanager.locks WHERE object = 'subscription/test_sub' AND pid = pg_backend_pid() RETURNING object"
+
+
+def test_lock_status():
+    assert _lock_status({'connected': True}) == 'held'
+    assert _lock_status({'connected': False}) == 'holder gone'
+
+
+def test_no_takeover_while_connected(monkeypatch):
+    '''However long the holder works: only its own connection, or its backend being gone, lets the lock change hands.'''
+    src, dest = FakeServer(), FakeServer()
+    src.results.update(LOCKED)
+    dest.results.update(LOCKED)
+    sub = subscription(monkeypatch, src, dest)
+
+    sub.lock()
+
+    takeover = src.queries[-1].split('WHERE l.pid')[1]
+    assert 'now()' not in takeover
+    assert 'pg_stat_activity' in takeover
+
+
+def test_create_table_race(monkeypatch):
+    '''The lock table is created on first use; another operator creating it at the same time is fine.'''
+    src, dest = FakeServer(), FakeServer()
+    created = []
+
+    def insert(query):
+        if not created:
+            raise psycopg2.errors.UndefinedTable('relation "pglogicalmanager.locks" does not exist')
+        return [{'holder': 'me'}]
+
+    def create(query):
+        created.append(query)
+        raise psycopg2.errors.UniqueViolation('duplicate key value violates unique constraint "pg_type_typname_nsp_index"')
+
+    src.results.update({'RETURNING holder': insert, 'CREATE UNLOGGED TABLE': create})
+    dest.results.update(LOCKED)
+    sub = subscription(monkeypatch, src, dest)
+
+    assert sub.lock()
+    assert [query.split()[0] for query in src.queries[-3:]] == ['INSERT', 'CREATE', 'INSERT']
+
+    # Once it exists, locking is one round trip.
+    assert not any('CREATE' in query for query in dest.queries)
+
+
+def test_rewind_releases_lock_on_error(monkeypatch):
+    src, dest = FakeServer(), FakeServer()
+    src.results.update(LOCKED)
+    dest.results.update(LOCKED)
+    dest.results['FROM pg_stat_subscription'] = [{'count': 0}]
+
+    def advance(query):
+        raise psycopg2.errors.InvalidTextRepresentation('invalid input syntax for type pg_lsn: "0/XYZ"')
+
+    dest.results['pg_replication_origin_advance'] = advance
+    sub = subscription(monkeypatch, src, dest)
+    origin = ReplicationOrigin(sub.dest)
+    origin.name = 'pg_16389'
+    monkeypatch.setattr('builtins.input', lambda prompt: 'Y')
+
+    with pytest.raises(psycopg2.errors.InvalidTextRepresentation):
+        origin.rewind('0/XYZ', sub)
+
+    # Not left for the next operator to trip over.
+    for server in (src, dest):
+        assert server.queries[-1].startswith('DELETE FROM pglogicalmanager.locks')
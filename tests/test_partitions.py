@@ -0,0 +1,108 @@
+'''Test partitioned tables are reported, checked and published as one table.'''
+import pytest
+
+from pglogicalmanager.manager import (Publication, Tables, UnsupportedFeature, _catalogs, _collapse_partitions, _identity_problems,
+                                      _index_readiness, _invalidate_catalogs, _partition_roots)
+
+from tests.fake import FakeServer
+from tests.test_indexes import index, table as index_table
+from tests.test_replica_identity import table
+
+PARTITIONS = [{'root_schema': 'public', 'root': 'events', 'schemaname': 'public', 'relname': f'events_{month}'}
+              for month in ('2024_01', '2024_02', '2024_03')]
+ROOTS = _partition_roots(PARTITIONS)
+
+
+def test_roots():
+    assert ROOTS == {'public.events_2024_01': 'public.events', 'public.events_2024_02': 'public.events',
+                     'public.events_2024_03': 'public.events'}
+
+
+def test_collapse():
+    rows = [{'table': 'public.events_2024_01', 'kind': 'a', 'write_rate': 1.0, 'total_size': 100},
+            {'table': 'public.users', 'kind': 'a', 'write_rate': 5.0, 'total_size': 10},
+            {'table': 'public.events_2024_02', 'kind': 'a', 'write_rate': 2.0, 'total_size': 200},
+            {'table': 'public.events_2024_03', 'kind': 'b', 'write_rate': 4.0, 'total_size': 400}]
+
+    collapsed = _collapse_partitions(rows, ROOTS, lambda row: (row['table'], row['kind']))
+
+    assert [(row['table'], row['kind'], row.get('partitions'), row['write_rate'], row['total_size']) for row in collapsed] == [
+        ('public.events', 'a', 2, 3.0, 300),
+        ('public.users', 'a', None, 5.0, 10),
+        ('public.events', 'b', 1, 4.0, 400),
+    ]
+    assert collapsed[0]['partitions_total'] == 3
+
+
+def test_identity_problems():
+    src = [table(f'events_{month}', has_primary_key=False) for month in ('2024_01', '2024_02', '2024_03')] + [table('users')]
+    dest = src[:2] + [table('users')]
+
+    problems = _identity_problems(src, dest, dest_version=160000, roots=ROOTS)
+
+    assert [(problem['table'], problem['side'], problem['problem']) for problem in problems] == [
+        ('public.events', 'source', 'No primary key or replica identity, UPDATE and DELETE will fail. (3 of 3 partitions)'),
+        ('public.events', 'destination', 'Table does not exist. (1 of 3 partitions)'),
+    ]
+    # Naming the partitioned table checks its partitions.
+    assert len(_identity_problems(src, dest, ['events'], dest_version=160000, roots=ROOTS)) == 2
+    assert _identity_problems(src, dest, ['users'], dest_version=160000, roots=ROOTS) == []
+
+
+def test_index_readiness():
+    months = ('2024_01', '2024_02', '2024_03')
+    src_indexes = [index(f'events_{month}', f'events_{month}_pkey', 'id', primary=True) for month in months]
+    tables = [index_table(f'events_{month}', 1.0) for month in months]
+
+    results = _index_readiness(src_indexes, [], tables, tables, roots=ROOTS)
+
+    assert [(result['table'], result['index'], result['status'], result['write_rate']) for result in results] == [
+        ('public.events', 'events_2024_01_pkey and 2 more', 'missing', 3.0),
+    ]
+    # Statements for every partition, each buildable on its own.
+    assert len(results[0]['statements']) == 6
+
+
+@pytest.fixture
+def server():
+    server = FakeServer({'publications': []}, server_version=130000)
+    conn = server.connect('postgres://localhost/src')
+
+    yield server, conn
+
+    _invalidate_catalogs(conn)
+
+
+def test_publish_via_partition_root(server):
+    server, conn = server
+
+    publication = Publication.create(conn, 'events_publication', via_partition_root=True)
+
+    assert publication.all_tables
+    assert 'CREATE PUBLICATION events_publication FOR ALL TABLES WITH (publish_via_partition_root = true)' in server.queries
+
+
+def test_publish_via_partition_root_unsupported(server):
+    server, conn = server
+    conn.server_version = 120000
+
+    with pytest.raises(UnsupportedFeature):
+        Publication.create(conn, 'events_publication', via_partition_root=True)
+
+    assert not any(query.startswith('CREATE PUBLICATION') for query in server.queries)
+
+
+def test_tables_count_leaves():
+    # events is partitioned by month, and its last month again by region: 4 leaves, 2 of them one level down.
+    partitions = PARTITIONS[:2] + [dict(PARTITIONS[2], relname=f'events_2024_03_{region}') for region in ('us', 'eu')]
+    server = FakeServer({'tables': [{'schemaname': 'public', 'tablename': 'events', 'tableowner': 'postgres', 'partitioned': True},
+                                    {'schemaname': 'public', 'tablename': 'users', 'tableowner': 'postgres', 'partitioned': False}],
+                         'partitions': partitions})
+    conn = server.connect('postgres://localhost/src')
+    tables = Tables(conn)
+    tables.refresh()
+
+    assert [(table.name, table.partitions) for table in tables.tables] == [('events', 4), ('users', None)]
+    assert tables.get('events').partitions == 4
+
+    _invalidate_catalogs(conn)
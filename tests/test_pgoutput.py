@@ -0,0 +1,201 @@
+'''Test pgoutput decoding and backlog summaries.'''
+import struct
+from time import perf_counter
+
+import pytest
+from click.testing import CliRunner
+
+from pglogicalmanager import pgoutput, BacklogSummary, benchmark_pgoutput
+
+
+def begin(xid, lsn=0x1000):
+    return b'B' + struct.pack('>qqI', lsn, 0, xid)
+
+
+def commit(lsn=0x1000):
+    return b'C' + struct.pack('>bqqq', 0, lsn, lsn + 8, 0)
+
+
+def relation(relid, namespace, name, columns=('id', 'value')):
+    data = b'R' + struct.pack('>I', relid) + namespace.encode() + b'\0' + name.encode() + b'\0'
+    data += struct.pack('>bh', ord('d'), len(columns))
+
+    return data + b''.join(struct.pack('>b', 1 if i == 0 else 0) + column.encode() + b'\0' + struct.pack('>Ii', 23, -1)
+                           for i, column in enumerate(columns))
+
+
+def tuple_data(*values):
+    data = struct.pack('>h', len(values))
+
+    for value in values:
+        if value is None:
+            data += b'n'
+        elif value is pgoutput.UNCHANGED_TOAST:
+            data += b'u'
+        else:
+            value = value.encode()
+            data += b't' + struct.pack('>I', len(value)) + value
+
+    return data
+
+
+def insert(relid, *values):
+    return b'I' + struct.pack('>I', relid) + b'N' + tuple_data(*values)
+
+
+def update(relid, key, *values):
+    old = b'K' + tuple_data(key) if key is not None else b''
+    return b'U' + struct.pack('>I', relid) + old + b'N' + tuple_data(*values)
+
+
+def delete(relid, *values):
+    return b'D' + struct.pack('>I', relid) + b'K' + tuple_data(*values)
+
+
+def truncate(*relids):
+    return b'T' + struct.pack('>Ib', len(relids), 1) + struct.pack(f'>{len(relids)}I', *relids)
+
+
+def fixture(transactions=100):
+    '''A stream of small transactions against two tables.'''
+    stream = [relation(10, 'public', 'events'), relation(11, 'public', 'users')]
+
+    for xid in range(transactions):
+        stream += [begin(xid), insert(10, str(xid), 'x' * 64), update(11, None, str(xid), 'y' * 32), commit()]
+
+    return list(enumerate(stream))
+
+
+def test_decode():
+    decoder = pgoutput.Decoder()
+
+    assert decoder.decode(begin(42)) == pgoutput.Begin(0x1000, 0, 42)
+    assert decoder.decode(commit(0x2000)).end_lsn == 0x2008
+
+    events = decoder.decode(relation(16384, 'public', 'events'))
+
+    assert events.name == 'events'
+    assert [column.name for column in events.columns] == ['id', 'value']
+    assert events.columns[0].key
+    assert decoder.relations[16384] is events
+    assert decoder.decode(relation(1, '', 'pg_thing')).namespace == 'pg_catalog'
+
+    message = decoder.decode(insert(16384, '1', None))
+
+    assert message.relation is events
+    assert bytes(message.new[0]) == b'1'
+    assert message.new[1] is None
+
+    message = decoder.decode(update(16384, '1', '2', pgoutput.UNCHANGED_TOAST))
+
+    assert bytes(message.old[0]) == b'1'
+    assert bytes(message.new[0]) == b'2'
+    assert message.new[1] is pgoutput.UNCHANGED_TOAST
+    assert decoder.decode(update(16384, None, '2', 'a')).old is None
+
+    message = decoder.decode(delete(16384, '2'))
+
+    assert str(message.old[0], 'utf-8') == '2'
+
+    message = decoder.decode(truncate(16384, 99))
+
+    assert message.relations[0] is events
+    assert message.relations[1].name == 'oid 99' # Never saw its Relation message
+    assert message.cascade and not message.restart_identity
+
+    assert decoder.decode(b'O' + struct.pack('>q', 5) + b'origin\0') == pgoutput.Origin(5, 'origin')
+
+
+def test_decode_is_zero_copy():
+    payload = insert(10, 'hello')
+    message = pgoutput.Decoder().decode(payload)
+
+    assert message.new[0].obj is payload
+
+
+def test_wide_relation_from_recording(tmp_path):
+    '''Strings in payloads sliced out of a recording are found in place, not by copying the rest of the payload each time.'''
+    columns = [f'column_with_a_long_name_{i:05}' for i in range(30000)]
+    path = tmp_path / 'stream.bin'
+
+    with open(path, 'wb') as file:
+        pgoutput.write_stream(file, [(1, begin(1)), (2, relation(16384, 'public', 'wide', columns)), (3, commit())])
+
+    messages = list(pgoutput.read_stream(path.read_bytes()))
+    started = perf_counter()
+    wide = pgoutput.Decoder().decode(messages[1][1])
+
+    assert [column.name for column in wide.columns] == columns
+    assert perf_counter() - started < 1.0
+
+
+def test_decode_error():
+    with pytest.raises(pgoutput.DecodeError):
+        pgoutput.Decoder().decode(b'')
+
+
+def test_unknown_message_type():
+    decoder = pgoutput.Decoder()
+
+    # Stream Start and Stream Stop, from protocol version 2.
+    assert decoder.decode(b'S' + struct.pack('>Ib', 1234, 1)) is None
+    assert decoder.decode(b'E') is None
+    assert decoder.decode(b'E') is None
+    assert decoder.skipped == {'S': 1, 'E': 2}
+
+    # And the stream goes on.
+    assert decoder.decode(b'O' + struct.pack('>q', 5) + b'origin\0') == pgoutput.Origin(5, 'origin')
+
+
+def test_recording(tmp_path):
+    stream = fixture(10)
+    path = tmp_path / 'stream.bin'
+
+    with open(path, 'wb') as file:
+        assert pgoutput.write_stream(file, stream) == len(stream)
+
+    recorded = list(pgoutput.read_stream(path.read_bytes()))
+
+    assert [(lsn, bytes(payload)) for lsn, payload in recorded] == stream
+
+    result = pgoutput.benchmark(path.read_bytes(), repeat=1)
+
+    assert result['messages'] == len(stream)
+    assert result['bytes'] == sum(len(payload) for _, payload in stream)
+    assert result['messages_per_second'] > 0
+
+
+def test_benchmark_command(tmp_path):
+    path = tmp_path / 'stream.bin'
+
+    with open(path, 'wb') as file:
+        pgoutput.write_stream(file, fixture(1000))
+
+    result = CliRunner().invoke(benchmark_pgoutput, [str(path), '--repeat=1'])
+
+    assert result.exit_code == 0
+    assert '4002' in result.output # Messages
+
+
+def test_backlog_summary():
+    summary = BacklogSummary(top=1)
+    stream = [
+        begin(1), relation(10, 'public', 'events'), insert(10, 'a'), commit(),
+        begin(2), relation(11, 'public', 'users'), insert(10, 'b' * 100), delete(11, 'c'), insert(10, 'd'), commit(),
+        begin(3), truncate(11), commit(),
+    ]
+
+    for lsn, payload in enumerate(stream):
+        summary.add(lsn, payload)
+
+    assert summary.commits == 3
+    assert summary.tables[10]['I'] == 3
+    assert summary.tables[11]['D'] == 1
+    assert summary.tables[11]['T'] == 1
+
+    largest = summary.largest_transactions()
+
+    assert len(largest) == 1
+    assert largest[0]['xid'] == 2
+    assert largest[0]['changes'] == 3
+    assert sorted(summary.table_name(relid) for relid in largest[0]['relids']) == ['public.events', 'public.users']
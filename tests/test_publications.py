@@ -0,0 +1,55 @@
+'''Test publication table specs.'''
+import pytest
+
+from pglogicalmanager import Publications, UnsupportedFeature
+from pglogicalmanager.manager import _check_table_specs, _invalidate_catalogs, _table_spec
+
+from tests.fake import FakeServer
+
+
+class Conn:
+    dsn = 'postgres://localhost:5432/src'
+
+    def __init__(self, server_version):
+        self.server_version = server_version
+
+
+def test_row_filters_need_pg15():
+    specs = ['public.events', {'name': 'public.users', 'where': "region = 'us'"}]
+
+    with pytest.raises(UnsupportedFeature) as e:
+        _check_table_specs(Conn(140005), specs)
+
+    assert 'PostgreSQL 15' in str(e.value)
+
+    _check_table_specs(Conn(150002), specs)
+
+
+def test_plain_tables_any_version():
+    _check_table_specs(Conn(100012), ['public.events', {'name': 'public.users'}])
+
+
+def test_table_spec():
+    assert _table_spec('events') == '"events"'
+    assert _table_spec('public.events') == '"public"."events"'
+    assert _table_spec({'name': 'public.users', 'columns': ['id', 'email'], 'where': "region = 'us'"}) == \
+        '"public"."users" ("id", "email") WHERE (region = \'us\')'
+
+    # Quoted, whatever the name.
+    assert _table_spec({'name': 'Sales.Order"Lines', 'columns': ['Line No']}) == '"Sales"."Order""Lines" ("Line No")'
+
+
+def test_add_and_drop_tables():
+    server = FakeServer({'publications': [{'pubname': 'events_publication', 'puballtables': False}]}, server_version=150002)
+    conn = server.connect('postgres://localhost/src')
+    publication = Publications(conn).get('events_publication')
+
+    publication.add_tables(['public.events', {'name': 'public.users', 'columns': ['id'], 'where': 'active'}])
+    publication.drop_tables(['public.events'])
+
+    assert server.queries[-2:] == [
+        'ALTER PUBLICATION events_publication ADD TABLE "public"."events", "public"."users" ("id") WHERE (active)',
+        'ALTER PUBLICATION events_publication DROP TABLE "public"."events"',
+    ]
+
+    _invalidate_catalogs(conn)
@@ -0,0 +1,53 @@
+'''Test replica identity problems are found and ranked.'''
+from pglogicalmanager.manager import _identity_problems
+
+
+def table(relname, relreplident='d', has_primary_key=True, has_identity_index=False, indexes=1, total_size=8192, write_rate=0.0):
+    return {'schemaname': 'public', 'relname': relname, 'relreplident': relreplident, 'has_primary_key': has_primary_key,
+            'has_identity_index': has_identity_index, 'indexes': indexes, 'total_size': total_size, 'write_rate': write_rate}
+
+
+def test_problems():
+    src = [
+        table('users'),
+        table('events', has_primary_key=False, indexes=0, total_size=100),
+        table('logs', has_primary_key=False, indexes=0, total_size=1000),
+        table('audit', relreplident='f', has_primary_key=False, indexes=0, write_rate=10.0),
+        table('orders', relreplident='i', has_primary_key=False, has_identity_index=True, total_size=500),
+        table('items', total_size=50),
+    ]
+    dest = [
+        table('users'),
+        table('events', has_primary_key=False, indexes=0),
+        table('logs', has_primary_key=False, indexes=0),
+        table('audit', relreplident='f', has_primary_key=False, indexes=0),
+        table('orders', has_primary_key=False, indexes=0),
+    ]
+
+    problems = _identity_problems(src, dest, dest_version=150000)
+
+    # Errors first, largest first.
+    assert [(problem['table'], problem['side'], problem['severity']) for problem in problems] == [
+        ('public.logs', 'source', 'error'),
+        ('public.orders', 'destination', 'error'),
+        ('public.events', 'source', 'error'),
+        ('public.items', 'destination', 'error'), # Missing
+        ('public.audit', 'source', 'warning'),
+    ]
+
+
+def test_full_identity_with_index():
+    src = [table('audit', relreplident='f', has_primary_key=False)]
+    dest = [table('audit', relreplident='f', has_primary_key=False, indexes=1)]
+
+    # PostgreSQL 16+ uses the index to find rows.
+    assert _identity_problems(src, dest, dest_version=160000) == []
+    assert len(_identity_problems(src, dest, dest_version=150000)) == 1
+
+
+def test_scope():
+    src = [table('users', has_primary_key=False), table('events', has_primary_key=False)]
+
+    problems = _identity_problems(src, src, tables=['events'])
+
+    assert [problem['table'] for problem in problems] == ['public.events']
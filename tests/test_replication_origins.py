@@ -0,0 +1,22 @@
+'''Test replication origin progress.'''
+from pglogicalmanager import ReplicationOrigin
+
+
+def origin(remote_lsn, slot_lsn):
+    obj = ReplicationOrigin.from_row(None, {'roname': 'pg_16389', 'remote_lsn': remote_lsn, 'local_lsn': '0/3000000',
+                                            'subname': 'test_sub', 'subslotname': 'test_sub_slot'})
+    obj.slot_lsn = slot_lsn
+
+    return obj
+
+
+def test_divergence():
+    assert origin('0/16EDE8A0', '0/16EDE8A0').divergence() == 0
+    assert origin('1/0', '0/FFFFFF00').divergence() == 0x100
+    assert origin('0/100', '0/200').divergence() == -0x100
+
+
+def test_divergence_unknown():
+    assert origin(None, '0/200').divergence() is None
+    assert origin('0/100', None).divergence() is None
+    assert origin('0/100', None).to_list()[-1] == 'N/A'
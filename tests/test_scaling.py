@@ -0,0 +1,188 @@
+'''Test commands take the same number of round trips, and roughly linear time, at 10k objects.'''
+import json
+from time import perf_counter
+
+import psycopg2
+import pytest
+from click.testing import CliRunner
+
+from pglogicalmanager import Subscriptions, Tables, Columns, list_subscriptions, list_columns, main
+from pglogicalmanager.manager import _catalogs, _connect, _invalidate_catalogs
+
+from tests.fake import FakeCluster, FakeServer
+
+OBJECTS = 10000
+
+# Most queries each command may send to the (source, destination), however many objects there are.
+QUERY_BUDGETS = [
+    (['list-replication-slots'], (1, 0)),
+    (['list-subscriptions'], (1, 1)),
+    (['list-publications'], (1, 0)),
+    (['list-publication-tables', 'sub_0_publication'], (2, 0)),
+    (['list-replication-origins'], (1, 1)),
+    (['list-tables', '--source'], (1, 1)),
+    (['list-tables', '--destination'], (1, 1)),
+    (['list-columns', 'table_0', '--source'], (1, 1)),
+    (['check-replica-identity'], (1, 1)),
+    (['check-indexes'], (1, 1)),
+    (['subscription-stats', '--interval', '0'], (1, 5)),
+    (['analyze-hot-tables', '--interval', '0'], (3, 0)),
+    (['sync-progress', 'sub_0'], (3, 3)),
+    (['enable-subscription', 'sub_0'], (1, 2)),
+    (['disable-subscription', 'sub_0'], (1, 2)),
+    (['create-replication-slot', 'sub_0_slot'], (1, 0)),
+    (['drop-replication-slot', 'no_such_slot'], (1, 0)),
+    (['create-subscription', 'new_sub', '--wait-timeout', '0'], (6, 2)),
+    (['drop-subscription', 'sub_0'], (5, 2)),
+    (['alter-subscription', 'sub_0', '--binary'], (1, 2)),
+    (['add-subscription-tables', 'sub_1', 'table_2'], (2, 3)),
+    (['remove-subscription-tables', 'sub_1', 'table_1'], (2, 2)),
+    (['apply', '--file', 'topology.json', '--dry-run'], (1, 1)),
+    (['list-locks'], (3, 3)),
+    (['release-lock', 'subscription/sub_0'], (2, 2)),
+    # Reads only the files record-wal-usage writes.
+    (['forecast-wal-usage'], (0, 0)),
+]
+# Not budgeted here:
+# - record-wal-usage, record-replication-history, throttle-subscriptions and sync-standby-slots loop; their
+#   tests check the queries per sample.
+# - wait-for-subscription, copy-tables and recover-subscription poll until the servers change.
+# - list-standby-slots and sync-standby-slots need a standby, see test_failover.
+# - inspect-replication-slot streams over a replication connection.
+# - configure, reverse-configuration, show-replication-history, benchmark-pgoutput, version, start-agent and
+#   stop-agent don't query the servers, or only to write .env.
+# - reverse-subscription and rewind-replication-origin are interactive.
+
+
+@pytest.fixture
+def cluster(monkeypatch):
+    def make(subscriptions=0, tables=0, latency=0.0):
+        src = FakeServer.source(subscriptions=subscriptions, tables=tables, latency=latency)
+        dest = FakeServer.destination(subscriptions=subscriptions, tables=tables, latency=latency)
+        cluster = FakeCluster(src, dest)
+
+        if subscriptions > 1:
+            # sub_1 publishes a few tables, the rest all of them.
+            src.catalogs['publications'][1]['puballtables'] = False
+            src.catalogs['publication_tables'] = [{'pubname': 'sub_1_publication', 'table_name': f'public.table_{i}',
+                                                   'columns': None, 'row_filter': None} for i in range(2)]
+
+        for server in (src, dest):
+            server.results["to_regclass('pglogicalmanager.locks')"] = [{'exists': True}]
+
+        dest.results['SHOW max_sync_workers_per_subscription'] = [{'max_sync_workers_per_subscription': '2'}]
+
+        monkeypatch.setattr(psycopg2, 'connect', cluster.connect)
+        monkeypatch.setenv('SOURCE_DB_DSN', cluster.src_dsn)
+        monkeypatch.setenv('DEST_DB_DSN', cluster.dest_dsn)
+
+        return cluster
+
+    yield make
+
+    for conn in [conn for conn in _catalogs if hasattr(conn, 'server')]:
+        _invalidate_catalogs(conn)
+
+
+def queries(cluster):
+    return {dsn: len(server.queries) for dsn, server in cluster.servers.items()}
+
+
+def test_subscriptions_at_scale(cluster):
+    fake = cluster(subscriptions=OBJECTS)
+    src = _connect(fake.src_dsn, ['replication_slots', 'publications', 'wal_lsn'])
+    dest = _connect(fake.dest_dsn, ['subscriptions'])
+
+    started = perf_counter()
+    subscriptions = Subscriptions(src, dest)
+    subscriptions.refresh()
+    lags = [subscription.replication_lag() for subscription in subscriptions.subscriptions]
+    elapsed = perf_counter() - started
+
+    assert lags == [0x800] * OBJECTS
+    assert subscriptions.get(f'sub_{OBJECTS - 1}').slot.name == f'sub_{OBJECTS - 1}_slot'
+    # Prefetched with the privilege check, nothing else.
+    assert queries(fake) == {fake.src_dsn: 1, fake.dest_dsn: 1}
+    # Scanning every catalog per subscription takes minutes at this size.
+    assert elapsed < 5.0
+
+
+def test_tables_and_columns_at_scale(cluster):
+    fake = cluster(tables=OBJECTS)
+    src = _connect(fake.src_dsn, ['tables', 'columns'])
+
+    started = perf_counter()
+    columns = [Columns(src, Tables(src).get(f'table_{i}')) for i in range(OBJECTS)]
+
+    for table_columns in columns:
+        table_columns.refresh()
+
+    elapsed = perf_counter() - started
+
+    assert [column.name for column in columns[-1].columns] == [f'column_{j}' for j in range(5)]
+    assert queries(fake)[fake.src_dsn] == 1
+    assert elapsed < 5.0
+
+
+@pytest.mark.parametrize('command, args', [(list_subscriptions, []), (list_columns, ['table_0', '--source'])])
+def test_round_trips_do_not_grow(cluster, command, args):
+    counts = []
+
+    for objects in (10, OBJECTS):
+        fake = cluster(subscriptions=objects, tables=objects)
+        result = CliRunner().invoke(command, args)
+
+        assert result.exit_code == 0, result.output
+        counts.append(queries(fake))
+
+    assert counts[0] == counts[1] == {fake.src_dsn: 1, fake.dest_dsn: 1}
+
+
+@pytest.mark.parametrize('args, budget', QUERY_BUDGETS, ids=[args[0] for args, _ in QUERY_BUDGETS])
+def test_query_budget(cluster, tmp_path, monkeypatch, args, budget):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'topology.json').write_text(json.dumps({'subscriptions': [{'name': 'sub_0'}, {'name': 'new_sub', 'tables': ['table_0']}]}))
+    counts = []
+
+    for objects in (10, OBJECTS // 5):
+        fake = cluster(subscriptions=objects, tables=objects)
+        result = CliRunner().invoke(main, args)
+
+        assert result.exit_code == 0, result.output
+        counts.append((len(fake.servers[fake.src_dsn].queries), len(fake.servers[fake.dest_dsn].queries)))
+
+        for conn in [conn for conn in _catalogs if hasattr(conn, 'server')]:
+            _invalidate_catalogs(conn)
+
+    assert counts[0] == counts[1]
+    assert all(count <= limit for count, limit in zip(counts[1], budget)), counts[1]
+
+
+def test_stats(cluster):
+    fake = cluster(subscriptions=OBJECTS)
+    result = CliRunner().invoke(main, ['--stats', 'subscription-stats', '--interval', '0'])
+
+    assert result.exit_code == 0, result.output
+
+    rows = [line.split('|')[1:3] for line in result.output.splitlines() if line.startswith('|')]
+
+    assert [(name.strip(), int(count)) for name, count in rows[1:]] == [
+        ('Source', len(fake.servers[fake.src_dsn].queries)),
+        ('Destination', len(fake.servers[fake.dest_dsn].queries)),
+        ('Total', sum(queries(fake).values())),
+    ]
+
+
+def test_latency(cluster):
+    '''With 20ms round trips, listing 10k subscriptions costs a handful of them, not 10k.'''
+    fake = cluster(subscriptions=OBJECTS, latency=0.02)
+
+    started = perf_counter()
+    result = CliRunner().invoke(list_subscriptions)
+    elapsed = perf_counter() - started
+
+    assert result.exit_code == 0, result.output
+    assert 'sub_9999_slot' in result.output
+    # A query per subscription would take 200 seconds.
+    assert elapsed < 10.0
+    assert sum(server.connections for server in fake.servers.values()) == 2
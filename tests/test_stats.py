@@ -0,0 +1,75 @@
+'''Test apply rate computation between two samples.'''
+import pytest
+
+from pglogicalmanager.manager import SubscriptionStats, _apply_rates, _subscription_sample
+
+from tests.fake import FakeServer
+
+
+def table_sample(relid, relname, ins, upd, dele):
+    return {'relid': relid, 'schemaname': 'public', 'relname': relname, 'subnames': 'test_sub',
+            'n_tup_ins': ins, 'n_tup_upd': upd, 'n_tup_del': dele}
+
+
+def subscription_sample(received_bytes, apply_errors=None):
+    sample = _subscription_sample('test_sub')
+    sample['received_bytes'] = received_bytes
+    sample['apply_errors'] = apply_errors
+    return sample
+
+
+def test_table_rates():
+    before = {'time': 0.0, 'subscriptions': {}, 'tables': {
+        1: table_sample(1, 'hot', 0, 0, 0),
+        2: table_sample(2, 'cold', 0, 0, 0),
+    }}
+    after = {'time': 10.0, 'subscriptions': {}, 'tables': {
+        1: table_sample(1, 'hot', 600, 200, 100),
+        2: table_sample(2, 'cold', 100, 0, 0),
+        3: table_sample(3, 'new', 50, 0, 0), # Created between samples
+    }}
+
+    _, tables, elapsed = _apply_rates(before, after)
+
+    assert elapsed == 10.0
+    assert [table['relname'] for table in tables] == ['hot', 'cold']
+    assert tables[0]['ins_rate'] == 60.0
+    assert tables[0]['rows_rate'] == 90.0
+    assert tables[0]['share'] == pytest.approx(0.9)
+    assert tables[1]['share'] == pytest.approx(0.1)
+
+
+def test_subscription_rates():
+    before = {'time': 0.0, 'tables': {}, 'subscriptions': {
+        'test_sub': subscription_sample(1000, apply_errors=2),
+    }}
+    after = {'time': 2.0, 'tables': {}, 'subscriptions': {
+        'test_sub': subscription_sample(5000, apply_errors=3),
+    }}
+
+    subscriptions, _, _ = _apply_rates(before, after)
+
+    assert subscriptions[0]['received_rate'] == 2000.0
+    assert subscriptions[0]['apply_errors'] == 1
+    assert subscriptions[0]['conflicts'] is None # Not available before PG 18
+
+
+def worker(pid, relid=None, leader_pid=None, received_bytes=None):
+    return {'subname': 'test_sub', 'pid': pid, 'relid': relid, 'leader_pid': leader_pid, 'wait_event_type': None,
+            'wait_event': None, 'received_bytes': received_bytes, 'stats': {'apply_error_count': 0}}
+
+
+def test_sample_parallel_apply():
+    '''PG 16+ parallel apply workers have no relid, like the leader, but received nothing themselves.'''
+    server = FakeServer(server_version=160000)
+    server.results['FROM pg_stat_subscription s'] = [
+        worker(100, received_bytes=4096),
+        worker(101, leader_pid=100),
+        worker(102, relid=16384),
+        worker(103, leader_pid=100),
+    ]
+
+    sample = SubscriptionStats(server.connect('dest')).sample()['subscriptions']['test_sub']
+
+    assert 's.leader_pid' in server.queries[0]
+    assert (sample['pid'], sample['received_bytes'], sample['sync_workers']) == (100, 4096, 1)
@@ -1,10 +1,17 @@
 '''Test subscription management.'''
+import psycopg2
 import pytest
 import click
 from click.testing import CliRunner
 
 # Target
 from pglogicalmanager import list_subscriptions, create_subscription, drop_subscription, create_replication_slot, list_replication_slots, _ensure_connected
+from pglogicalmanager import UnsupportedFeature
+from pglogicalmanager import Subscription, Subscriptions
+from pglogicalmanager.wait import WaitTimeout
+from pglogicalmanager.manager import SUBSCRIPTION_CATALOGS, _catalogs, _connect, _invalidate_catalogs, _subscription_options
+
+from tests.fake import FakeCluster, FakeServer
 
 def test_list_subscriptions():
     runner = CliRunner()
@@ -54,3 +61,119 @@ def test_create_subscription_with_replication_slot():
     result = runner.invoke(list_subscriptions)
 
     assert 'No subscriptions found' in result.output
+
+
+class Conn:
+    def __init__(self, server_version):
+        self.dsn = f'postgres://localhost:5432/pg{server_version // 10000}'
+        self.server_version = server_version
+
+
+def test_subscription_options():
+    pg16 = Conn(160001)
+
+    assert _subscription_options(pg16, pg16) == []
+    assert _subscription_options(pg16, pg16, streaming='auto', binary=True, disable_on_error=False) == \
+        ['streaming = parallel', 'binary = true', 'disable_on_error = false']
+    # Parallel apply is up to the subscriber, streaming needs both.
+    assert _subscription_options(Conn(140005), pg16, streaming='auto') == ['streaming = parallel']
+    assert _subscription_options(pg16, Conn(150002), streaming='auto') == ['streaming = on']
+    assert _subscription_options(Conn(130010), pg16, streaming='auto') == []
+
+    # So is disable_on_error.
+    assert _subscription_options(Conn(140005), Conn(150002), disable_on_error=True) == ['disable_on_error = true']
+
+
+def test_subscription_options_unsupported():
+    with pytest.raises(UnsupportedFeature) as e:
+        _subscription_options(Conn(160001), Conn(150002), streaming='parallel')
+
+    assert e.value.dsn.endswith('pg15')
+    assert e.value.minimum_version == 16
+
+    with pytest.raises(UnsupportedFeature):
+        _subscription_options(Conn(140005), Conn(140005), disable_on_error=True)
+
+
+def test_drop_waits_for_slot(monkeypatch):
+    cluster = FakeCluster(FakeServer.source(subscriptions=1), FakeServer.destination(subscriptions=1))
+    monkeypatch.setattr(psycopg2, 'connect', cluster.connect)
+    src = _connect(cluster.src_dsn, SUBSCRIPTION_CATALOGS['src'])
+    dest = _connect(cluster.dest_dsn, SUBSCRIPTION_CATALOGS['dest'])
+    src_queries = cluster.servers[cluster.src_dsn].queries
+
+    Subscriptions(src, dest).get('sub_0').drop()
+
+    # The walsender is gone before the slot is dropped.
+    released = src_queries.index("SELECT active FROM pg_replication_slots WHERE slot_name = 'sub_0_slot'")
+    assert released < src_queries.index("SELECT pg_drop_replication_slot('sub_0_slot')")
+
+    for conn in (src, dest):
+        _invalidate_catalogs(conn)
+
+
+def test_create_existing_disabled(monkeypatch):
+    cluster = FakeCluster(FakeServer.source(subscriptions=1), FakeServer.destination(subscriptions=1))
+    cluster.servers[cluster.dest_dsn].catalogs['subscriptions'][0]['subenabled'] = False
+    monkeypatch.setattr(psycopg2, 'connect', cluster.connect)
+    monkeypatch.setenv('SOURCE_DB_DSN', cluster.src_dsn)
+    monkeypatch.setenv('DEST_DB_DSN', cluster.dest_dsn)
+
+    result = CliRunner().invoke(create_subscription, ['sub_0'])
+
+    # Left disabled, so it won't start streaming: no point waiting.
+    assert result.exit_code == 0, result.output
+    assert 'already exists and is disabled' in result.output
+    assert not any('pg_replication_slots WHERE slot_name' in query for query in cluster.servers[cluster.src_dsn].queries)
+
+    for conn in [conn for conn in _catalogs if hasattr(conn, 'server')]:
+        _invalidate_catalogs(conn)
+
+
+def test_reverse_reads_lag_after_prompt(monkeypatch):
+    cluster = FakeCluster(FakeServer.source(subscriptions=1), FakeServer.destination(subscriptions=1))
+    src_server = cluster.servers[cluster.src_dsn]
+    monkeypatch.setattr(psycopg2, 'connect', cluster.connect)
+    # Prefetched like reverse-subscription does.
+    src = _connect(cluster.src_dsn, ['replication_slots', 'publications', 'wal_lsn'])
+    dest = _connect(cluster.dest_dsn, ['subscriptions'])
+    subscription = Subscriptions(src, dest).get('sub_0')
+    prompts = []
+
+    def answer(prompt):
+        # Writes land while the operator reads the prompt.
+        src_server.catalogs['wal_lsn'] = [{'pg_current_wal_lsn': '0/9000'}]
+        prompts.append(prompt)
+        return 'Y' if len(prompts) == 1 else 'n'
+
+    monkeypatch.setattr('builtins.input', answer)
+    subscription.reverse()
+
+    assert 'Replication lag is 32768' in prompts[1]
+    assert not any(query.startswith('DROP SUBSCRIPTION') for query in cluster.servers[cluster.dest_dsn].queries)
+
+    for conn in (src, dest):
+        _invalidate_catalogs(conn)
+
+
+def test_drop_slot_not_released(monkeypatch):
+    cluster = FakeCluster(FakeServer.source(subscriptions=1), FakeServer.destination(subscriptions=1))
+    monkeypatch.setattr(psycopg2, 'connect', cluster.connect)
+    monkeypatch.setenv('SOURCE_DB_DSN', cluster.src_dsn)
+    monkeypatch.setenv('DEST_DB_DSN', cluster.dest_dsn)
+
+    def stuck(self, timeout=60.0):
+        raise WaitTimeout('replication slot sub_0_slot to be released', timeout, True)
+
+    monkeypatch.setattr(Subscription, 'wait_until_released', stuck)
+    result = CliRunner().invoke(drop_subscription, ['sub_0'])
+
+    # No traceback, and what's left is named.
+    assert result.exit_code == 1
+    assert result.exception is None or isinstance(result.exception, SystemExit)
+    assert 'replication slot sub_0_slot and publication sub_0_publication are left on the source' in result.output
+    assert 'drop-replication-slot sub_0_slot' in result.output
+    assert not any('pg_drop_replication_slot' in query for query in cluster.servers[cluster.src_dsn].queries)
+
+    for conn in [conn for conn in _catalogs if hasattr(conn, 'server')]:
+        _invalidate_catalogs(conn)
@@ -0,0 +1,52 @@
+'''Test initial sync progress, throughput and ETA between two samples.'''
+import pytest
+
+from pglogicalmanager.manager import _sync_progress, _format_eta
+
+
+def table(name, state, bytes_processed=None, size=1000, pid=None):
+    return {'table_name': name, 'srsubstate': state, 'pid': pid, 'bytes_processed': bytes_processed,
+            'tuples_processed': None, 'size': size, 'max_sync_workers': 2}
+
+
+def sample(time, *tables):
+    return {'time': time, 'max_sync_workers': 2, 'tables': {table['table_name']: table for table in tables}}
+
+
+def test_progress():
+    before = sample(0.0, table('public.users', 'd', 0, pid=1), table('public.events', 'd', 100, size=10000, pid=2),
+                    table('public.items', 'r'), table('public.orders', 'i'))
+    after = sample(10.0, table('public.users', 'd', 500, pid=1), table('public.events', 'd', 2100, size=10000, pid=2),
+                   table('public.items', 'r'), table('public.orders', 'i'))
+
+    tables, totals = _sync_progress(before, after)
+
+    # Most left to copy first, ready tables last.
+    assert [table['table_name'] for table in tables] == ['public.events', 'public.orders', 'public.users', 'public.items']
+
+    events = tables[0]
+    assert events['rate'] == 200.0
+    assert events['progress'] == pytest.approx(0.21)
+    assert events['eta'] == pytest.approx(7900 / 200)
+
+    # Not started yet, so no rate or ETA.
+    assert tables[1]['rate'] is None and tables[1]['eta'] is None
+
+    assert totals['ready'] == 1
+    assert totals['rate'] == 250.0
+    assert totals['eta'] == pytest.approx((7900 + 500 + 1000) / 250)
+
+
+def test_done():
+    before = sample(0.0, table('public.users', 'r'))
+    after = sample(5.0, table('public.users', 'r'))
+
+    _, totals = _sync_progress(before, after)
+
+    assert totals['progress'] == 1.0
+    assert totals['eta'] == 0.0
+
+
+def test_format_eta():
+    assert _format_eta(3725.5) == '1:02:05'
+    assert _format_eta(None) == 'N/A'
@@ -0,0 +1,138 @@
+'''Test the copy rate limit, schedules and load limits.'''
+from datetime import datetime
+
+import psycopg2
+import pytest
+from click.testing import CliRunner
+
+from pglogicalmanager import Subscriptions, copy_tables, throttle_subscriptions, _ensure_connected
+from pglogicalmanager.manager import SUBSCRIPTION_CATALOGS, _catalogs, _invalidate_catalogs, _source_load
+from pglogicalmanager.throttle import TokenBucket, decide, in_windows, over_limits, parse_window
+
+from tests.fake import FakeCluster, FakeServer
+from tests.test_wait import Clock
+
+
+def test_token_bucket():
+    clock = Clock()
+    bucket = TokenBucket(rate=100, capacity=1000, clock=clock, sleep=clock.sleep)
+
+    # A full bucket goes right away.
+    assert bucket.take(600) == 0
+    assert bucket.take(400) == 0
+    # Then at rate.
+    assert bucket.take(200) == 2.0
+    # More than capacity waits for a full bucket, and leaves it in debt.
+    assert bucket.take(5000) == 10.0
+    assert bucket.delay(100) == 41.0
+
+
+def test_windows():
+    nights = parse_window('Mon-Fri 20:00-06:00')
+    monday = datetime(2024, 1, 1)
+
+    assert monday.replace(hour=21) in nights
+    assert monday.replace(hour=12) not in nights
+    # Monday morning is Sunday night.
+    assert monday.replace(hour=3) not in nights
+    # Saturday morning is Friday night.
+    assert datetime(2024, 1, 6, 3) in nights
+    assert datetime(2024, 1, 6, 21) not in nights
+
+    weekend = parse_window('Sat,Sun')
+
+    assert datetime(2024, 1, 7, 12) in weekend
+    assert in_windows([nights, weekend], datetime(2024, 1, 7, 12))
+    assert in_windows([], monday)
+
+    assert datetime(2024, 1, 3, 23) in parse_window('22:00-05:00')
+
+    with pytest.raises(ValueError):
+        parse_window('nightly')
+
+
+def test_decide():
+    limits = {'active_sessions': 10, 'read_rate': None, 'wal_rate': 1000}
+
+    assert decide(True, True, {'active_sessions': 5, 'wal_rate': 900}, limits) == (True, None)
+    assert decide(True, False, {'active_sessions': 5}, limits) == (False, 'outside schedule')
+    assert decide(True, True, {'active_sessions': 12, 'wal_rate': 900}, limits) == (False, 'source load: active_sessions')
+    # Disabled ones resume only well below the limits.
+    assert decide(False, True, {'active_sessions': 9, 'wal_rate': 100}, limits)[0] is False
+    assert decide(False, True, {'active_sessions': 7, 'wal_rate': None}, limits) == (True, None)
+
+    assert over_limits({'wal_rate': 2000}, {'wal_rate': None}) == []
+
+
+def test_source_load():
+    before = {'sampled_at': 100.0, 'active_sessions': 3.0, 'read_bytes': 0.0, 'wal_bytes': 1000.0}
+    after = {'sampled_at': 110.0, 'active_sessions': 5.0, 'read_bytes': 8192.0, 'wal_bytes': 11000.0}
+
+    assert _source_load(None, after) == {'active_sessions': 5.0, 'read_rate': None, 'wal_rate': None}
+    assert _source_load(before, after) == {'active_sessions': 5.0, 'read_rate': 819.2, 'wal_rate': 1000.0}
+
+
+@pytest.fixture
+def cluster(monkeypatch):
+    src, dest = FakeServer.source(subscriptions=1), FakeServer.destination(subscriptions=1)
+    src.catalogs['publications'][0]['puballtables'] = False
+    src.catalogs['replica_identity'] = [
+        {'schemaname': 'public', 'relname': 'sessions', 'relpersistence': 'u', 'total_size': 8192},
+        {'schemaname': 'public', 'relname': 'scratch', 'relpersistence': 't', 'total_size': 8192},
+    ]
+    src.results['AS active_sessions'] = [{'sampled_at': 1.0, 'active_sessions': 0, 'read_bytes': 0, 'wal_bytes': 0}]
+    cluster = FakeCluster(src, dest)
+    monkeypatch.setattr(psycopg2, 'connect', cluster.connect)
+    monkeypatch.setenv('SOURCE_DB_DSN', cluster.src_dsn)
+    monkeypatch.setenv('DEST_DB_DSN', cluster.dest_dsn)
+
+    yield cluster
+
+    for conn in [conn for conn in _catalogs if hasattr(conn, 'server')]:
+        _invalidate_catalogs(conn)
+
+
+def test_copy_tables_skips_unlogged(cluster):
+    result = CliRunner().invoke(copy_tables, ['sub_0', '--rate', '10MB'])
+
+    assert result.exit_code == 0, result.output
+    assert 'Added 0 table(s)' in result.output
+
+    result = CliRunner().invoke(copy_tables, ['sub_0', 'sessions', '--rate', '10MB'])
+
+    assert result.exit_code == 1
+    assert "can't be published: public.sessions" in result.output
+    assert not any('ALTER PUBLICATION' in query for query in cluster.servers[cluster.src_dsn].queries)
+
+
+def test_throttle_enables_only_what_it_disabled(cluster):
+    src, dest = cluster.servers[cluster.src_dsn], cluster.servers[cluster.dest_dsn]
+    dest.catalogs['subscriptions'].append(dict(dest.catalogs['subscriptions'][0], subname='by_hand', subenabled=False))
+    samples = []
+
+    def load(query):
+        # Busy, then quiet once sub_0 is disabled.
+        if samples:
+            dest.catalogs['subscriptions'][0]['subenabled'] = False
+        samples.append(query)
+        return [{'sampled_at': len(samples), 'active_sessions': 100 if len(samples) == 1 else 0, 'read_bytes': 0, 'wal_bytes': 0}]
+
+    src.results['AS active_sessions'] = load
+    result = CliRunner().invoke(throttle_subscriptions, ['--max-active-sessions', '10', '--interval', '0', '--count', '2'])
+
+    assert result.exit_code == 0, result.output
+    assert [query for query in dest.queries if query.startswith('ALTER SUBSCRIPTION')] == [
+        'ALTER SUBSCRIPTION sub_0 DISABLE',
+        'ALTER SUBSCRIPTION sub_0 ENABLE',
+    ]
+
+
+def test_unsynced_tables_named_like_catalogs(cluster):
+    '''regclass::text quotes mixed-case names and drops schemas on the search_path, so they never matched the catalogs.'''
+    src, dest = _ensure_connected(prefetch=SUBSCRIPTION_CATALOGS)
+    dest_server = cluster.servers[cluster.dest_dsn]
+    dest_server.results['FROM pg_subscription_rel r'] = [{'table_name': 'Sales.Order Lines', 'srsubstate': 'd'}]
+
+    assert Subscriptions(src, dest).get('sub_0').unsynced_tables()[0]['table_name'] == 'Sales.Order Lines'
+    assert 'regclass' not in dest_server.queries[-1]
+    assert "n.nspname || '.' || c.relname AS table_name" in dest_server.queries[-1]
@@ -0,0 +1,158 @@
+'''Test topology plans: what changes, in which stage, and nothing when up to date.'''
+import pytest
+
+from pglogicalmanager.topology import TopologyError, load, plan, validate
+
+
+def subscription_row(name, enabled=True, slot=None, publications=None, substream=False, subbinary=False):
+    return {'subname': name, 'subenabled': enabled, 'subslotname': slot or f'{name}_slot',
+            'subpublications': publications or [f'{name}_publication'], 'substream': substream, 'subbinary': subbinary}
+
+
+def live(subscriptions=(), slots=(), publications=None, publication_tables=None, table_specs=None, version=150000):
+    return {
+        'slots': set(slots),
+        'publications': publications or {},
+        'publication_tables': publication_tables or {},
+        'table_specs': table_specs or {},
+        'subscriptions': {row['subname']: row for row in subscriptions},
+        'src_version': version,
+        'dest_version': version,
+    }
+
+
+TOPOLOGY = validate({'subscriptions': [
+    {'name': 'orders', 'tables': ['orders', 'public.items'], 'copy_data': True, 'streaming': 'auto'},
+    {'name': 'rest'},
+]})
+
+
+def kinds(changes):
+    return [(change.stage, change.server, change.kind, change.name) for change in changes]
+
+
+def test_from_scratch():
+    changes, conflicts = plan(TOPOLOGY, live())
+
+    assert conflicts == []
+    assert kinds(changes) == [
+        (0, 'src', 'create_slot', 'orders_slot'),
+        (0, 'src', 'create_publication', 'orders_publication'),
+        (1, 'dest', 'create_subscription', 'orders'),
+        (0, 'src', 'create_slot', 'rest_slot'),
+        (0, 'src', 'create_publication', 'rest_publication'),
+        (1, 'dest', 'create_subscription', 'rest'),
+    ]
+
+
+def up_to_date():
+    return live(
+        subscriptions=[subscription_row('orders', substream='t'), subscription_row('rest')],
+        slots=['orders_slot', 'rest_slot'],
+        publications={'orders_publication': False, 'rest_publication': True},
+        publication_tables={'orders_publication': {'public.orders', 'public.items'}},
+    )
+
+
+def test_up_to_date():
+    state = up_to_date()
+    state['subscriptions']['orders']['substream'] = True # PG 15 reports a boolean
+
+    assert plan(TOPOLOGY, state) == ([], [])
+
+
+def test_changes():
+    state = up_to_date()
+    state['subscriptions']['rest']['subenabled'] = False
+    state['subscriptions']['orders']['substream'] = 'f'
+    state['publication_tables']['orders_publication'] = {'public.orders', 'public.users'}
+
+    changes, _ = plan(TOPOLOGY, state)
+
+    assert kinds(changes) == [
+        (0, 'src', 'add_tables', 'orders_publication'),
+        (0, 'src', 'drop_tables', 'orders_publication'),
+        (1, 'dest', 'refresh_publication', 'orders'),
+        (1, 'dest', 'alter_subscription', 'orders'),
+        (1, 'dest', 'enable_subscription', 'rest'),
+    ]
+    assert changes[0].args == (['public.items'],)
+    assert changes[1].args == (['public.users'],)
+    assert changes[3].args == ({'streaming': 'on'},)
+
+
+def test_prune():
+    state = up_to_date()
+    state['subscriptions']['old'] = subscription_row('old')
+    state['slots'].add('old_slot')
+    state['publications']['old_publication'] = True
+
+    changes, _ = plan(dict(TOPOLOGY, prune=True), state)
+
+    assert kinds(changes) == [
+        (0, 'dest', 'drop_subscription', 'old'),
+        (1, 'src', 'drop_slot', 'old_slot'),
+        (1, 'src', 'drop_publication', 'old_publication'),
+    ]
+
+    # Without prune, unknown subscriptions are left alone.
+    assert plan(TOPOLOGY, state) == ([], [])
+
+
+def test_conflicts():
+    state = up_to_date()
+    state['publications']['rest_publication'] = False
+    state['subscriptions']['orders']['subslotname'] = 'other_slot'
+
+    _, conflicts = plan(TOPOLOGY, state)
+
+    assert len(conflicts) == 2
+
+
+def test_column_lists_and_row_filters():
+    topology = validate({'subscriptions': [{'name': 'orders', 'tables': [
+        {'name': 'orders', 'columns': ['id', 'region'], 'where': "region = 'us'"}, 'public.items']}]})
+    state = live(
+        subscriptions=[subscription_row('orders')],
+        slots=['orders_slot'],
+        publications={'orders_publication': False},
+        publication_tables={'orders_publication': {'public.orders', 'public.items'}},
+        # As Postgres deparses them.
+        table_specs={('orders_publication', 'public.orders'): {'columns': ['region', 'id'], 'where': "(region = 'us'::text)"},
+                     ('orders_publication', 'public.items'): {'columns': None, 'where': None}},
+    )
+
+    assert plan(topology, state) == ([], [])
+
+    state['table_specs'][('orders_publication', 'public.orders')] = {'columns': ['id'], 'where': "(region = 'eu'::text)"}
+    state['table_specs'][('orders_publication', 'public.items')]['where'] = '(id > 10)'
+
+    changes, conflicts = plan(topology, state)
+
+    assert changes == []
+    assert conflicts == [
+        "Table public.orders in publication orders_publication has columns id, not id, region and row filter (region = 'eu'::text), "
+        "not region = 'us'. Remove it from the topology, apply, then add it back to copy it again.",
+        'Table public.items in publication orders_publication has row filter (id > 10), not none. '
+        'Remove it from the topology, apply, then add it back to copy it again.',
+    ]
+
+
+def test_validate():
+    with pytest.raises(TopologyError):
+        validate({'subscriptions': [{'name': 'orders', 'table': ['orders']}]})
+
+    with pytest.raises(TopologyError):
+        validate({'subscriptions': [{'name': 'orders'}, {'name': 'orders'}]})
+
+
+def test_load_yaml(tmp_path):
+    pytest.importorskip('yaml')
+
+    path = tmp_path / 'topology.yaml'
+    path.write_text('subscriptions:\n  - name: orders\n    tables: [orders]\n    enabled: false\n')
+
+    topology = load(str(path))
+
+    assert topology['subscriptions'][0]['replication_slot'] == 'orders_slot'
+    assert topology['subscriptions'][0]['enabled'] is False
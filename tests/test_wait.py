@@ -0,0 +1,54 @@
+'''Test waiting for conditions with backoff and deadlines.'''
+import pytest
+
+from pglogicalmanager.wait import WaitTimeout, backoff, wait_for
+
+
+class Clock:
+    '''Fake time, advanced by sleep.'''
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_backoff():
+    intervals = backoff(initial=0.1, maximum=1.0)
+
+    assert [round(next(intervals), 2) for _ in range(6)] == [0.1, 0.2, 0.4, 0.8, 1.0, 1.0]
+
+
+def test_returns_as_soon_as_condition_holds():
+    clock = Clock()
+    values = iter([None, 0, 'ready'])
+
+    assert wait_for(lambda: next(values), 'ready', clock=clock, sleep=clock.sleep) == 'ready'
+    assert clock.sleeps == [0.05, 0.1]
+
+
+def test_progress():
+    clock = Clock()
+    values = iter([0, 0, 1])
+    progress = []
+
+    wait_for(lambda: next(values), 'one', progress=lambda value, elapsed: progress.append(elapsed), clock=clock, sleep=clock.sleep)
+
+    assert progress == [0.0, 0.05]
+
+
+def test_timeout():
+    clock = Clock()
+
+    with pytest.raises(WaitTimeout) as e:
+        wait_for(lambda: False, 'never', timeout=1.0, clock=clock, sleep=clock.sleep)
+
+    # Last check happens right at the deadline.
+    assert clock.now == pytest.approx(1.0)
+    assert str(e.value) == 'Timed out after 1.0 seconds waiting for never.'
@@ -0,0 +1,126 @@
+'''Test WAL usage samples are kept in a bounded ring and projected against a budget.'''
+import psycopg2
+import pytest
+
+from pglogicalmanager.manager import WalUsage, _connect, _invalidate_catalogs
+from pglogicalmanager.wal_usage import HEADER, SAMPLE, WalSamples, forecast, parse_size
+
+from tests.fake import FakeServer
+
+GB = 1024 ** 3
+
+
+def test_parse_size():
+    assert parse_size('512') == 512
+    assert parse_size('512MB') == 512 * 1024 ** 2
+    assert parse_size('1.5 gb') == 1.5 * GB
+
+    with pytest.raises(ValueError):
+        parse_size('lots')
+
+
+def test_ring(tmp_path):
+    samples = WalSamples.for_slot(str(tmp_path), 'test_slot', capacity=100)
+
+    assert samples.samples() == []
+
+    for i in range(250):
+        samples.append(1000.0 + i, i, i, i)
+
+    records = samples.samples()
+
+    # Only the last 100, oldest first, in constant space.
+    assert [record[0] for record in records] == [1150.0 + i for i in range(100)]
+    assert (tmp_path / 'test_slot.wal').stat().st_size == HEADER.size + 100 * SAMPLE.size
+
+
+def test_restart_lsn_backwards(tmp_path):
+    samples = WalSamples.for_slot(str(tmp_path), 'test_slot', capacity=100)
+
+    for i in range(3):
+        samples.append(1000.0 + i, 2000 + i, 1000 + i, 1500 + i)
+
+    # Restored from a backup: earlier samples are another history.
+    samples.append(1003.0, 800, 500, 600)
+
+    assert samples.samples() == [(1003.0, 800, 500, 600)]
+
+
+def test_forecast():
+    # 1 MB/s of WAL, applied at 0.5 MB/s, 1 GB retained after an hour.
+    samples = [(3600.0 * i, 10 * GB + i * 3600 * 2 ** 20, 10 * GB - (GB - i * 1800 * 2 ** 20),
+                10 * GB - (GB - i * 1800 * 2 ** 20)) for i in range(2)]
+    result = forecast(samples, budget=3 * GB)
+
+    assert result['wal_rate'] == 2 ** 20
+    assert result['apply_rate'] == 2 ** 19
+    assert result['retained'] == GB + 1800 * 2 ** 20
+    # 1.25 GB to go at 0.5 MB/s.
+    assert result['seconds'] == (3 * GB - result['retained']) / 2 ** 19
+
+    assert forecast(samples, budget=GB)['seconds'] == 0.0
+
+
+def test_forecast_not_growing():
+    samples = [(0.0, 1000, 500, 500), (60.0, 2000, 1500, 1500)]
+
+    assert forecast(samples, budget=GB)['seconds'] is None
+    assert forecast(samples[:1], budget=GB)['wal_rate'] is None
+    # Inactive slot that never confirmed anything only grows.
+    assert forecast([(0.0, 1000, 500, 0), (60.0, 2000, 500, 0)], budget=GB)['growth'] == 1000 / 60
+
+
+def test_forecast_restart_lsn():
+    # Applied as fast as written, but restart_lsn hasn't moved: it's the retained WAL that grows.
+    samples = [(0.0, 1000, 500, 1000), (60.0, 7000, 500, 7000)]
+    result = forecast(samples, budget=GB)
+
+    assert result['apply_rate'] == result['wal_rate'] == 100
+    assert result['growth'] == 100
+    assert result['seconds'] == (GB - 6500) / 100
+
+    # And once it moves, retained WAL shrinks even while the subscriber falls behind.
+    result = forecast([(0.0, 1000, 100, 900), (60.0, 7000, 6600, 6700)], budget=GB)
+
+    assert result['growth'] == -500 / 60
+    assert result['seconds'] is None
+
+
+def test_window():
+    samples = [(0.0, 0, 0, 0), (3000.0, 3000, 0, 0), (3600.0, 9000, 0, 0)]
+
+    assert forecast(samples, budget=GB)['wal_rate'] == 2.5
+    assert forecast(samples, budget=GB, window=600)['wal_rate'] == 10.0
+
+
+def test_record(tmp_path, monkeypatch):
+    server = FakeServer.source(subscriptions=3)
+    monkeypatch.setattr(psycopg2, 'connect', server.connect)
+    src = _connect('postgres://localhost/src')
+
+    for i, slot in enumerate(server.catalogs['replication_slots']):
+        slot['restart_lsn'] = f'0/{(i + 1) * 0x100:X}'
+
+    usage = WalUsage(str(tmp_path), src=src)
+
+    for _ in range(2):
+        usage.record()
+
+    # One query per sample, whatever the number of slots.
+    assert len(server.queries) == 3
+
+    usage.refresh(budget=GB)
+
+    assert [forecast['slot'] for forecast in usage.forecasts] == ['sub_0_slot', 'sub_1_slot', 'sub_2_slot']
+    assert usage.forecasts[0]['retained'] == 0x1700
+    assert usage.forecasts[0]['lag'] == 0x800
+
+    # Dropped slots are forgotten.
+    del server.catalogs['replication_slots'][2]
+    usage.record()
+    usage.refresh(budget=GB)
+
+    assert len(usage.forecasts) == 2
+    assert usage.alerts(0) == []
+
+    _invalidate_catalogs(src)